@@ -17,9 +17,14 @@ setup(name='bloom',
          'bin/git-bloom-config',
          'bin/git-bloom-generate-debian',
          'bin/git-bloom-generate-debian-all',
+         'bin/git-bloom-graph',
          'bin/git-bloom-import-upstream',
+         'bin/git-bloom-object-store',
          'bin/git-bloom-patch',
          'bin/git-bloom-release',
+         'bin/git-bloom-release-many',
+         'bin/git-bloom-rosdep-cache',
+         'bin/git-bloom-serve',
          'bin/git-bloom-set-upstream',
       ],
       package_data={'bloom': ['resources/em/*.em']},
@@ -0,0 +1,355 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Python API for the bloom commands.
+
+Unlike the git-bloom-* commands these never exit the interpreter or prompt
+on the terminal unless asked to, which makes it possible to run many
+operations from one process.  Failures raise :py:class:`BloomError` or one
+of its subclasses, and successful operations return a result tuple.
+
+Prompts are answered by a policy, one of:
+
+- ``ASSUME_YES``, the default, answers yes to every prompt
+- ``ASSUME_NO`` answers no, which aborts the operation
+- ``FAIL`` raises :py:class:`InteractionRequired` at the first prompt
+- ``ASK`` prompts on the terminal like the command line tools
+
+For example::
+
+    from bloom import api
+    api.import_upstream(directory='ros-foo-release')
+    result = api.branch('upstream', 'release', directory='ros-foo-release')
+    for branch in result.branches:
+        print(branch)
+"""
+
+from __future__ import print_function
+
+import os
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+from . git import branch_context
+from . git import get_current_branch
+from . git import get_last_tag_by_date
+from . logging import pop_log_prefix
+from . logging import push_log_prefix
+from . tag_index import get_tag_index
+from . util import ASK
+from . util import ASSUME_NO
+from . util import ASSUME_YES
+from . util import BloomError
+from . util import FAIL
+from . util import InteractionRequired
+from . util import library_mode
+
+ImportResult = namedtuple('ImportResult', 'upstream_tag version')
+BranchResult = namedtuple('BranchResult', 'source branches')
+PatchResult = namedtuple('PatchResult', 'command branch')
+GenerateResult = namedtuple('GenerateResult', 'tags')
+
+
+class CommandFailed(BloomError):
+    """
+    Raised when an operation fails with a non zero return code.
+
+    :ivar command: name of the equivalent git-bloom-* command
+    :ivar returncode: return code the command line tool would have exited with
+    """
+
+    def __init__(self, command, returncode, msg=None):
+        if msg is None:
+            msg = "{0} failed with return code {1}".format(command,
+                                                          returncode)
+        BloomError.__init__(self, msg, returncode)
+        self.command = command
+
+
+@contextmanager
+def _operation(command, policy, directory=None):
+    """
+    Runs an operation in library mode, in directory if given.
+
+    Exits which are left in the commands, e.g. from argument parsing, are
+    turned into CommandFailed.  Some of the commands run git in the cwd
+    regardless of the directory they are given, so the operation always
+    changes to directory; pass :py:func:`_abspath` of it to the commands.
+    """
+    cwd = os.getcwd()
+    with library_mode(policy):
+        try:
+            if directory is not None:
+                os.chdir(directory)
+            yield
+        except SystemExit as err:
+            code = err.code
+            if code is None or code == 0:
+                raise CommandFailed(command, 0, "{0} exited early"
+                                                .format(command))
+            if not isinstance(code, int):
+                raise CommandFailed(command, 1, str(code))
+            raise CommandFailed(command, code)
+        finally:
+            os.chdir(cwd)
+
+
+def _abspath(directory):
+    """Returns directory as an absolute path, which survives the chdir"""
+    return os.path.abspath(directory) if directory is not None else None
+
+
+def _check(command, returncode):
+    if returncode is not None and returncode != 0:
+        raise CommandFailed(command, returncode)
+
+
+def _debian_tags(directory=None):
+    index = get_tag_index(directory)
+    return set(r.name for r in index.records if r.package is not None)
+
+
+def import_upstream(directory=None, upstream_branch=None, replace=False,
+                    policy=ASSUME_YES):
+    """
+    Imports the upstream repository, like git-bloom-import-upstream.
+
+    :param directory: the release repository, by default the cwd
+    :param upstream_branch: upstream branch to import instead of the one in
+        bloom.conf
+    :param replace: if True an existing import of the same version is
+        replaced
+    :param policy: how to answer prompts
+    :returns: ImportResult with the upstream tag and version which were
+        imported
+
+    :raises: BloomError, CommandFailed or subprocess.CalledProcessError
+    """
+    from . import_upstream import main as import_upstream_main
+    sysargs = []
+    if upstream_branch is not None:
+        sysargs.extend(['--upstream-branch', upstream_branch])
+    if replace:
+        sysargs.append('--replace')
+    command = 'git-bloom-import-upstream'
+    with _operation(command, policy, directory):
+        _check(command, import_upstream_main(sysargs))
+    tag = get_last_tag_by_date(directory)
+    return ImportResult(tag, tag[len('upstream/'):])
+
+
+def branch(src, prefix, patch=True, interactive=False, directory=None,
+           policy=ASSUME_YES):
+    """
+    Branches the packages in src, like git-bloom-branch.
+
+    :param src: branch containing the packages
+    :param prefix: the packages are branched to prefix/<package name>
+    :param patch: if False the patches of existing branches are not applied
+    :param interactive: if True a summary is given and confirmed first
+    :param directory: the release repository, by default the cwd
+    :param policy: how to answer prompts
+    :returns: BranchResult with the source and the destination branches
+
+    :raises: BloomError, CommandFailed or subprocess.CalledProcessError
+    """
+    from . branch.branch import _branch_packages
+    directory = _abspath(directory)
+    branches = []
+    command = 'git-bloom-branch'
+    with _operation(command, policy, directory):
+        push_log_prefix('[git-bloom-branch]: ')
+        try:
+            with branch_context(directory=directory):
+                _check(command, _branch_packages(src, prefix, patch,
+                                                 interactive, directory,
+                                                 branched=branches))
+        finally:
+            pop_log_prefix()
+    return BranchResult(src, branches)
+
+
+def patch(command, directory=None, policy=ASSUME_YES):
+    """
+    Runs a git-bloom-patch command on the current branch.
+
+    :param command: one of ``export``, ``import``, ``remove`` or ``rebase``
+    :param directory: the release repository, by default the cwd
+    :param policy: how to answer prompts
+    :returns: PatchResult with the command and the branch it was run on
+
+    :raises: ValueError for an unknown command, otherwise BloomError,
+        CommandFailed or subprocess.CalledProcessError
+    """
+    from . patch.export_cmd import export_patches
+    from . patch.import_cmd import import_patches
+    from . patch.rebase_cmd import rebase_patches
+    from . patch.remove_cmd import remove_patches
+    commands = {
+        'export': export_patches,
+        'import': import_patches,
+        'remove': remove_patches,
+        'rebase': rebase_patches
+    }
+    if command not in commands:
+        raise ValueError("Invalid patch command: {0}".format(command))
+    name = 'git-bloom-patch ' + command
+    directory = _abspath(directory)
+    with _operation(name, policy, directory):
+        current_branch = get_current_branch(directory)
+        _check(name, commands[command](directory=directory))
+    return PatchResult(command, current_branch)
+
+
+def trim(sub_dir=None, force=False, undo=False, directory=None,
+         policy=ASSUME_YES):
+    """
+    Moves a sub directory to the root of the branch, like git-bloom-patch trim.
+
+    :param sub_dir: sub directory to move to the root of the branch
+    :param force: if True an already trimmed branch is trimmed again
+    :param undo: if True a previous trim is undone
+    :param directory: the release repository, by default the cwd
+    :param policy: how to answer prompts
+    :returns: PatchResult with the command and the branch it was run on
+
+    :raises: BloomError, CommandFailed or subprocess.CalledProcessError
+    """
+    from . patch.trim_cmd import trim as trim_branch
+    name = 'git-bloom-patch trim'
+    directory = _abspath(directory)
+    with _operation(name, policy, directory):
+        current_branch = get_current_branch(directory)
+        _check(name, trim_branch(sub_dir, force, undo, directory))
+    return PatchResult('trim', current_branch)
+
+
+def generate_debian(rosdistro, upstream_tag=None, distros=None,
+                    debian_revision=0, update_rosdep=True,
+                    rosdep_max_age=None, directory=None, policy=ASSUME_YES):
+    """
+    Generates the debians of the current branch, like
+    git-bloom-generate-debian.
+
+    :param rosdistro: ros distro to generate the debians for
+    :param upstream_tag: tag to generate the debians from, by default the
+        latest upstream tag
+    :param distros: list of ubuntu distros, by default all of the distros
+        targeted by the ros distro
+    :param debian_revision: debian revision of the generated debians
+    :param update_rosdep: if False rosdep is not updated first
+    :param rosdep_max_age: if given rosdep is only updated if the last
+        update is older than this many seconds
+    :param directory: the release repository, by default the cwd
+    :param policy: how to answer prompts
+    :returns: GenerateResult with the sorted list of debian tags created
+
+    :raises: BloomError, CommandFailed or subprocess.CalledProcessError
+    """
+    from . generators.debian import main as generate_debian_main
+    sysargs = ['--debian-revision', str(debian_revision)]
+    if upstream_tag is not None:
+        sysargs.extend(['--upstream-tag', upstream_tag])
+    if distros:
+        sysargs.append('--distros')
+        sysargs.extend(distros)
+    if not update_rosdep:
+        sysargs.append('--do-not-update-rosdep')
+    elif rosdep_max_age is not None:
+        sysargs.extend(['--rosdep-max-age', str(rosdep_max_age)])
+    sysargs.append(rosdistro)
+    command = 'git-bloom-generate-debian'
+    with _operation(command, policy, directory):
+        before = _debian_tags()
+        _check(command, generate_debian_main(sysargs))
+        tags = _debian_tags() - before
+    return GenerateResult(sorted(tags))
+
+
+def generate_debian_all(rosdistro, prefix='release', debian_revision=0,
+                        update_rosdep=True, rosdep_max_age=None,
+                        resume=False, directory=None, policy=ASSUME_YES):
+    """
+    Branches and generates the debians of all of the release branches, like
+    git-bloom-generate-debian-all.
+
+    :param rosdistro: ros distro to generate the debians for
+    :param prefix: prefix of the release branches
+    :param debian_revision: debian revision of the generated debians
+    :param update_rosdep: if False rosdep is not updated first
+    :param rosdep_max_age: if given rosdep is only updated if the last
+        update is older than this many seconds
+    :param resume: if True the packages finished by an interrupted run are
+        skipped
+    :param directory: the release repository, by default the cwd
+    :param policy: how to answer prompts
+    :returns: GenerateResult with the sorted list of debian tags created
+
+    :raises: BloomError, CommandFailed or subprocess.CalledProcessError
+    """
+    from . generators.debian.main_all import generate_all
+    command = 'git-bloom-generate-debian-all'
+    results = []
+    with _operation(command, policy, directory):
+        before = _debian_tags()
+        try:
+            _check(command, generate_all(rosdistro, prefix, debian_revision,
+                                         results=results,
+                                         update_rosdep=update_rosdep,
+                                         resume=resume,
+                                         rosdep_max_age=rosdep_max_age))
+        except BloomError:
+            # Names the first package which failed, if any did
+            for package, returncode in results:
+                _check('git-bloom-generate-debian for ' + package,
+                       returncode)
+            raise
+        tags = _debian_tags() - before
+    return GenerateResult(sorted(tags))
+
+
+def release_waves(prefix='release', directory=None):
+    """
+    Returns the release branches in dependency waves, like git-bloom-graph.
+
+    :param prefix: prefix of the release branches
+    :param directory: the release repository, by default the cwd
+    :returns: list of waves, each a sorted list of the release branches of
+        packages which only depend on packages in earlier waves
+
+    :raises: bloom.packages.DependencyCycle if the dependencies are circular
+    """
+    from . packages import get_release_waves
+    with _operation('git-bloom-graph', ASSUME_YES):
+        return get_release_waves(prefix, directory)
@@ -1,9 +1,9 @@
 from __future__ import print_function
 
 import os
-import sys
 import traceback
 
+from .. util import bailout
 from .. util import execute_command
 from .. util import maybe_continue
 from .. util import parse_stack_xml
@@ -12,25 +12,21 @@ from .. logging import error
 from .. logging import log_prefix
 from .. logging import info
 from .. logging import warning
-from .. git import create_branch
+from .. git import branch_context
 from .. git import branch_exists
+from .. git import checkout
+from .. git import create_branch
 from .. git import get_commit_hash
 from .. git import get_current_branch
 from .. git import track_branches
+from .. packages import find_packages_in_tree
+from .. packages import order_packages
 
 from .. patch.common import set_patch_config
 from .. patch.common import get_patch_config
 from .. patch.rebase_cmd import rebase_patches
 from .. patch.trim_cmd import trim
 
-try:
-    from catkin_pkg.packages import find_packages
-    from catkin_pkg.packages import verify_equal_package_versions
-except ImportError:
-    error("catkin_pkg was not detected, please install it.",
-          file=sys.stderr)
-    sys.exit(1)
-
 
 def branch(src, prefix, patch, interactive, ignore_stack, directory=None):
     """
@@ -47,7 +43,7 @@ def branch(src, prefix, patch, interactive, ignore_stack, directory=None):
         return execute_command(src, stack_name, patch, interactive, directory)
     else:
         info("stack.xml not found, searching for package.xml(s)")
-        branch_packages(src, prefix, patch, interactive, directory)
+        return branch_packages(src, prefix, patch, interactive, directory)
 
 
 @log_prefix('[git-bloom-branch]: ')
@@ -56,24 +52,34 @@ def branch_packages(src, prefix, patch, interactive, directory=None):
     Handles source directories with one or more new style catkin packages.
 
     All parameters are passes through to execute_branch.
+
+    :returns: 0 on success, otherwise the return code of the last failure
     """
-    current_branch = get_current_branch()
-    try:
-        _branch_packages(src, prefix, patch, interactive, directory)
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
+    with branch_context(directory=directory):
+        return _branch_packages(src, prefix, patch, interactive, directory)
 
 
-def _branch_packages(src, prefix, patch, interactive, directory=None):
+def _branch_packages(src, prefix, patch, interactive, directory=None,
+                     branched=None):
+    """
+    Branches each package in src to prefix/<package name>.
+
+    :param branched: if a list is given, the destination branches which were
+        branched successfully are appended to it
+    :returns: 0 on success, otherwise the return code of the last failure
+    """
+    try:
+        from catkin_pkg.packages import verify_equal_package_versions
+    except ImportError:
+        bailout("catkin_pkg was not detected, please install it.")
     # Ensure we are on the correct src branch
-    current_branch = get_current_branch()
+    current_branch = get_current_branch(directory)
     if current_branch != src:
         info("Changing to specified source branch " + src)
-        execute_command('git checkout ' + src, cwd=directory)
-    # Get packages
+        checkout(src, directory)
+    # Get packages, from the tree of src rather than the working tree
     repo_dir = directory if directory else os.getcwd()
-    packages = find_packages(repo_dir)
+    packages = find_packages_in_tree(src, directory)
     if packages == []:
         error("No package.xml(s) found in " + repo_dir)
         return 1
@@ -88,8 +94,10 @@ def _branch_packages(src, prefix, patch, interactive, directory=None):
             error("Answered no to continue, exiting.")
             return 1
     retcode = 0
-    for path in packages:
-        package = packages[path]
+    # Branch the packages which others depend on first
+    paths = dict((p.name, path) for path, p in packages.items())
+    for package in order_packages(packages.values()):
+        path = paths[package.name]
         branch = prefix + ('' if prefix and prefix.endswith('/') else '/') \
                + package.name
         print('')  # white space
@@ -105,12 +113,14 @@ def _branch_packages(src, prefix, patch, interactive, directory=None):
                 retcode = ret
             else:
                 info(msg)
+                if branched is not None:
+                    branched.append(branch)
         except Exception as err:
             traceback.print_exc()
             error("Error branching " + package.name + ": " + str(err))
             retcode = ret
         finally:
-            execute_command('git checkout ' + src, cwd=directory)
+            checkout(src, directory)
     return retcode
 
 
@@ -182,12 +192,12 @@ def execute_branch(src, dst, patch, interactive, trim_dir, directory=None):
     current_branch = get_current_branch(directory)
     try:
         # Change to the src branch
-        execute_command('git checkout {0}'.format(src), cwd=directory)
+        checkout(src, directory)
         # Create the dst branch if needed
         if create_dst_branch:
             create_branch(dst, changeto=True, directory=directory)
         else:
-            execute_command('git checkout {0}'.format(dst), cwd=directory)
+            checkout(dst, directory)
         config = None
         # Create the dst patches branch if needed
         if create_dst_patches_branch:
@@ -224,7 +234,7 @@ def execute_branch(src, dst, patch, interactive, trim_dir, directory=None):
         set_patch_config(dst_patches, config, directory=directory)
         # Command is successful, even if applying patches fails
         current_branch = None
-        execute_command('git checkout ' + dst, cwd=directory)
+        checkout(dst, directory)
         # If trim_dir is set, trim the resulting directory
         if trim_dir not in ['', '.'] and create_dst_branch:
             trim(trim_dir, False, False, directory)
@@ -238,6 +248,5 @@ def execute_branch(src, dst, patch, interactive, trim_dir, directory=None):
                      "'--no-patch' was passed.")
     finally:
         if current_branch is not None:
-            execute_command('git checkout {0}'.format(current_branch),
-                            cwd=directory)
+            checkout(current_branch, directory)
     return 0
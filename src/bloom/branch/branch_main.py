@@ -1,6 +1,5 @@
 from __future__ import print_function
 
-import sys
 import traceback
 from argparse import ArgumentParser
 from subprocess import CalledProcessError
@@ -81,4 +80,4 @@ def branchmain():
     if retcode == 0:
         info("Working branch: " + ansi('boldon') + \
             str(get_current_branch()) + ansi('reset'))
-    sys.exit(retcode)
+    return retcode
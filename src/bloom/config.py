@@ -42,12 +42,14 @@ from . util import maybe_continue, execute_command, ansi
 from . logging import debug
 from . logging import info
 from . logging import error
+from . git import branch_context
 from . git import branch_exists
+from . git import checkout
 from . git import create_branch
-from . git import get_current_branch
 from . git import get_root
 from . git import has_changes
 from . git import inbranch
+from . gitconfig import write_config
 
 
 def check_git_init():
@@ -74,20 +76,17 @@ def set_upstream(upstream_repo, upstream_repo_type, upstream_repo_branch):
         # Found a bloom branch
         debug("Found a bloom branch, checking out.")
         # Check out the bloom branch
-        execute_command('git checkout bloom')
+        checkout('bloom')
     else:
         # No bloom branch found, create one
         create_branch('bloom', changeto=True)
 
     # Now set the upstream using the bloom config
-    cmd = 'git config -f bloom.conf bloom.upstream "{0}"'.format(upstream_repo)
-    execute_command(cmd)
-    cmd = 'git config -f bloom.conf ' \
-        + 'bloom.upstreamtype "{0}"'.format(upstream_repo_type)
-    execute_command(cmd)
-    cmd = 'git config -f bloom.conf ' \
-        + 'bloom.upstreambranch "{0}"'.format(upstream_repo_branch)
-    execute_command(cmd)
+    write_config('bloom.conf', [
+        ('bloom.upstream', upstream_repo),
+        ('bloom.upstreamtype', upstream_repo_type),
+        ('bloom.upstreambranch', upstream_repo_branch)
+    ])
 
     execute_command('git add bloom.conf')
     if has_changes():
@@ -164,17 +163,11 @@ def main(sysargs=None):
     if not validate_args(args.upstream_vcs_type):
         return 1
 
-    # Store the current branch
-    current_branch = get_current_branch()
-    try:
+    # Roll back to the branch the user was on before, even if this fails
+    with branch_context():
         set_upstream(args.upstream_repository, args.upstream_vcs_type,
                      args.upstream_branch)
         info("Upstream successively set.")
         return 0
-    finally:
-        # Try to roll back to the branch the user was on before
-        # this possibly failed.
-        if current_branch:
-            execute_command('git checkout ' + current_branch)
 
     return 1
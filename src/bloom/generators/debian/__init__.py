@@ -32,46 +32,117 @@
 
 from __future__ import print_function
 
-import pkg_resources
-import copy
 import datetime
-import dateutil.tz
-import em
 import os
 import re
-import rospkg
 import sys
 import tempfile
 
 from pprint import pprint
-from subprocess import Popen, CalledProcessError
+from subprocess import Popen, PIPE, CalledProcessError
 
 from ... util import add_global_arguments
+from ... util import check_output
 from ... util import execute_command
 from ... util import handle_global_arguments
 from ... util import bailout
 from ... util import ansi
 # from . util import get_versions_from_upstream_tag
-from ... git import get_current_branch
+from ... git import resolve_commit
+from ... git import branch_exists
+from ... git import commit_files
+from ... git import create_tag
 from ... git import track_branches
+from ... git import get_changed_files
+from ... git import get_current_branch
 from ... git import get_last_tag_by_date
-
+from ... git import list_tree
+from ... git import sync_checkout
+from ... git import tag_batch
+from ... journal import get_journal
+from ... packages import get_manifest_descriptions
+from ... packages import get_tree_manifest_descriptions
+from ... packages import parse_package_blob
+from ... packages import parse_package_file
+from ... packages import parse_stack_blob
+from ... packages import parse_stack_file
+from ... rosdep_cache import add_rosdep_arguments
+from ... rosdep_cache import get_default_max_age
+from ... rosdep_cache import get_ubuntu_targets
+from ... rosdep_cache import update_rosdep
+from ... rosdep_index import get_rosdep_index
+
+from . meta import DISTRO_KEYS
+from . meta import DISTRO_LIST_KEYS
+from . meta import PackageMeta
+
+from ... logging import debug
 from ... logging import error
 from ... logging import info
 from ... logging import warning
 
-try:
-    from vcstools import VcsClient
-except ImportError:
-    print("vcstools was not detected, please install it.", file=sys.stderr)
-    sys.exit(1)
+# rosdep2, em, dateutil and pkg_resources each take a
+# noticeable time to import, so they are imported on first use below, which
+# keeps things like --help fast.
+
+
+def _import_rosdep():
+    """Returns the rosdep2 module, importing it on first use"""
+    try:
+        import rosdep2.catkin_support
+        import rosdep2.platforms.debian
+    except ImportError:
+        print("rosdep was not detected, please install it.", file=sys.stderr)
+        sys.exit(2)
+    return rosdep2
+
+
+# rosdep views by (rosdistro, os name, os version) and template text by file
+# name, which are reused by later commands in a bloom server
+_rosdep_views = {}
+_templates = {}
+# Skeletons of the templates rendered for a package, keyed by the template
+# and the stack data of the package, or False if a template cannot be spliced
+_skeletons = {}
+_max_skeletons = 256
+# Placeholders of the keys which vary by distro in a rendered skeleton
+_sentinel_pattern = re.compile('\0bloom:(\\w+)\0|'
+                               '\0bloom:(\\w+):0\0(.*?)\0bloom:\\2:1\0',
+                               re.DOTALL)
+
+
+def get_rosdep_view(rosdistro, os_name, os_version):
+    """
+    Returns the rosdep view for an os, reusing it until rosdep is updated.
+
+    :raises: rosdep2.catkin_support.ValidationFailed
+    """
+    rosdep2 = _import_rosdep()
+    from rosdep2.sources_list import CACHE_INDEX, get_sources_cache_dir
+    try:
+        st = os.stat(os.path.join(get_sources_cache_dir(), CACHE_INDEX))
+        signature = (st.st_mtime, st.st_size, st.st_ino)
+    except OSError:
+        signature = None
+    key = (rosdistro, os_name, os_version)
+    cached = _rosdep_views.get(key)
+    if signature is not None and cached is not None \
+       and cached[0] == signature:
+        return cached[1]
+    view = rosdep2.catkin_support.get_catkin_view(rosdistro, os_name,
+                                                  os_version, update=False)
+    _rosdep_views[key] = (signature, view)
+    return view
+
+
+def _get_template(ifilename):
+    """Returns the text of one of bloom's templates, reading it once"""
+    if ifilename not in _templates:
+        import pkg_resources
+        _templates[ifilename] = pkg_resources.resource_string('bloom',
+                                                              ifilename)
+    return _templates[ifilename]
 
-try:
-    import rosdep2.catkin_support
-    from rosdep2.platforms.debian import APT_INSTALLER
-except ImportError:
-    print("rosdep was not detected, please install it.", file=sys.stderr)
-    sys.exit(2)
 
 '''
 The Debian binary package file names conform to the following convention:
@@ -122,6 +193,7 @@ def update_repo(working_dir, repo_path, repo_uri, first_release):
 
 
 def generate_rosdep_db(working_dir, rosdistro):
+    rosdep2 = _import_rosdep()
     return rosdep2.catkin_support.get_catkin_view(rosdistro)
 
 
@@ -148,8 +220,19 @@ def process_stack_xml(args, cwd=None):
     xml_path = os.path.join(cwd, 'stack.xml')
     if not os.path.exists(xml_path):
         bailout("No stack.xml file found at: {0}".format(xml_path))
-    stack = rospkg.stack.parse_stack_file(xml_path)
+    stack = parse_stack_file(xml_path)
+    return get_stack_xml_data(
+        args, stack, get_manifest_descriptions(cwd, stack.name))
+
 
+def get_stack_xml_data(args, stack, descriptions):
+    """
+    Returns the :py:class:`PackageMeta` of a parsed stack.xml.
+
+    :param stack: the rospkg.stack.Stack
+    :param descriptions: dict of the rosbuild packages in the stack to their
+        descriptions, see :py:func:`bloom.packages.get_manifest_descriptions`
+    """
     data = {}
     data['Name'] = stack.name
     data['Version'] = stack.version
@@ -195,21 +278,9 @@ def process_stack_xml(args, cwd=None):
     package_descriptions = {}
 
     # search for manifest in current folder and direct subfolders
-    for dir_name in [cwd] + os.listdir(cwd):
-        if not os.path.isdir(dir_name):
-            continue
-        dir_path = os.path.join('.', dir_name)
-        for file_name in os.listdir(dir_path):
-            if file_name == 'manifest.xml':
-                # parse the manifest, in case it is not valid
-                manifest = rospkg.parse_manifest_file(dir_path, file_name)
-                # remove markups
-                if manifest.description is None:
-                    manifest.description = ''
-                description = debianize_string(manifest.description)
-                if dir_name == '.':
-                    dir_name = stack.name
-                package_descriptions[dir_name] = description
+    for dir_name, description in descriptions.items():
+        # remove markups
+        package_descriptions[dir_name] = debianize_string(description or '')
     # Enhance the description with the list of packages in the stack
     if package_descriptions:
         if data['Description']:
@@ -218,7 +289,7 @@ def process_stack_xml(args, cwd=None):
         for name, description in package_descriptions.items():
             data['Description'] += '\n * %s: %s' % (name, description)
 
-    return data
+    return PackageMeta.from_dict(data)
 
 
 def process_package_xml(args, directory=None):
@@ -226,14 +297,19 @@ def process_package_xml(args, directory=None):
     xml_path = os.path.join(cwd, 'package.xml')
     if not os.path.exists(xml_path):
         bailout("No package.xml file found at: {0}".format(xml_path))
-    try:
-        from catkin_pkg.package import parse_package
-    except ImportError:
-        error("catkin_pkg was not detected, please install it.",
-              file=sys.stderr)
-        sys.exit(1)
-    package = parse_package(xml_path)
+    package = parse_package_file(xml_path)
+    return get_package_xml_data(
+        args, package, get_manifest_descriptions(cwd, package.name))
 
+
+def get_package_xml_data(args, package, descriptions):
+    """
+    Returns the :py:class:`PackageMeta` of a parsed package.xml.
+
+    :param package: the catkin_pkg.package.Package
+    :param descriptions: dict of the rosbuild packages next to it to their
+        descriptions, see :py:func:`bloom.packages.get_manifest_descriptions`
+    """
     data = {}
     data['Name'] = package.name
     data['Version'] = package.version
@@ -281,21 +357,9 @@ def process_package_xml(args, directory=None):
     package_descriptions = {}
 
     # search for manifest in current folder and direct subfolders
-    for dir_name in [cwd] + os.listdir(cwd):
-        if not os.path.isdir(dir_name):
-            continue
-        dir_path = os.path.join('.', dir_name)
-        for file_name in os.listdir(dir_path):
-            if file_name == 'manifest.xml':
-                # parse the manifest, in case it is not valid
-                manifest = rospkg.parse_manifest_file(dir_path, file_name)
-                # remove markups
-                if manifest.description is None:
-                    manifest.description = ''
-                description = debianize_string(manifest.description)
-                if dir_name == '.':
-                    dir_name = package.name
-                package_descriptions[dir_name] = description
+    for dir_name, description in descriptions.items():
+        # remove markups
+        package_descriptions[dir_name] = debianize_string(description or '')
     # Enhance the description with the list of packages in the stack
     if package_descriptions:
         if data['Description']:
@@ -304,7 +368,7 @@ def process_package_xml(args, directory=None):
         for name, description in package_descriptions.items():
             data['Description'] += '\n * %s: %s' % (name, description)
 
-    return data
+    return PackageMeta.from_dict(data)
 
 
 def get_stack_data(args, directory=None):
@@ -318,61 +382,198 @@ def get_stack_data(args, directory=None):
             bailout("No stack.xml or package.xml found, exiting.")
 
 
-def expand(fname, stack_data, dest_dir, filetype=''):
+def get_tree_stack_data(args, reference, directory=None):
+    """
+    Returns the stack data of the tree of a reference, e.g. an upstream tag.
+
+    Like :py:func:`get_stack_data`, but the package.xml or stack.xml and the
+    manifest.xml files are read from the git objects, so the tag does not
+    have to be checked out.
+    """
+    entries = list_tree(reference, ['package.xml', 'stack.xml'], directory)
+    if 'package.xml' in entries:
+        package = parse_package_blob(entries['package.xml'][2], directory)
+        return get_package_xml_data(args, package,
+            get_tree_manifest_descriptions(reference, package.name, directory))
+    if 'stack.xml' in entries:
+        stack = parse_stack_blob(entries['stack.xml'][2], directory)
+        return get_stack_xml_data(args, stack,
+            get_tree_manifest_descriptions(reference, stack.name, directory))
+    bailout("No stack.xml or package.xml found in {0}, exiting."
+            .format(reference))
+
+
+def expand(fname, stack_data, filetype='', directory=None,
+           reference='HEAD'):
+    """
+    Returns the text of a debian file expanded from its template, or None.
+
+    A custom rules file is read from the tree of reference and rendered in
+    full for each distro, the templates are bloom's own.
+    """
     # insert template type
     if fname == 'rules' and stack_data['Catkin-DebRulesType'] == 'custom':
-        path = os.path.join(dest_dir, '..', stack_data['Catkin-DebRulesFile'])
-        f = open(path)
-        file_em = f.read()
-        f.close()
+        path = os.path.normpath(stack_data['Catkin-DebRulesFile'])
+        file_em = check_output(['git', 'show', reference + ':' + path],
+                               cwd=directory)
+        return _expand(file_em, stack_data) + '\n'
+    if filetype != '':
+        ifilename = (fname + '.' + filetype + '.em')
     else:
-        if filetype != '':
-            ifilename = (fname + '.' + filetype + '.em')
+        ifilename = fname + '.em'
+    ifilename = os.path.join('resources', 'em', ifilename)
+    print("Reading %s template from %s" % (fname, ifilename))
+    try:
+        file_em = _get_template(ifilename)
+    except IOError:
+        warning("Could not find {0}, skipping...".format(ifilename))
+        return None
+
+    return _render(file_em, stack_data) + '\n'
+
+
+def _expand(file_em, stack_data):
+    """Expands a template with EmPy"""
+    import em
+    # The keys are passed as the globals, they are not all identifiers
+    return em.expand(file_em, dict(stack_data.items()))
+
+
+def _sentinel(key, index=None):
+    if index is None:
+        return '\0bloom:{0}\0'.format(key)
+    return '\0bloom:{0}:{1}\0'.format(key, index)
+
+
+def _branches_on(file_em, keys):
+    """
+    Returns True if control markup or a statement of a template uses keys.
+
+    :param file_em: text of the template
+    :param keys: names the markup is searched for
+    """
+    pattern = re.compile(r'\b(?:' + '|'.join(keys) + r')\b')
+    brackets = {'[': ']', '{': '}'}
+    start = file_em.find('@')
+    while start != -1 and start + 1 < len(file_em):
+        opening = file_em[start + 1]
+        if opening == '@':
+            start = file_em.find('@', start + 2)
+            continue
+        end = start + 1
+        if opening in brackets:
+            depth = 0
+            while end < len(file_em):
+                if file_em[end] == opening:
+                    depth += 1
+                elif file_em[end] == brackets[opening]:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            if pattern.search(file_em[start:end]):
+                return True
+        start = file_em.find('@', end)
+    return False
+
+
+def get_skeleton(file_em, stack_data):
+    """
+    Renders the parts of a template which are the same for every distro.
+
+    The template is expanded once with placeholders for the keys which
+    vary by distro, the dependency lists as two placeholders, which gives
+    the separator they are joined with.
+
+    :param file_em: text of the template
+    :param stack_data: the :py:class:`PackageMeta` of the package
+    :returns: list of the text between the keys, and (key, separator)
+        tuples, the separator is None for keys which are not lists, or None
+        if the template uses the keys in another way
+    """
+    # Control markup and statements can branch on the distro, which the
+    # placeholders do not show
+    if _branches_on(file_em, DISTRO_KEYS):
+        return None
+    data = dict(stack_data.items())
+    for key in DISTRO_KEYS:
+        if key in DISTRO_LIST_KEYS:
+            data[key] = [_sentinel(key, 0), _sentinel(key, 1)]
+        else:
+            data[key] = _sentinel(key)
+    text = _expand(file_em, data)
+    skeleton = []
+    end = 0
+    for match in _sentinel_pattern.finditer(text):
+        skeleton.append(text[end:match.start()])
+        if match.group(1) is not None:
+            skeleton.append((match.group(1), None))
         else:
-            ifilename = fname + '.em'
-        ifilename = os.path.join('resources', 'em', ifilename)
-        print("Reading %s template from %s" % (fname, ifilename))
-        try:
-            file_em = pkg_resources.resource_string('bloom', ifilename)
-        except IOError:
-            warning("Could not find {0}, skipping...".format(ifilename))
-            return False
-
-    s = em.expand(file_em, **stack_data)
-
-    ofilename = os.path.join(dest_dir, fname)
-    with open(ofilename, "w") as ofilestr:
-        print(s, file=ofilestr)
-    if fname == 'rules':
-        os.chmod(ofilename, 0755)
-    return True
-
-
-def find_deps(stack_data, apt_installer, rosdistro, debian_distro):
+            skeleton.append((match.group(2), match.group(3)))
+        end = match.end()
+    skeleton.append(text[end:])
+    for part in skeleton:
+        if not isinstance(part, tuple) and '\0bloom:' in part:
+            return None
+        if isinstance(part, tuple) and part[1] and '\0bloom:' in part[1]:
+            return None
+    return skeleton
+
+
+def splice(skeleton, stack_data):
+    """Returns the text of a skeleton with the values of stack_data"""
+    parts = []
+    for part in skeleton:
+        if not isinstance(part, tuple):
+            parts.append(part)
+        elif part[1] is None:
+            parts.append(str(stack_data[part[0]]))
+        else:
+            parts.append(part[1].join(stack_data[part[0]]))
+    return ''.join(parts)
+
+
+def _render(file_em, stack_data):
+    """
+    Expands one of bloom's templates, splicing the distro into a skeleton
+    if possible.
+
+    The first distro of a package is rendered in full, and the skeleton of
+    the package is only used for the other distros if splicing it gives
+    the same text for the first one, otherwise each is rendered in full.
+    Templates which branch on the distro have no skeleton, see
+    :py:func:`get_skeleton`, and templates from the package's own tree are
+    rendered with :py:func:`_expand` instead.
+    """
+    base = getattr(stack_data, 'base', None)
+    if base is None:
+        return _expand(file_em, stack_data)
+    key = (file_em, tuple(base.items()))
+    skeleton = _skeletons.get(key)
+    if skeleton:
+        return splice(skeleton, stack_data)
+    text = _expand(file_em, stack_data)
+    if skeleton is None:
+        skeleton = get_skeleton(file_em, base)
+        if skeleton is None or splice(skeleton, stack_data) != text:
+            debug("The distros of " + base['Name'] + " are rendered in full")
+            skeleton = False
+        if len(_skeletons) >= _max_skeletons:
+            _skeletons.clear()
+        _skeletons[key] = skeleton
+    return text
+
+
+def find_deps(stack_data, rosdistro, debian_distro):
     os_name = 'ubuntu'
 
     deps = stack_data['Depends']
     build_deps = stack_data['BuildDepends']
 
-    rosdep_view = rosdep2.catkin_support.get_catkin_view(rosdistro, os_name,
-                                                         debian_distro,
-                                                         update=False)
-
-    ubuntu_deps = set()
-    for dep in deps:
-        resolved = \
-            rosdep2.catkin_support.resolve_for_os(dep, rosdep_view,
-                                                  apt_installer, os_name,
-                                                  debian_distro)
-        ubuntu_deps.update(resolved)
-
-    ubuntu_build_deps = set()
-    for dep in build_deps:
-        resolved = \
-            rosdep2.catkin_support.resolve_for_os(dep, rosdep_view,
-                                                  apt_installer, os_name,
-                                                  debian_distro)
-        ubuntu_build_deps.update(resolved)
+    # The keys are looked up in the precomputed table of the rosdep views
+    index = get_rosdep_index(rosdistro, [debian_distro], os_name)
+    ubuntu_deps = index.resolve(deps, debian_distro)
+    ubuntu_build_deps = index.resolve(build_deps, debian_distro)
 
     print(stack_data['Name'], "has the following dependencies for ubuntu "
                                "%s" % debian_distro)
@@ -383,56 +584,106 @@ def find_deps(stack_data, apt_installer, rosdistro, debian_distro):
     return list(ubuntu_deps), list(ubuntu_build_deps)
 
 
-def generate_deb(stack_data, repo_path, stamp, rosdistro, debian_distro):
-    apt_installer = rosdep2.catkin_support.get_installer(APT_INSTALLER)
-    depends, build_depends = find_deps(stack_data, apt_installer,
-                                       rosdistro, debian_distro)
-    stack_data['Depends'] = depends
-    stack_data['BuildDepends'] = build_depends
-    stack_data['Distribution'] = debian_distro
-    stack_data['Date'] = stamp.strftime('%a, %d %b %Y %T %z')
-    stack_data['YYYY'] = stamp.strftime('%Y')
+def get_distro_data(stack_data, stamp, rosdistro, debian_distro):
+    """
+    Returns the stack data of a package for one distro.
+
+    :param stack_data: the :py:class:`PackageMeta` of the package
+    :param stamp: the datetime of the release
+    :returns: :py:class:`DistroMeta` with the dependencies resolved for
+        debian_distro, over stack_data
+    """
+    depends, build_depends = find_deps(stack_data, rosdistro, debian_distro)
+    return stack_data.for_distro(debian_distro, depends, build_depends,
+                                 stamp)
+
+
+def generate_deb(stack_data, repo_path, reference='HEAD'):
+    """
+    Returns the files of the debian directory for one distro.
+
+    The files are only rendered, see :py:func:`commit_debian`.
 
-    source_dir = '.'  # repo_path
-    print("source_dir=%s" % source_dir)
-    dest_dir = os.path.join(source_dir, 'debian')
-    if not os.path.exists(dest_dir):
-        os.makedirs(dest_dir)
+    :param stack_data: the :py:class:`DistroMeta` of the distro
+    :param reference: the upstream commit, to read a custom rules file from
+    :returns: dict of path to (mode, content)
+    """
+    files = {}
+
+    def add(fname, content, mode='100644'):
+        if content is not None:
+            files['debian/' + fname] = (mode, content)
 
     #create control file:
-    expand('control', stack_data, dest_dir)
-    expand('changelog', stack_data, dest_dir,
-           filetype=stack_data['Catkin-ChangelogType'])
-    expand('rules', stack_data, dest_dir,
-           filetype=stack_data['Catkin-DebRulesType'])
-    # expand('copyright', stack_data, dest_dir,
-           # filetype=stack_data['Catkin-CopyrightType'])
-    # ofilename = os.path.join(dest_dir, 'copyright')
-    # ofilestr = open(ofilename, "w")
-    # print(stack_data['copyright'], file=ofilestr)
-    # ofilestr.close()
+    add('control', expand('control', stack_data, directory=repo_path,
+                          reference=reference))
+    add('changelog', expand('changelog', stack_data,
+                            stack_data['Catkin-ChangelogType'], repo_path,
+                            reference))
+    add('rules', expand('rules', stack_data,
+                        stack_data['Catkin-DebRulesType'], repo_path,
+                        reference),
+        mode='100755')
+    # add('copyright', expand('copyright', stack_data,
+    #                         stack_data['Catkin-CopyrightType'], repo_path))
 
     #compat to quiet warnings, 7 .. lucid
-    ofilename = os.path.join(dest_dir, 'compat')
-    ofilestr = open(ofilename, "w")
-    print("7", file=ofilestr)
-    ofilestr.close()
+    add('compat', '7\n')
 
     #source format, 3.0 quilt
-    if not os.path.exists(os.path.join(dest_dir, 'source')):
-        os.makedirs(os.path.join(dest_dir, 'source'))
-    ofilename = os.path.join(dest_dir, 'source/format')
-    ofilestr = open(ofilename, "w")
-    print("3.0 (quilt)", file=ofilestr)
-    ofilestr.close()
+    add('source/format', '3.0 (quilt)\n')
+    return files
+
 
+def commit_debian(stack_data, repo_path, files, parent=None, ref=None):
+    """
+    Commits the debian files without touching the checkout.
 
-def commit_debian(stack_data, repo_path):
-    call(repo_path, ['git', 'add', 'debian'])
+    :param parent: commit to commit on top of, if given only ref is moved,
+        otherwise the files are committed to HEAD
+    :param ref: ref to move from parent to the new commit, e.g.
+        ``refs/heads/<branch>``, or None to only write the commit
+    :returns: the SHA-1 hash of the new commit, or of the commit the files
+        were committed on top of if none of them changed
+    """
     message = "+ Creating debian mods for distro: %(Distribution)s, " \
               "rosdistro: %(ROS_DISTRO)s, upstream version: " \
               "%(Version)s" % stack_data
-    call(repo_path, ['git', 'commit', '-m', message])
+    print("+ Committing %s to %s" % (', '.join(sorted(files)),
+                                     ref or parent or 'HEAD'))
+    if parent is not None:
+        return commit_files(files, message, ref, repo_path, parent)
+    return commit_files(files, message, directory=repo_path)
+
+
+def get_previous_generation(tag_name, repo_path):
+    """
+    Returns the commit and changelog date of an earlier generation.
+
+    :param tag_name: name of the debian tag of the distro
+    :returns: tuple of the commit the tag points to and the datetime of its
+        changelog, or (None, None) if there is no such tag
+    """
+    import dateutil.parser
+    try:
+        commit = check_output(['git', 'rev-parse', '-q', '--verify',
+                               'refs/tags/' + tag_name + '^{commit}'],
+                              cwd=repo_path).strip()
+    except CalledProcessError:
+        return None, None
+    try:
+        changelog = check_output(['git', 'cat-file', 'blob',
+                                  commit + ':debian/changelog'],
+                                 cwd=repo_path, stderr=PIPE)
+    except CalledProcessError:
+        return commit, None
+    match = re.search(r'^ -- .*  (.+)$', changelog, re.MULTILINE)
+    if match is None:
+        return commit, None
+    try:
+        return commit, dateutil.parser.parse(match.group(1))
+    except ValueError:
+        return commit, None
 
 
 def get_argument_parser():
@@ -457,6 +708,7 @@ Creates or updates a git-buildpackage repository using a catkin project.\
                         help="If specified, rosdep will not be updated before "
                              "generating the debian stuff",
                         action='store_false', default=True)
+    add_rosdep_arguments(parser)
     parser.add_argument('--upstream-tag', '-t',
                         help='tag to create debians from', default=None)
 
@@ -469,7 +721,7 @@ Creates or updates a git-buildpackage repository using a catkin project.\
     return parser
 
 
-def execute_bloom_generate_debian(args, bloom_repo):
+def execute_bloom_generate_debian(args):
     """Executes the generation of the debian.  Assumes in bloom git repo."""
     if args.upstream_tag is not None:
         last_tag = args.upstream_tag
@@ -486,31 +738,89 @@ def execute_bloom_generate_debian(args, bloom_repo):
     # print("Upstream version is: {0}{1}{2}"
           # "".format(ansi('boldon'), version_str, ansi('reset')))
 
-    # Make sure we are on the correct upstream branch
-    bloom_repo.update(last_tag)
-
+    # The upstream sources are read from the objects of the tag, and the
+    # debians are committed on top of it, without checking it out.  If it is
+    # a branch, e.g. debian/<rosdistro>/<package> in
+    # git-bloom-generate-debian-all, the branch is moved to each commit.
+    ref = None
+    if branch_exists(last_tag, True):
+        ref = 'refs/heads/' + last_tag
+    upstream = resolve_commit(ref or last_tag)
+
+    import dateutil.tz
+    rosdep2 = _import_rosdep()
     stamp = datetime.datetime.now(dateutil.tz.tzlocal())
-    stack_data = get_stack_data(args)
+    stack_data = get_tree_stack_data(args, upstream)
     working = args.working if args.working else tempfile.mkdtemp()
     make_working(working)
 
     debian_distros = args.distros
     if not debian_distros:
-        debian_distros = \
-            rosdep2.catkin_support.get_ubuntu_targets(args.rosdistro)
-
+        debian_distros = get_ubuntu_targets(args.rosdistro)
+
+    # Inside of git-bloom-generate-debian-all each distro is journaled, under
+    # the debian branch given as the upstream tag
+    journal = get_journal()
+    branch = last_tag
+    # Each distro is committed on top of the previous one
+    parent = upstream
+    modified = []
     try:
-        for debian_distro in debian_distros:
-            # XXX TODO: Why is this copy needed, should it be deepcopy,
-            # is it related to the lack of packages in deb descriptions?
-            data = copy.copy(stack_data)
-            generate_deb(data, ".", stamp, args.rosdistro, debian_distro)
-            commit_debian(data, ".")
-            tag_name = 'debian/' \
-                '%(Package)s_%(Version)s-%(DebianInc)s_%(Distribution)s' % data
-            print("tag: %s" % tag_name)
-            call(".", ['git', 'tag', '-f', tag_name, '-m',
-                 'Debian release %(Version)s' % data])
+        # Index the rosdep keys for all of the distros at once
+        get_rosdep_index(args.rosdistro, debian_distros)
+        # The tags for all distros are written at once, or not at all
+        with tag_batch():
+            for debian_distro in debian_distros:
+                record = None
+                if journal is not None:
+                    record = journal.get(branch, debian_distro, 'generate')
+                # The branch already has the commits of an interrupted run
+                if record is not None and \
+                   (journal.contains({'sha': upstream}, record['sha']) or
+                    ref is not None and journal.contains(record, upstream)):
+                    print("Skipping %s, which was finished by the "
+                          "interrupted run" % debian_distro)
+                    for tag in record['tags']:
+                        create_tag(tag[0], tag[1], tag[2])
+                    parent = record['sha']
+                    continue
+                data = get_distro_data(stack_data, stamp, args.rosdistro,
+                                       debian_distro)
+                tag_name = 'debian/' \
+                    '%(Package)s_%(Version)s-%(DebianInc)s_%(Distribution)s' \
+                    % data
+                # The files are compared with the last generation of the
+                # tag, which keeps its date if nothing else changed
+                previous, date = get_previous_generation(tag_name, ".")
+                changed = True
+                if date is not None:
+                    files = generate_deb(
+                        stack_data.for_distro(debian_distro, data['Depends'],
+                                              data['BuildDepends'], date),
+                        ".", upstream)
+                    changed = bool(get_changed_files(files, previous, "."))
+                if changed:
+                    modified.append(debian_distro)
+                    files = generate_deb(data, ".", upstream)
+                else:
+                    print("The debian files for %s did not change"
+                          % debian_distro)
+                if not changed and \
+                   resolve_commit(previous + '^', ".") == parent:
+                    # The last generation is on top of the same commit
+                    commit = previous
+                    if ref is not None:
+                        check_output(['git', 'update-ref', ref, commit,
+                                      parent])
+                else:
+                    commit = commit_debian(data, ".", files, parent, ref)
+                parent = commit
+                print("tag: %s" % tag_name)
+                message = 'Debian release %(Version)s' % data
+                create_tag(tag_name, commit, message)
+                if journal is not None:
+                    journal.record(branch, debian_distro, 'generate', commit,
+                                   tags=[(tag_name, commit, message)])
     except rosdep2.catkin_support.ValidationFailed as e:
         print(e.args[0], file=sys.stderr)
         return 1
@@ -527,6 +837,11 @@ If [{0}] is a system dependency, make sure there is a \
 rosdep.yaml entry for it in your sources.
 """.format(rosdep_key), file=sys.stderr)
         return 1
+    finally:
+        if ref is not None and get_current_branch() == last_tag:
+            # The branch was moved under the checkout
+            sync_checkout(upstream)
+    info("Debian files changed for: " + (', '.join(modified) or 'none'))
     return 0
 
 
@@ -551,17 +866,16 @@ def main(sysargs=None):
                 "  git bloom-set-upstream <UPSTREAM_VCS_URL> <VCS_TYPE> "
                 "[<VCS_BRANCH>]")
 
-    current_branch = get_current_branch()
-    bloom_repo = VcsClient('git', os.getcwd())
-    result = 0
-    try:
-        # update rosdep is needed
-        if args.do_not_update_rosdep:
-            info("Updating rosdep")
-            rosdep2.catkin_support.update_rosdep()
-        # do it
-        result = execute_bloom_generate_debian(args, bloom_repo)
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch)
-    return result
+    # update rosdep is needed
+    if args.do_not_update_rosdep:
+        _import_rosdep()
+        max_age = args.rosdep_max_age
+        if max_age is None:
+            try:
+                max_age = get_default_max_age()
+            except ValueError as err:
+                bailout("$BLOOM_ROSDEP_MAX_AGE: " + str(err))
+        update_rosdep(max_age)
+    # do it, the upstream tag is never checked out, so neither is the
+    # current branch afterwards
+    return execute_bloom_generate_debian(args)
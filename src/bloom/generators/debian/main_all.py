@@ -31,17 +31,26 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import sys
-
 from argparse import ArgumentParser
+from subprocess import CalledProcessError
 
 from . import main as gendeb_main
 from ... branch.branch import branch_packages
 
+from ... git import create_tag
+from ... git import format_maintenance_report
 from ... git import get_branches
+from ... git import get_ref_stats
+from ... git import maintain_repository
+from ... git import tag_batch
 from ... git import track_branches
+from ... journal import open_journal
+from ... packages import DependencyCycle
+from ... rosdep_cache import add_rosdep_arguments
+from ... packages import get_branch_waves
+from ... util import BloomError
 from ... util import maybe_continue
-from ... logging import info, error
+from ... logging import info, error, warning
 
 
 def get_argument_parser():
@@ -60,40 +69,174 @@ Example: 'git-bloom-generate-debian-all groovy release'
                              ' Please enter a monotonically increasing number '
                              'from the last upload.',
                         default=0)
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="skip the packages finished by an interrupted "
+                             "run with the same arguments")
+    parser.add_argument('--maintenance', action='store_true', default=False,
+                        help="report the ref counts and ref lookup time "
+                             "before and after the refs and objects are "
+                             "packed at the end")
+    add_rosdep_arguments(parser)
     return parser
 
 
-def main(sysargs=None):
-    parser = get_argument_parser()
-    args = parser.parse_args(sysargs)
+def generate_all(rosdistro, prefix, debian_revision=0, results=None,
+                 update_rosdep=True, resume=False, rosdep_max_age=None):
+    """
+    Branches and generates the debians for each branch matching prefix.
+
+    The debian tags of all of the packages are written together at the end,
+    or not at all if branching any of the packages fails.
+
+    :param rosdistro: ros distro to generate the debians for
+    :param prefix: prefix of the release branches, e.g. ``release``
+    :param debian_revision: debian revision of the generated debians
+    :param results: if a list is given, (package, return code of
+        git-bloom-generate-debian) pairs are appended to it
+    :param update_rosdep: if False rosdep is not updated, otherwise it is
+        updated before generating the first package
+    :param rosdep_max_age: if given rosdep is only updated if the last
+        update is older than this many seconds
+    :param resume: if True the packages finished by an interrupted run, as
+        recorded in its journal, are skipped if their branches have not
+        moved since
+    :returns: 0 on success, or 1 if answered no to continue
+
+    :raises: BloomError with the return code of git-bloom-branch if it fails,
+        or of the first git-bloom-generate-debian which failed, after the
+        tags of the other packages are written.  The journal is kept, so
+        a run with resume only generates the failed packages again.
+    """
     track_branches()
     branches = get_branches(local_only=True)
     targets = []
     for branch in branches:
-        if branch.startswith(args.prefix):
+        if branch.startswith(prefix):
             targets.append(branch)
+    # Generate the packages which others depend on first
+    try:
+        waves = get_branch_waves(targets)
+    except DependencyCycle as err:
+        warning(str(err) + ", generating them in branch order.")
+        waves = [targets]
+    targets = [target for wave in waves for target in wave]
     info("This will run git-bloom-generate-debian on these "
          "pacakges: " + str(targets))
     if not maybe_continue():
         error("Answered no to continue, exiting.")
-        sys.exit(1)
-    for index, target in enumerate(targets):
-        # Branch first
-        package = target[len('release/'):]
-        new_target = 'debian/' + args.rosdistro
-        info("Branching to debian prefix with: git-bloom-branch --src " + \
-             target + " " + new_target + '/' + package)
-        ret = branch_packages(target, new_target, True, False)
-        ret = ret if ret is not None else 0
-        if ret != 0:
-            error("Command git-bloom-branch failed with return code: " + \
-                  str(ret))
-            sys.exit(ret)
-        # Then generate
-        gen_args = ['-t', new_target + '/' + package,
-                    args.rosdistro, '--debian-revision',
-                    str(args.debian_revision)]
-        if index != 0:
-            gen_args.append('--do-not-update-rosdep')
-        info("Calling git-bloom-generate-debian-all " + " ".join(gen_args))
-        gendeb_main(gen_args)
+        return 1
+    run = {'rosdistro': rosdistro, 'prefix': prefix,
+           'debian_revision': str(debian_revision)}
+    # Write the tags of all of the packages at the end, in one transaction,
+    # and journal each finished package so an interrupted run can resume
+    failed = []
+    with open_journal('generate-debian-all', run, resume) as journal:
+        with tag_batch():
+            for target in targets:
+                package = target[len('release/'):]
+                new_target = 'debian/' + rosdistro
+                debian_branch = new_target + '/' + package
+                if journal is not None \
+                   and journal.get(debian_branch, None, 'generate') \
+                   and journal.is_current(debian_branch):
+                    info("Skipping " + debian_branch + ", which was "
+                         "finished by the interrupted run")
+                    for tag in journal.tags(debian_branch):
+                        create_tag(tag[0], tag[1], tag[2])
+                    if results is not None:
+                        results.append((package, 0))
+                    continue
+                if journal is not None \
+                   and journal.get(debian_branch, None, 'branch') \
+                   and journal.is_current(debian_branch):
+                    info("Resuming " + debian_branch + ", which was "
+                         "branched by the interrupted run")
+                else:
+                    if journal is not None:
+                        journal.forget(debian_branch)
+                    # Branch first
+                    info("Branching to debian prefix with: git-bloom-branch "
+                         "--src " + target + " " + debian_branch)
+                    ret = branch_packages(target, new_target, True, False)
+                    if ret != 0:
+                        msg = "Command git-bloom-branch failed with return " \
+                              "code: " + str(ret)
+                        error(msg)
+                        # Leaving the batch with an error discards the queued
+                        # tags, the journal keeps the finished packages
+                        raise BloomError(msg, ret)
+                    if journal is not None:
+                        journal.record(debian_branch, None, 'branch',
+                                       debian_branch)
+                # Then generate
+                gen_args = ['-t', debian_branch,
+                            rosdistro, '--debian-revision',
+                            str(debian_revision)]
+                if not update_rosdep:
+                    gen_args.append('--do-not-update-rosdep')
+                elif rosdep_max_age is not None:
+                    gen_args.extend(['--rosdep-max-age', str(rosdep_max_age)])
+                info("Calling git-bloom-generate-debian-all " + \
+                     " ".join(gen_args))
+                ret = gendeb_main(gen_args)
+                # rosdep only needs to be updated for the first package
+                update_rosdep = False
+                if ret == 0 and journal is not None:
+                    journal.record(debian_branch, None, 'generate',
+                                   debian_branch)
+                if ret != 0:
+                    failed.append((package, ret))
+                if results is not None:
+                    results.append((package, ret))
+        if failed:
+            # Leaving the journal with an error keeps it for a resume
+            msg = "git-bloom-generate-debian failed for: " + \
+                ', '.join(package for package, ret in failed)
+            error(msg)
+            raise BloomError(msg, failed[0][1])
+    return 0
+
+
+def run_maintenance(before=None):
+    """
+    Packs the many debian branches and tags a run wrote, if enough.
+
+    This has to run once the tags are written, i.e. outside of any
+    :py:func:`tag_batch`, and a failure only warns, the result of the run
+    does not depend on it.
+
+    :param before: if given, the :py:func:`get_ref_stats` from before the
+        run, which are reported along with the ones after the maintenance
+    """
+    try:
+        commands = maintain_repository()
+        if before is not None:
+            for line in format_maintenance_report(before, get_ref_stats(),
+                                                  commands):
+                info(line)
+        elif commands:
+            info("Ran " + ', '.join(commands))
+    except CalledProcessError as err:
+        warning("The maintenance of the repository failed: " + str(err))
+
+
+def main(sysargs=None, maintain=True):
+    """
+    Runs git-bloom-generate-debian-all.
+
+    :param maintain: if False the maintenance of the repository is left to
+        the caller, e.g. if it writes the tags in an outer tag batch, see
+        :py:func:`run_maintenance`
+    """
+    parser = get_argument_parser()
+    args = parser.parse_args(sysargs)
+    before = get_ref_stats() if args.maintenance else None
+    try:
+        ret = generate_all(args.rosdistro, args.prefix, args.debian_revision,
+                           resume=args.resume,
+                           rosdep_max_age=args.rosdep_max_age)
+    except BloomError as err:
+        ret = err.returncode
+    if maintain:
+        run_maintenance(before)
+    return ret
@@ -0,0 +1,220 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Immutable stack data of the packages which debians are generated for.
+
+The stack data of a package, read from its package.xml or stack.xml, is a
+:py:class:`PackageMeta` record, and the data of each distro is a small
+:py:class:`DistroMeta` overlay with the resolved dependencies and the date,
+which shares the record of the package instead of copying it.  Both are read
+only mappings keyed by the names the templates use, e.g. ``Package`` or
+``Catkin-DebRulesType``, so their items can be the globals of ``em.expand``
+and they can be used with ``%`` formatting, and both can be pickled, e.g. to
+send them to a worker process.
+"""
+
+from __future__ import print_function
+
+from collections import Mapping
+
+# Attribute of each key of the stack data
+_package_fields = [
+    ('name', 'Name'),
+    ('version', 'Version'),
+    ('description', 'Description'),
+    ('homepage', 'Homepage'),
+    ('changelog_type', 'Catkin-ChangelogType'),
+    ('rules_type', 'Catkin-DebRulesType'),
+    ('rules_file', 'Catkin-DebRulesFile'),
+    ('copyright_type', 'Catkin-CopyrightType'),
+    ('copyright', 'copyright'),
+    ('debian_inc', 'DebianInc'),
+    ('package', 'Package'),
+    ('ros_distro', 'ROS_DISTRO'),
+    ('install_prefix', 'INSTALL_PREFIX'),
+    ('depends', 'Depends'),
+    ('build_depends', 'BuildDepends'),
+    ('maintainer', 'Maintainer'),
+]
+
+# Keys the overlay of a distro replaces or adds
+_distro_fields = [
+    ('distribution', 'Distribution'),
+    ('depends', 'Depends'),
+    ('build_depends', 'BuildDepends'),
+    ('date', 'Date'),
+    ('year', 'YYYY'),
+]
+
+
+# Keys whose values vary by distro, the dependencies are lists
+DISTRO_KEYS = [key for attr, key in _distro_fields]
+DISTRO_LIST_KEYS = ['Depends', 'BuildDepends']
+
+
+class _Record(object):
+    """
+    Read only mapping over the slots of a record.
+
+    It is not derived from Mapping, whose bases have no __slots__ in Python
+    2, which would give each record a __dict__, but it is registered as one.
+    """
+    __slots__ = ()
+    _fields = []
+    __hash__ = None
+
+    def __init__(self, *values):
+        if len(values) != len(self._fields):
+            raise TypeError("{0} takes {1} values, got {2}".format(
+                type(self).__name__, len(self._fields), len(values)))
+        for (attr, key), value in zip(self._fields, values):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{0} is immutable".format(type(self).__name__))
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, a) for a, k in self._fields))
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(a, getattr(self, a)) for a, k in self._fields))
+
+
+class PackageMeta(_Record):
+    """
+    The stack data of a package, which does not depend on the distro.
+
+    The dependencies are the frozensets of the keys in its package.xml or
+    stack.xml, they are resolved for each distro by :py:class:`DistroMeta`.
+    """
+    __slots__ = tuple(attr for attr, key in _package_fields)
+    _fields = _package_fields
+    _attrs = dict((key, attr) for attr, key in _package_fields)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates the record from a dict of the stack data.
+
+        Keys missing from data, e.g. the copyright of a package.xml, are None.
+        """
+        values = []
+        for attr, key in cls._fields:
+            value = data.get(key)
+            if attr in ['depends', 'build_depends']:
+                value = frozenset(value or ())
+            values.append(value)
+        return cls(*values)
+
+    def __getitem__(self, key):
+        return getattr(self, self._attrs[key])
+
+    def __iter__(self):
+        return iter(key for attr, key in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def for_distro(self, distribution, depends, build_depends, stamp):
+        """
+        Returns the overlay of this record for a distro.
+
+        :param distribution: the distro, e.g. ``precise``
+        :param depends: the resolved run dependencies
+        :param build_depends: the resolved build dependencies
+        :param stamp: the datetime of the release, with a timezone
+        :returns: :py:class:`DistroMeta`
+        """
+        return DistroMeta(self, distribution, tuple(depends),
+                          tuple(build_depends),
+                          stamp.strftime('%a, %d %b %Y %T %z'),
+                          stamp.strftime('%Y'))
+
+
+class DistroMeta(_Record):
+    """The stack data of a package for one distro, over its PackageMeta"""
+    __slots__ = ('base',) + tuple(attr for attr, key in _distro_fields)
+    _fields = [('base', None)] + _distro_fields
+    _attrs = dict((key, attr) for attr, key in _distro_fields)
+
+    def __getitem__(self, key):
+        if key in self._attrs:
+            return getattr(self, self._attrs[key])
+        return self.base[key]
+
+    def __iter__(self):
+        for key in self.base:
+            yield key
+        for attr, key in _distro_fields:
+            if key not in self.base._attrs:
+                yield key
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+Mapping.register(PackageMeta)
+Mapping.register(DistroMeta)
@@ -34,14 +34,230 @@
 
 from __future__ import print_function
 
-from subprocess import PIPE, CalledProcessError
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from subprocess import CalledProcessError, PIPE
+from subprocess import Popen
 
 from . logging import debug
+from . logging import error
 
 from . util import execute_command
 from . util import check_output
 
 
+# Environment variables which change how git finds the repository, if any of
+# these are set the git directory is not resolved in process
+_git_discovery_env = [
+    'GIT_DIR', 'GIT_WORK_TREE', 'GIT_COMMON_DIR', 'GIT_CEILING_DIRECTORIES',
+    'GIT_DISCOVERY_ACROSS_FILESYSTEM'
+]
+# Resolved repositories keyed by the absolute path they were queried from
+_git_dir_cache = {}
+# Parsed packed-refs files keyed by their path
+_packed_refs_cache = {}
+# Refs and objects written by bloom keyed by the repository they are in
+_written = {}
+# Written refs and objects after which maintain_repository packs the refs,
+# and repacks the loose objects, and the number of packs after which they
+# are consolidated into one
+_maintenance_limits = {'refs': 100, 'objects': 1000, 'packs': 20}
+
+
+def _stat_key(path):
+    """Returns a key which changes whenever the file at path is replaced"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _looks_like_git_dir(path):
+    return os.path.isfile(os.path.join(path, 'HEAD')) and \
+        os.path.isdir(os.path.join(path, 'objects')) and \
+        os.path.isdir(os.path.join(path, 'refs'))
+
+
+def _discover_git_dir(directory):
+    """
+    Walks up from directory looking for a .git directory or gitdir file.
+
+    :returns: (work tree root, git dir, common dir, path of .git) or None if
+        the layout is not one which can be resolved without git
+    """
+    path = os.path.realpath(directory)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            if not _looks_like_git_dir(dot_git):
+                return None
+            return (path, dot_git, dot_git, dot_git)
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules use a file pointing to the git dir
+            contents = _read_file(dot_git) or ''
+            if not contents.startswith('gitdir: '):
+                return None
+            git_dir = contents[len('gitdir: '):].strip()
+            git_dir = os.path.normpath(os.path.join(path, git_dir))
+            if not os.path.isfile(os.path.join(git_dir, 'HEAD')):
+                return None
+            common_dir = git_dir
+            commondir = _read_file(os.path.join(git_dir, 'commondir'))
+            if commondir is not None:
+                common_dir = os.path.normpath(
+                    os.path.join(git_dir, commondir.strip()))
+            return (path, git_dir, common_dir, dot_git)
+        if _looks_like_git_dir(path) or os.path.basename(path) == '.git':
+            # Inside of a bare repository or a .git directory
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _resolve_git_dir(directory=None):
+    """
+    Returns the (work tree root, git dir, common dir) for a directory.
+
+    The result is cached and revalidated against the mtimes of the queried
+    directory and of the .git entry it was found at.  None is returned if the
+    repository has to be resolved by git itself.
+    """
+    for var in _git_discovery_env:
+        if var in os.environ:
+            return None
+    key = os.path.abspath(directory if directory else os.getcwd())
+    cached = _git_dir_cache.get(key)
+    if cached is not None:
+        result, dot_git, stat_keys = cached
+        if (_stat_key(key), _stat_key(dot_git)) == stat_keys:
+            return result
+    found = _discover_git_dir(key)
+    if found is None:
+        _git_dir_cache.pop(key, None)
+        return None
+    root, git_dir, common_dir, dot_git = found
+    result = (root, git_dir, common_dir)
+    stat_keys = (_stat_key(key), _stat_key(dot_git))
+    _git_dir_cache[key] = (result, dot_git, stat_keys)
+    return result
+
+
+def _read_packed_refs(common_dir):
+    """Returns the packed refs of a repository as a dict, cached by mtime"""
+    path = os.path.join(common_dir, 'packed-refs')
+    stat_key = _stat_key(path)
+    if stat_key is None:
+        return {}
+    cached = _packed_refs_cache.get(path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    refs = {}
+    for line in (_read_file(path) or '').splitlines():
+        if not line or line[0] in '#^':
+            continue
+        sha, _, name = line.partition(' ')
+        refs[name] = sha
+    _packed_refs_cache[path] = (stat_key, refs)
+    return refs
+
+
+def _read_loose_ref(common_dir, ref):
+    """Returns the contents of a loose ref file or None if not found"""
+    contents = _read_file(os.path.join(common_dir, *ref.split('/')))
+    if contents is None:
+        return None
+    return contents.strip()
+
+
+def _ref_exists(common_dir, ref):
+    if _read_loose_ref(common_dir, ref):
+        return True
+    return ref in _read_packed_refs(common_dir)
+
+
+def get_git_dir(directory=None):
+    """
+    Returns the git directory of the repository containing directory.
+
+    For worktrees this is the per worktree git directory, which contains the
+    HEAD of the worktree.  None is returned if the git directory cannot be
+    determined without calling git, e.g. for bare repositories or if the
+    GIT_DIR environment variable is set.
+
+    :param directory: directory to query from, if None the cwd is used
+    :returns: absolute path of the git directory or None
+    """
+    resolved = _resolve_git_dir(directory)
+    return resolved[1] if resolved is not None else None
+
+
+def get_common_git_dir(directory=None):
+    """
+    Returns the git directory which holds the refs and objects of a repository.
+
+    This is the same as :py:func:`get_git_dir` except for worktrees.
+
+    :param directory: directory to query from, if None the cwd is used
+    :returns: absolute path of the common git directory or None
+    """
+    resolved = _resolve_git_dir(directory)
+    return resolved[2] if resolved is not None else None
+
+
+def list_refs(prefixes, directory=None):
+    """
+    Returns the refs under the given prefixes, read directly from the repo.
+
+    Loose refs take precedence over packed refs of the same name and symbolic
+    refs are not included.  None is returned if the repository could not be
+    resolved without git.
+
+    :param prefixes: list of ref prefixes, e.g. ``['refs/heads/']``
+    :param directory: directory to query from, if None the cwd is used
+    :returns: dict of full ref names to SHA-1 hashes, or None
+    """
+    common_dir = get_common_git_dir(directory)
+    if common_dir is None:
+        return None
+    refs = {}
+    for name, sha in _read_packed_refs(common_dir).items():
+        for prefix in prefixes:
+            if name.startswith(prefix):
+                refs[name] = sha
+                break
+    for prefix in prefixes:
+        base = os.path.join(common_dir, *prefix.rstrip('/').split('/'))
+        for root, dirs, files in os.walk(base):
+            rel = os.path.relpath(root, common_dir).replace(os.sep, '/')
+            for file_name in files:
+                if file_name.endswith('.lock'):
+                    continue
+                name = rel + '/' + file_name
+                contents = _read_loose_ref(common_dir, name)
+                if not contents or contents.startswith('ref: '):
+                    refs.pop(name, None)
+                    continue
+                refs[name] = contents
+    return refs
+
+
 def branch_exists(branch_name, local_only=False, directory=None):
     """
     Returns true if a given branch exists locally or remotelly
@@ -67,6 +283,84 @@ def branch_exists(branch_name, local_only=False, directory=None):
     return False
 
 
+# Branches to restore of the nested branch contexts, keyed by repository
+_branch_stacks = {}
+
+
+def get_repository_key(directory=None):
+    """
+    Returns the key of the in process state of a repository, e.g. its tag
+    batch or its journal.
+
+    The key is the same for every directory of a work tree.
+
+    :param directory: directory the state is for, if None the cwd is used
+    :returns: the root of the work tree, or the absolute path of directory
+        if it is not in one
+    """
+    root = get_root(directory)
+    if root is None:
+        return os.path.abspath(directory if directory else os.getcwd())
+    return os.path.realpath(root)
+
+
+def checkout(branch, directory=None):
+    """
+    Checks out the given branch, unless it is checked out already.
+
+    While inside of a :py:func:`branch_context`, checking out the branch
+    HEAD is on is skipped rather than calling out to git.  HEAD is read
+    again every time, so changes made by other git commands are seen.
+
+    :param branch: branch to checkout
+    :param directory: directory in which to run this command
+
+    :raises: subprocess.CalledProcessError if the git checkout call fails
+    """
+    if get_repository_key(directory) in _branch_stacks and \
+       get_current_branch(directory) == branch:
+        debug("Already on branch " + str(branch) + ", skipping checkout")
+        return
+    execute_command('git checkout {0}'.format(branch), cwd=directory)
+
+
+@contextmanager
+def branch_context(branch=None, directory=None):
+    """
+    Context manager for doing things in a different branch safely.
+
+    On entering, the given branch is checked out, unless it is None, in which
+    case the working branch is left as is.  On exiting, the branch which was
+    checked out on entering is checked out again.
+
+    Nested contexts share one stack per repository, whichever directory of
+    its work tree they are given, and entering or leaving a nested context
+    for the branch which is already checked out only reads HEAD, without
+    calling git.
+
+    :param branch: branch to switch to, or None to stay on the current branch
+    :param directory: directory in which to run this context
+
+    :raises: subprocess.CalledProcessError if either git checkout call fails
+    """
+    key = get_repository_key(directory)
+    stack = _branch_stacks.setdefault(key, [])
+    previous_branch = get_current_branch(directory)
+    stack.append(previous_branch)
+    try:
+        if branch is not None:
+            checkout(branch, directory)
+        yield
+    finally:
+        try:
+            if previous_branch is not None:
+                checkout(previous_branch, directory)
+        finally:
+            stack.pop()
+            if not stack:
+                del _branch_stacks[key]
+
+
 def inbranch(branch, directory=None):
     """
     Decorator for doing things in a different branch safely.
@@ -75,6 +369,9 @@ def inbranch(branch, directory=None):
     the target branch and back to the current branch no matter what the
     decorated function does (unless it deletes the current branch).
 
+    See :py:func:`branch_context`, which this decorator uses, for how nested
+    branch switches are collapsed.
+
     :param branch: branch to switch to before executing the decorated function
     :param directory: directory in which to run this decorator.
 
@@ -82,23 +379,395 @@ def inbranch(branch, directory=None):
 
     :raises: subprocess.CalledProcessError if either git checkout call fails
     """
-    current_branch = get_current_branch()
-
     def decorator(fn):
         def wrapper(*args, **kwargs):
-            execute_command('git checkout {0}'.format(branch), cwd=directory)
-            try:
-                result = fn(*args, **kwargs)
-            finally:
-                execute_command('git checkout {0}'.format(current_branch),
-                                cwd=directory)
-            return result
+            with branch_context(branch, directory=directory):
+                return fn(*args, **kwargs)
 
         return wrapper
 
     return decorator
 
 
+# Tags queued by tag_batch, keyed by get_repository_key
+_tag_batches = {}
+
+
+def resolve_commit(reference, directory=None):
+    """
+    Returns the full SHA-1 hash of the commit a reference points to.
+
+    HEAD is read from the git directory if possible, other references are
+    resolved with git rev-parse.
+
+    :param reference: reference to resolve, e.g. ``HEAD`` or a tag
+    :param directory: directory to query from, if None the cwd is used
+
+    :raises: subprocess.CalledProcessError if the reference does not exist
+    """
+    resolved = _resolve_git_dir(directory)
+    if reference == 'HEAD' and resolved is not None:
+        root, git_dir, common_dir = resolved
+        head = (_read_file(os.path.join(git_dir, 'HEAD')) or '').strip()
+        if head.startswith('ref: '):
+            ref = head[len('ref: '):]
+            head = _read_loose_ref(common_dir, ref) or \
+                _read_packed_refs(common_dir).get(ref, '')
+        if len(head) == 40:
+            return head
+    cmd = 'git rev-parse --verify {0}^{{commit}}'.format(reference)
+    return check_output(cmd, shell=True, cwd=directory).strip()
+
+
+def _write_tags(tags, directory=None):
+    """
+    Writes the given tags in one atomic ref transaction.
+
+    Annotated tag objects are written to the object database first, using a
+    single call to git hash-object, then all of the tag refs are updated using
+    a single call to git update-ref, which either updates all refs or none.
+
+    :param tags: list of (tag name, commit SHA-1, message or None) tuples
+    :param directory: directory in which to run the git commands
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    if not tags:
+        return
+    annotated = [tag for tag in tags if tag[2] is not None]
+    objects = {}
+    if annotated:
+        tagger = check_output('git var GIT_COMMITTER_IDENT', shell=True,
+                              cwd=directory).strip()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for index, (name, sha, message) in enumerate(annotated):
+                path = os.path.join(tmp_dir, str(index))
+                with open(path, 'w') as f:
+                    f.write('object {0}\ntype commit\ntag {1}\n'
+                            'tagger {2}\n\n{3}\n'.format(sha, name, tagger,
+                                                          message.rstrip()))
+                paths.append(path)
+            cmd = 'git hash-object -t tag -w --stdin-paths'
+            output = check_output(cmd, shell=True, cwd=directory,
+                                  input='\n'.join(paths) + '\n')
+        finally:
+            shutil.rmtree(tmp_dir)
+        for tag, tag_sha in zip(annotated, output.split()):
+            objects[tag[0]] = tag_sha
+    updates = []
+    for name, sha, message in tags:
+        updates.append('update refs/tags/{0} {1}\n'.format(
+            name, objects.get(name, sha)))
+    debug("Writing " + str(len(updates)) + " tags")
+    check_output('git update-ref --stdin', shell=True, cwd=directory,
+                 input=''.join(updates))
+    _count_written(directory, len(updates), len(objects))
+
+
+def create_tag(tag_name, reference='HEAD', message=None, directory=None):
+    """
+    Creates or moves (like ``git tag -f``) a tag to point at a reference.
+
+    If the message is not None an annotated tag is created.  Inside of a
+    :py:func:`tag_batch` the tag is only queued and written when the batch
+    ends, otherwise it is written immediately.
+
+    :param tag_name: name of the tag, without refs/tags/
+    :param reference: reference to tag, resolved to a commit immediately
+    :param message: message of the annotated tag, None for a lightweight tag
+    :param directory: directory in which to preform this action
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    tag = (tag_name, resolve_commit(reference, directory), message)
+    batch = _tag_batches.get(get_repository_key(directory))
+    if batch is None:
+        _write_tags([tag], directory)
+        return
+    debug("Queuing tag " + tag_name + " for " + tag[1])
+    # Moving a queued tag again replaces the earlier entry
+    batch[:] = [t for t in batch if t[0] != tag_name]
+    batch.append(tag)
+
+
+@contextmanager
+def tag_batch(directory=None):
+    """
+    Context manager which writes all tags created inside of it at once.
+
+    Tags created with :py:func:`create_tag` are queued and written in a single
+    atomic transaction when the outermost batch exits normally.  If the batch
+    is left with an exception the tags queued inside of it are discarded, so
+    an aborted run does not leave a partial set of tags behind.
+
+    :param directory: directory in which to preform this action
+
+    :raises: subprocess.CalledProcessError if writing the tags fails
+    """
+    key = get_repository_key(directory)
+    batch = _tag_batches.get(key)
+    outermost = batch is None
+    if outermost:
+        batch = _tag_batches[key] = []
+    savepoint = list(batch)
+    try:
+        yield
+    except BaseException:
+        debug("Discarding tags queued in the aborted tag batch")
+        if outermost:
+            del _tag_batches[key]
+        else:
+            batch[:] = savepoint
+        raise
+    if outermost:
+        del _tag_batches[key]
+        _write_tags(batch, directory)
+
+
+def commit_files(files, message, ref='HEAD', directory=None, parent=None):
+    """
+    Commits files on top of the tree of ref without a checkout.
+
+    Files whose content and mode are the same as in the tree of the parent
+    are skipped, and if none changed no commit is written at all.  The
+    other blobs are written with a single call to git hash-object, the tree
+    is built in a temporary index starting from the tree of the parent, and
+    the commit is written with git commit-tree.  Then ref is moved to the
+    commit, only if it still points to the parent, like ``git commit`` would
+    move HEAD.  Neither the index nor the working tree are touched, so a ref
+    which is not checked out can be committed to without changing branches,
+    and if ref is checked out :py:func:`sync_checkout` has to be called
+    afterwards.
+
+    :param files: dict of path to (mode, content), e.g. ``'100755'`` for an
+        executable file, other files in the tree are kept
+    :param message: commit message
+    :param ref: ref to commit to, e.g. ``HEAD`` or ``refs/heads/<branch>``,
+        or None to only write the commit
+    :param directory: directory in which to preform this action
+    :param parent: commit to commit on top of, by default the one ref
+        points to
+    :returns: the SHA-1 hash of the new commit, or of the parent if none of
+        the files changed
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    if parent is None:
+        parent = resolve_commit(ref, directory)
+    paths = get_changed_files(files, parent, directory)
+    if not paths:
+        debug("None of " + str(len(files)) + " files changed in " + parent)
+        return parent
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ)
+        env['GIT_INDEX_FILE'] = os.path.join(tmp_dir, 'index')
+        blob_paths = []
+        for index, path in enumerate(paths):
+            blob_path = os.path.join(tmp_dir, str(index))
+            with open(blob_path, 'wb') as f:
+                f.write(_encode(files[path][1]))
+            blob_paths.append(blob_path)
+        output = check_output('git hash-object -w --stdin-paths', shell=True,
+                              cwd=directory, env=env,
+                              input='\n'.join(blob_paths) + '\n')
+        entries = []
+        for path, blob in zip(paths, output.split()):
+            entries.append('{0} {1}\t{2}\n'.format(files[path][0], blob,
+                                                    path))
+        check_output(['git', 'read-tree', parent], cwd=directory, env=env)
+        check_output('git update-index --index-info', shell=True,
+                     cwd=directory, env=env, input=''.join(entries))
+        tree = check_output('git write-tree', shell=True, cwd=directory,
+                            env=env).strip()
+    finally:
+        shutil.rmtree(tmp_dir)
+    commit = check_output(['git', 'commit-tree', tree, '-p', parent],
+                          cwd=directory, input=message.rstrip() + '\n')
+    commit = commit.strip()
+    if ref is not None:
+        check_output(['git', 'update-ref', '-m', 'commit: ' +
+                      message.splitlines()[0], ref, commit, parent],
+                     cwd=directory)
+    # The blobs, the tree and the commit
+    _count_written(directory, 1 if ref is not None else 0, len(paths) + 2)
+    debug("Committed " + str(len(paths)) + " of " + str(len(files)) +
+          " files to " + (ref or parent) + " as " + commit)
+    return commit
+
+
+def get_changed_files(files, reference, directory=None):
+    """
+    Returns the files whose content or mode differ from the tree of reference.
+
+    :param files: dict of path to (mode, content), like for
+        :py:func:`commit_files`
+    :param reference: commit or tree to compare with
+    :param directory: directory in which to preform this action
+    :returns: sorted list of the paths which changed or are not in the tree
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    existing = list_tree(reference, sorted(files), directory)
+    paths = []
+    for path in sorted(files):
+        mode, content = files[path]
+        entry = existing.get(path)
+        if entry is None or entry[0] != mode or \
+           entry[2] != get_blob_hash(content):
+            paths.append(path)
+    return paths
+
+
+def _encode(content):
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return content
+
+
+def get_blob_hash(content):
+    """Returns the SHA-1 hash git gives a blob of content, without git"""
+    content = _encode(content)
+    return hashlib.sha1('blob {0}\0'.format(len(content)) + content) \
+        .hexdigest()
+
+
+def sync_checkout(old_commit, directory=None):
+    """
+    Updates the index and working tree after HEAD was moved by a commit.
+
+    Like the fast forward of a checkout, this only writes the files which
+    changed between old_commit and HEAD, and fails without changing anything
+    if they have local modifications.
+
+    :param old_commit: commit HEAD pointed to when the index was last updated
+    :param directory: directory in which to preform this action
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    head = resolve_commit('HEAD', directory)
+    if head == old_commit:
+        return
+    check_output(['git', 'read-tree', '-m', '-u', old_commit, head],
+                 cwd=directory)
+
+
+def list_tree(reference, paths=None, directory=None):
+    """
+    Lists the entries of the tree of a reference, without a checkout.
+
+    :param reference: commit or tree to list
+    :param paths: list of paths to list, relative to the root of the tree,
+        by default the entries at the root
+    :param directory: directory in which to preform this action
+    :returns: OrderedDict of path to (mode, type, SHA-1) of each entry, the
+        type is ``blob``, ``tree`` or ``commit``
+    """
+    cmd = ['git', 'ls-tree', '-z', '--full-tree', reference]
+    if paths:
+        cmd += ['--'] + list(paths)
+    entries = OrderedDict()
+    for entry in check_output(cmd, cwd=directory).split('\0'):
+        if entry:
+            info, path = entry.split('\t', 1)
+            entries[path] = tuple(info.split())
+    return entries
+
+
+def _get_refs(prefixes, directory=None):
+    """Like :py:func:`list_refs`, but asks git if it cannot read the refs"""
+    refs = list_refs(prefixes, directory)
+    if refs is None:
+        refs = {}
+        out = check_output(['git', 'for-each-ref', '--format=%(objectname) '
+                            '%(refname)'] + list(prefixes), cwd=directory)
+        for line in out.splitlines():
+            sha, ref = line.split(' ', 1)
+            refs[ref] = sha
+    return refs
+
+
+def record_refs(remote='origin', directory=None):
+    """
+    Returns the branches and tags of a remote, as of the last fetch.
+
+    The branches are read from the remote tracking branches, and the tags
+    from the local tags, which are all of the tags of the remote in a fresh
+    clone of it.  Pass the result to :py:func:`get_ref_changes` to find the
+    refs a command created, moved or deleted since.
+
+    :param remote: name of the remote
+    :param directory: directory in which to preform this action
+    :returns: dict of ref, e.g. ``refs/heads/upstream``, to SHA-1 hash
+    """
+    prefix = 'refs/remotes/' + remote + '/'
+    refs = {}
+    for ref, sha in _get_refs([prefix, 'refs/tags/'], directory).items():
+        if ref.startswith(prefix):
+            if ref != prefix + 'HEAD':
+                refs['refs/heads/' + ref[len(prefix):]] = sha
+        else:
+            refs[ref] = sha
+    return refs
+
+
+def get_ref_changes(recorded, directory=None):
+    """
+    Returns the branches and tags which changed since they were recorded.
+
+    Local branches and tags which are new or point elsewhere are changes,
+    and so are recorded tags which were deleted.  Recorded branches which
+    do not exist locally were never checked out, so they did not change.
+
+    :param recorded: dict of ref to SHA-1 hash from :py:func:`record_refs`
+    :param directory: directory in which to preform this action
+    :returns: sorted list of (ref, old SHA-1 or None, new SHA-1 or None)
+    """
+    current = _get_refs(['refs/heads/', 'refs/tags/'], directory)
+    changes = []
+    for ref in sorted(set(current) | set(recorded)):
+        old = recorded.get(ref)
+        new = current.get(ref)
+        if new is None and not ref.startswith('refs/tags/'):
+            continue
+        if old != new:
+            changes.append((ref, old, new))
+    return changes
+
+
+def push_ref_changes(changes, remote='origin', directory=None):
+    """
+    Pushes exactly the given ref changes to a remote, in one atomic push.
+
+    Each ref is pushed with ``--force-with-lease`` against its old value, so
+    nothing is pushed if any of the refs changed on the remote since they
+    were recorded, and the other refs of the remote are not even compared.
+
+    :param changes: list of (ref, old, new) from :py:func:`get_ref_changes`
+    :param remote: name or url of the remote
+    :param directory: directory in which to preform this action
+    :returns: the return code of git push, 0 if there were no changes
+    """
+    if not changes:
+        debug("No refs changed, nothing to push to " + remote)
+        return 0
+    cmd = ['git', 'push', '--atomic', '--porcelain']
+    refspecs = []
+    for ref, old, new in changes:
+        cmd.append('--force-with-lease={0}:{1}'.format(ref, old or ''))
+        refspecs.append('{0}:{1}'.format(ref if new else '', ref))
+    debug("Pushing " + ', '.join(ref for ref, old, new in changes) +
+          " to " + remote)
+    p = Popen(cmd + [remote] + refspecs, cwd=directory, stdout=PIPE,
+              stderr=PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        error("Pushing to {0} failed:\n{1}{2}".format(remote, out, err))
+    return p.returncode
+
+
 def get_commit_hash(reference, directory=None):
     """
     Returns the SHA-1 commit hash for the given reference.
@@ -143,6 +812,17 @@ def get_branches(local_only=False, directory=None):
 
     :raises: subprocess.CalledProcessError if any git calls fail
     """
+    prefixes = ['refs/heads/'] if local_only else \
+        ['refs/heads/', 'refs/remotes/']
+    refs = list_refs(prefixes, directory)
+    if refs is not None:
+        branches = []
+        for ref in sorted(refs):
+            if ref.startswith('refs/heads/'):
+                branches.append(ref[len('refs/heads/'):])
+            else:
+                branches.append(ref[len('refs/'):])
+        return branches
     cmd = 'git branch --no-color'
     if not local_only:
         cmd += ' -a'
@@ -187,13 +867,12 @@ def create_branch(branch, orphaned=False, changeto=False, directory=None):
         else:
             execute_command('git branch {0}'.format(branch), cwd=directory)
             if changeto:
-                execute_command('git checkout {0}'.format(branch),
-                                cwd=directory)
+                checkout(branch, directory)
             current_branch = None
+        _count_written(directory, 1, 2 if orphaned else 0)
     finally:
         if current_branch is not None:
-            execute_command('git checkout {0}'.format(current_branch),
-                            cwd=directory)
+            checkout(current_branch, directory)
 
 
 def get_root(directory=None):
@@ -205,6 +884,9 @@ def get_root(directory=None):
     :param directory: directory to query from, if None the cwd is used
     :returns: root of git repository or None if not a git repository
     """
+    resolved = _resolve_git_dir(directory)
+    if resolved is not None:
+        return resolved[0]
     cmd = 'git rev-parse --show-toplevel'
     try:
         output = check_output(cmd, shell=True, cwd=directory)
@@ -215,7 +897,10 @@ def get_root(directory=None):
 
 def get_current_branch(directory=None):
     """
-    Returns the current git branch by parsing the output of `git branch`
+    Returns the current git branch by reading HEAD from the git directory
+
+    If the repository layout is not understood the output of `git branch` is
+    parsed instead.
 
     This will raise a RuntimeError if the current working directory is not
     a git repository.  If no branch could be determined it will return None,
@@ -226,6 +911,20 @@ def get_current_branch(directory=None):
 
     :raises: subprocess.CalledProcessError if git command fails
     """
+    resolved = _resolve_git_dir(directory)
+    if resolved is not None:
+        root, git_dir, common_dir = resolved
+        head = _read_file(os.path.join(git_dir, 'HEAD'))
+        if head is not None:
+            head = head.strip()
+            if not head.startswith('ref: refs/heads/'):
+                # Detached HEAD
+                return None
+            ref = head[len('ref: '):]
+            if not _ref_exists(common_dir, ref):
+                # Unborn branch, e.g. in a freshly initialized repository
+                return None
+            return ref[len('refs/heads/'):]
     cmd = 'git branch --no-color'
     output = check_output(cmd, shell=True, cwd=directory)
     output = output.splitlines()
@@ -253,9 +952,8 @@ def track_branches(branches=None, directory=None):
         branches = [branches]
     if branches == []:
         return
-    # Save the current branch
-    current_branch = get_current_branch(directory)
-    try:
+    # Return to the current branch afterwards
+    with branch_context(directory=directory):
         # Get the local branches
         local_branches = get_branches(local_only=True, directory=directory)
         # Get the remote and local branches
@@ -279,25 +977,143 @@ def track_branches(branches=None, directory=None):
         # Track branches
         debug("Tracking branches: " + str(branches_to_track))
         for branch in branches_to_track:
-            execute_command('git checkout ' + branch, cwd=directory)
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
+            checkout(branch, directory)
 
 
 def get_last_tag_by_date(directory=None):
     """
     Returns the most recent, by date, tag in the given local git repository.
 
+    The tags are looked up in the tag index of the repository, see
+    :py:func:`bloom.tag_index.get_tag_index`.
+
     :param directory: the directory in which to run the query
     :returns: the most recent tag by date, else '' if there are no tags
 
     :raises: subprocess.CalledProcessError if git command fails
     """
-    cmd = "git for-each-ref --sort='*authordate' " \
-          "--format='%(refname:short)' refs/tags/upstream"
-    output = check_output(cmd, shell=True, cwd=directory, stderr=PIPE)
-    output = output.splitlines()
-    if len(output) == 0:
+    from . tag_index import get_tag_index
+    record = get_tag_index(directory).latest_upstream()
+    if record is None:
         return ''
-    return output[-1]
+    return str(record.name)
+
+
+def _maintenance_git_dir(directory=None):
+    git_dir = get_common_git_dir(directory)
+    if git_dir is None:
+        git_dir = check_output(['git', 'rev-parse', '--git-common-dir'],
+                               cwd=directory).strip()
+        git_dir = os.path.join(directory if directory else os.getcwd(),
+                               git_dir)
+    return os.path.abspath(git_dir)
+
+
+def _written_key(directory):
+    return get_common_git_dir(directory) or \
+        os.path.abspath(directory if directory else os.getcwd())
+
+
+def _count_written(directory, refs, objects):
+    """Counts the refs and objects bloom wrote to a repository"""
+    key = _written_key(directory)
+    written = _written.setdefault(key, {'refs': 0, 'objects': 0})
+    written['refs'] += refs
+    written['objects'] += objects
+
+
+def get_written(directory=None):
+    """
+    Returns how many refs and objects bloom wrote to a repository.
+
+    Only the writes of this process since the last
+    :py:func:`maintain_repository` of the repository are counted.
+
+    :param directory: directory to query from, if None the cwd is used
+    :returns: dict with the number of written ``refs`` and ``objects``
+    """
+    key = _written_key(directory)
+    return dict(_written.get(key, {'refs': 0, 'objects': 0}))
+
+
+def get_ref_stats(directory=None, lookups=3):
+    """
+    Returns the number of refs and objects of a repository, and how long it
+    takes git to list all of the refs.
+
+    :param directory: directory to query from, if None the cwd is used
+    :param lookups: the lookup time is the fastest of this many listings
+    :returns: dict with the number of ``loose_refs``, ``packed_refs``,
+        ``loose_objects`` and ``packs``, and the ``lookup`` seconds
+    """
+    git_dir = _maintenance_git_dir(directory)
+    loose_refs = 0
+    for root, dirs, files in os.walk(os.path.join(git_dir, 'refs')):
+        loose_refs += len([f for f in files if not f.endswith('.lock')])
+    counts = {}
+    for line in check_output(['git', 'count-objects', '-v'],
+                             cwd=git_dir).splitlines():
+        key, _, value = line.partition(':')
+        counts[key.strip()] = value.strip()
+    lookup = None
+    for index in range(lookups):
+        start = time.time()
+        check_output(['git', 'for-each-ref'], cwd=git_dir)
+        elapsed = time.time() - start
+        lookup = elapsed if lookup is None else min(lookup, elapsed)
+    return {'loose_refs': loose_refs,
+            'packed_refs': len(_read_packed_refs(git_dir)),
+            'loose_objects': int(counts.get('count', 0)),
+            'packs': int(counts.get('packs', 0)),
+            'lookup': lookup}
+
+
+def maintain_repository(directory=None, force=False):
+    """
+    Packs the refs and repacks the objects bloom wrote to a repository.
+
+    Called at the end of bulk operations.  Once bloom wrote more refs than
+    the limit the loose refs are packed, as each loose ref is a file which
+    git scans when listing refs.  Once it wrote more objects than the limit
+    the loose objects are packed into a new pack, and if there are too many
+    packs they are consolidated into one.  Objects borrowed from alternates,
+    e.g. an object store, are not copied into the packs.
+
+    :param directory: directory in which to preform this action
+    :param force: if True the refs and objects are packed regardless of the
+        limits
+    :returns: list of the git commands run, e.g. ``['git pack-refs --all']``
+
+    :raises: subprocess.CalledProcessError if any git calls fail
+    """
+    written = get_written(directory)
+    commands = []
+    if force or written['refs'] >= _maintenance_limits['refs']:
+        commands.append(['git', 'pack-refs', '--all'])
+    if force or written['objects'] >= _maintenance_limits['objects']:
+        commands.append(['git', 'repack', '-d', '-l', '-q'])
+        packs = get_ref_stats(directory, lookups=0)['packs']
+        if packs + 1 > _maintenance_limits['packs']:
+            commands.append(['git', 'repack', '-a', '-d', '-l', '-q'])
+    git_dir = _maintenance_git_dir(directory)
+    for cmd in commands:
+        debug("Running " + ' '.join(cmd) + " in " + git_dir)
+        check_output(cmd, cwd=git_dir)
+    _written.pop(_written_key(directory), None)
+    return [' '.join(cmd) for cmd in commands]
+
+
+def format_maintenance_report(before, after, commands):
+    """Returns the stats before and after maintain_repository as lines"""
+    lines = []
+    for label, loose, packed in [('Refs', 'loose_refs', 'packed_refs'),
+                                 ('Objects', 'loose_objects', 'packs')]:
+        unit = 'packed' if packed == 'packed_refs' else 'packs'
+        lines.append('{0}: {1} loose, {2} {3} -> {4} loose, {5} {3}'.format(
+            label, before[loose], before[packed], unit, after[loose],
+            after[packed]))
+    lines.append('Ref lookup: {0:.1f}ms -> {1:.1f}ms'.format(
+        before['lookup'] * 1000, after['lookup'] * 1000))
+    lines.append('Ran: ' + (', '.join(commands) if commands else 'nothing, '
+                            'the limits were not reached'))
+    return lines
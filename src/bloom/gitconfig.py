@@ -0,0 +1,304 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Reads and writes git config formatted files, like bloom.conf, in process.
+
+These produce the same results as ``git config -f <file>`` for the simple
+``[section]`` and ``key = value`` files bloom uses, without calling git once
+per key.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+
+from collections import OrderedDict
+
+from subprocess import PIPE, CalledProcessError
+
+from . util import check_output
+
+_section_re = re.compile(
+    r'^\s*\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+_key_re = re.compile(r'^\s*([A-Za-z][A-Za-z0-9-]*)\s*(=|$|[#;])')
+_escapes = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+
+def _section_key(section, subsection=None):
+    """Returns the lower cased section, keeping the subsection's case"""
+    if subsection is None and '.' in section:
+        section, subsection = section.split('.', 1)
+    if subsection is None:
+        return section.lower()
+    return section.lower() + '.' + subsection
+
+
+def _match_section(line):
+    """Returns (section key, rest of the line) or None for non headers"""
+    match = _section_re.match(line)
+    if match is None:
+        return None
+    subsection = match.group(2)
+    if subsection is not None:
+        subsection = re.sub(r'\\(.)', r'\1', subsection)
+    return _section_key(match.group(1), subsection), line[match.end():]
+
+
+def _parse_value(lines, index, value):
+    """
+    Parses a value, which may continue over several lines.
+
+    :returns: (parsed value, index of the last line of the value)
+    """
+    result = []
+    spaces = ''
+    quoted = False
+    pos = 0
+    while True:
+        if pos >= len(value):
+            if quoted:
+                raise ValueError("Unterminated quote on line {0}"
+                                 .format(index + 1))
+            break
+        c = value[pos]
+        pos += 1
+        if c == '\\':
+            if pos >= len(value):
+                # Line continuation
+                index += 1
+                if index >= len(lines):
+                    break
+                value = lines[index]
+                pos = 0
+                continue
+            escaped = value[pos]
+            pos += 1
+            if escaped not in _escapes:
+                raise ValueError("Invalid escape on line {0}"
+                                 .format(index + 1))
+            result.append(spaces + _escapes[escaped])
+            spaces = ''
+        elif c == '"':
+            result.append(spaces)
+            spaces = ''
+            quoted = not quoted
+        elif not quoted and c in ' \t':
+            if result:
+                spaces += ' '
+        elif not quoted and c in '#;':
+            break
+        else:
+            result.append(spaces + c)
+            spaces = ''
+    return ''.join(result), index
+
+
+def parse_config(text):
+    """
+    Parses the contents of a git config file.
+
+    Section and key names are lower cased, as git does, and the last value
+    given for a key wins.
+
+    :param text: contents of the config file
+    :returns: dict of ``section.key`` (or ``section.subsection.key``) to value
+
+    :raises: ValueError if the text is not valid git config syntax
+    """
+    config = {}
+    section = None
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        stripped = line.strip()
+        if not stripped or stripped[0] in '#;':
+            index += 1
+            continue
+        header = _match_section(line)
+        if header is not None:
+            section, line = header
+            if not line.strip() or line.strip()[0] in '#;':
+                index += 1
+                continue
+        match = _key_re.match(line)
+        if match is None or section is None:
+            raise ValueError("Invalid config line {0}: {1}"
+                             .format(index + 1, line))
+        key = section + '.' + match.group(1).lower()
+        if match.group(2) == '=':
+            value, index = _parse_value(lines, index, line[match.end():])
+        else:
+            # A key without a value is a boolean true
+            value = 'true'
+        config[key] = value
+        index += 1
+    return config
+
+
+def read_config(path):
+    """
+    Reads a git config file, returning None if it does not exist.
+
+    :param path: path to the config file
+    :returns: dict as returned by :py:func:`parse_config` or None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return parse_config(f.read())
+
+
+def read_config_blob(reference, path, directory=None):
+    """
+    Reads a git config file from a commit, without checking it out.
+
+    :param reference: branch, tag or commit containing the file
+    :param path: path of the file relative to the root of the repository
+    :param directory: directory in which to run the git command
+    :returns: dict as returned by :py:func:`parse_config` or None if the file
+        does not exist in the given reference
+    """
+    cmd = 'git cat-file blob {0}:{1}'.format(reference, path)
+    try:
+        text = check_output(cmd, shell=True, cwd=directory, stderr=PIPE)
+    except CalledProcessError:
+        return None
+    return parse_config(text)
+
+
+def format_value(value):
+    """Returns a value quoted and escaped the way git config writes it"""
+    quote = ''
+    if value and (value[0] == ' ' or value[-1] == ' '):
+        quote = '"'
+    if '#' in value or ';' in value:
+        quote = '"'
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    value = value.replace('\n', '\\n').replace('\t', '\\t')
+    return quote + value + quote
+
+
+def _format_pair(name, value):
+    return '\t{0} = {1}\n'.format(name, format_value(value))
+
+
+def write_config(path, values):
+    """
+    Sets keys in a git config file, creating the file if needed.
+
+    Existing keys are replaced in place and new keys are added to the end of
+    their section, like ``git config -f <path> <key> <value>`` would, but all
+    of the keys are written with one atomic replacement of the file.
+
+    :param path: path to the config file
+    :param values: list of (``section.key``, value) pairs, or a dict
+    """
+    if hasattr(values, 'items'):
+        values = list(values.items())
+    # A key given more than once keeps its first position and last value
+    pairs = OrderedDict()
+    for key, value in values:
+        section, name = key.rsplit('.', 1)
+        pairs.setdefault(_section_key(section) + '.' + name.lower(),
+                         [key, value])[1] = value
+    lines = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            lines = f.read().splitlines(True)
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+    # Find the last line of each section and the first and last line of
+    # each key, whose value may be continued over several lines
+    stripped = [line.rstrip('\r\n') for line in lines]
+    section = None
+    section_ends = {}
+    key_lines = {}
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        header = _match_section(line)
+        if header is not None:
+            section = header[0]
+            section_ends[section] = index
+            index += 1
+            continue
+        match = _key_re.match(line) if section is not None else None
+        if match is not None and not line.strip()[0] in '#;':
+            start = index
+            if match.group(2) == '=':
+                try:
+                    index = _parse_value(stripped, index,
+                                         stripped[index][match.end():])[1]
+                except ValueError:
+                    pass
+            key_lines[section + '.' + match.group(1).lower()] = \
+                (start, index)
+            section_ends[section] = index
+        index += 1
+    inserts = {}
+    appended = OrderedDict()
+    for key, value in pairs.values():
+        section, name = key.rsplit('.', 1)
+        section = _section_key(section)
+        full_key = section + '.' + name.lower()
+        if full_key in key_lines:
+            start, end = key_lines[full_key]
+            lines[start] = _format_pair(name, value)
+            for index in range(start + 1, end + 1):
+                lines[index] = ''
+        elif section in section_ends:
+            inserts.setdefault(section_ends[section], []).append(
+                _format_pair(name, value))
+        else:
+            appended.setdefault(section, []).append(_format_pair(name, value))
+    result = []
+    for index, line in enumerate(lines):
+        result.append(line)
+        result.extend(inserts.get(index, []))
+    for section, pairs in appended.items():
+        if '.' in section:
+            section, sub = section.split('.', 1)
+            sub = sub.replace('\\', '\\\\').replace('"', '\\"')
+            result.append('[{0} "{1}"]\n'.format(section, sub))
+        else:
+            result.append('[{0}]\n'.format(section))
+        result.extend(pairs)
+    # Replace the file atomically, keeping its permissions
+    tmp_path = path + '.lock'
+    with open(tmp_path, 'w') as f:
+        f.write(''.join(result))
+    if os.path.exists(path):
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+    os.rename(tmp_path, path)
@@ -33,7 +33,6 @@
 from __future__ import print_function
 
 import os
-import sys
 import argparse
 import shutil
 import traceback
@@ -48,24 +47,35 @@ from . util import bailout, execute_command, ansi, parse_stack_xml
 from . util import assert_is_not_gbp_repo, create_temporary_directory
 from . util import get_versions_from_upstream_tag, segment_version
 from . git import branch_exists
+from . git import checkout
 from . git import get_current_branch
 from . git import get_last_tag_by_date
+from . git import get_ref_changes
 from . git import get_root
+from . git import push_ref_changes
+from . git import record_refs
 from . git import track_branches
 
+from . gitconfig import read_config
+
 from . logging import debug
 from . logging import error
 from . logging import info
 from . logging import log_prefix
 from . logging import warning
 
-from distutils.version import StrictVersion
+from . packages import find_packages
+from . phases import format_seconds
+from . phases import run_phases
 
-try:
-    from vcstools import VcsClient
-except ImportError:
-    error("vcstools was not detected, please install it.", file=sys.stderr)
-    sys.exit(1)
+
+def _get_vcs_client(vcs_type, path):
+    """Imports vcstools on first use, it is slow to import"""
+    try:
+        from vcstools import VcsClient
+    except ImportError:
+        bailout("vcstools was not detected, please install it.")
+    return VcsClient(vcs_type, path)
 
 
 def convert_catkin_to_bloom(cwd=None):
@@ -75,7 +85,7 @@ def convert_catkin_to_bloom(cwd=None):
     # Rename the branch to bloom from catkin
     execute_command('git branch -m catkin bloom', cwd=cwd)
     # Change to the bloom branch
-    execute_command('git checkout bloom', cwd=cwd)
+    checkout('bloom', cwd)
     # Rename the config cwd
     if os.path.exists(os.path.join(cwd, 'catkin.conf')):
         execute_command('git mv catkin.conf bloom.conf', cwd=cwd)
@@ -115,7 +125,7 @@ def check_for_bloom(cwd=None):
             convert_catkin_to_bloom(cwd)
     # Check for bloom.conf
     try:
-        execute_command('git checkout bloom', cwd=cwd)
+        checkout('bloom', cwd)
     except CalledProcessError:
         not_a_bloom_release_repo()
     loc = os.path.join(cwd, 'bloom.conf') if cwd is not None else 'bloom.conf'
@@ -128,16 +138,15 @@ def parse_bloom_conf(cwd=None):
     """
     Parses the bloom.conf file in the current directory and returns info in it.
     """
-    cmd = 'git config -f bloom.conf bloom.upstream'
-    upstream_repo = check_output(cmd, shell=True, cwd=cwd).strip()
-    cmd = 'git config -f bloom.conf bloom.upstreamtype'
-    upstream_type = check_output(cmd, shell=True, cwd=cwd).strip()
-    try:
-        cmd = 'git config -f bloom.conf bloom.upstreambranch'
-        upstream_branch = check_output(cmd, shell=True, cwd=cwd).strip()
-    except CalledProcessError:
-        upstream_branch = ''
-    return upstream_repo, upstream_type, upstream_branch
+    config = read_config(os.path.join(cwd or os.getcwd(), 'bloom.conf'))
+    if config is None:
+        bailout("No bloom.conf found in the bloom branch.")
+    for key in ['bloom.upstream', 'bloom.upstreamtype']:
+        if key not in config:
+            bailout("The bloom.conf file does not specify " + key)
+    return (config['bloom.upstream'].strip(),
+            config['bloom.upstreamtype'].strip(),
+            config.get('bloom.upstreambranch', '').strip())
 
 
 def create_initial_upstream_branch(cwd=None):
@@ -185,12 +194,9 @@ def get_upstream_meta(upstream_dir):
     info("Checking for package.xml(s)")
     # Check for package.xml(s)
     try:
-        from catkin_pkg.packages import find_packages
         from catkin_pkg.packages import verify_equal_package_versions
     except ImportError:
-        error("catkin_pkg was not detected, please install it.",
-              file=sys.stderr)
-        sys.exit(1)
+        bailout("catkin_pkg was not detected, please install it.")
     packages = find_packages(basepath=upstream_dir)
     if packages == {}:
         info("package.xml(s) not found, looking for stack.xml")
@@ -227,12 +233,17 @@ def import_upstream(cwd, tmp_dir, args):
     # Create a clone of the bloom_repo to help isolate the activity
     bloom_repo_clone_dir = os.path.join(tmp_dir, 'bloom_clone')
     os.makedirs(bloom_repo_clone_dir)
+    # The clone borrows the objects of the repository, and of its object
+    # store, instead of copying them
+    check_output(['git', 'clone', '-q', '--shared', cwd,
+                  bloom_repo_clone_dir])
     os.chdir(bloom_repo_clone_dir)
-    bloom_repo = VcsClient('git', bloom_repo_clone_dir)
-    bloom_repo.checkout('file://{0}'.format(cwd))
+    bloom_repo = _get_vcs_client('git', bloom_repo_clone_dir)
 
     # Ensure the bloom and upstream branches are tracked from the original
     track_branches(['bloom', 'upstream'])
+    # Only the refs this import changes are pushed back at the end
+    recorded_refs = record_refs()
 
     # Check for a bloom branch
     check_for_bloom(os.getcwd())
@@ -243,15 +254,9 @@ def import_upstream(cwd, tmp_dir, args):
     # Summarize the config contents
     summarize_repo_info(upstream_repo, upstream_type, upstream_branch)
 
-    # If the upstream repo is git, then assert some things about the repo
-    if upstream_type == 'git':
-        info("Verifying a couple of things about the upstream git repo...")
-        # Ensure the upstream repo is not setup as a gbp
-        assert_is_not_gbp_repo(upstream_repo)
-
     # Checkout upstream
     upstream_dir = os.path.join(tmp_dir, 'upstream')
-    upstream_client = VcsClient(upstream_type, upstream_dir)
+    upstream_client = _get_vcs_client(upstream_type, upstream_dir)
     if args.upstream_branch != None:
         ver = args.upstream_branch
         warning("Overriding the bloom.conf branch with {0}".format(ver))
@@ -273,9 +278,25 @@ def import_upstream(cwd, tmp_dir, args):
         debug("Checking out branch "
           "({0}) from url {1}".format(checkout_ver, checkout_url))
 
+    def validate():
+        # If the upstream repo is git, then assert some things about the repo
+        if upstream_type == 'git':
+            info("Verifying a couple of things about the upstream git "
+                 "repo...")
+            # Ensure the upstream repo is not setup as a gbp
+            assert_is_not_gbp_repo(upstream_repo)
+
     # XXX TODO: Need to validate if ver is valid for the upstream repo...
     # see: https://github.com/vcstools/vcstools/issues/4
-    if not upstream_client.checkout(checkout_url, checkout_ver):
+    # The checkout does not wait for the validation, if that fails the
+    # checkout is thrown away with tmp_dir
+    results, seconds = run_phases([
+        ('validate', validate, []),
+        ('checkout', lambda: upstream_client.checkout(checkout_url,
+                                                      checkout_ver), []),
+    ])
+    debug("Time per phase:\n" + format_seconds(seconds))
+    if not results['checkout']:
         if upstream_type == 'svn':
             error(
                 "Could not checkout upstream repostiory "
@@ -317,7 +338,8 @@ def import_upstream(cwd, tmp_dir, args):
     # Change upstream_client for svn
     export_version = version
     if upstream_type == 'svn':
-        upstream_client = VcsClient('svn', os.path.join(tmp_dir, 'svn_tag'))
+        upstream_client = _get_vcs_client('svn',
+                                          os.path.join(tmp_dir, 'svn_tag'))
         checkout_url = upstream_repo + '/tags/' + version
         if not upstream_client.checkout(checkout_url):
             warning("Didn't find the tagged version at " + checkout_url)
@@ -341,6 +363,7 @@ def import_upstream(cwd, tmp_dir, args):
         info("The latest upstream tag in the release repository is "
               + ansi('boldon') + last_tag + ansi('reset'))
         # Ensure the new version is greater than the last tag
+        from distutils.version import StrictVersion
         full_version_strict = StrictVersion(version)
         last_tag_version = '.'.join([gbp_major, gbp_minor, gbp_patch])
         last_tag_version_strict = StrictVersion(last_tag_version)
@@ -361,9 +384,8 @@ The upstream version, {0}, is equal to a previous import version. \
 Removing conflicting tag before continuing because the '--replace' \
 options was specified.\
 """.format(version))
+                # The deletion is pushed with the rest of the import
                 execute_command('git tag -d {0}'.format(last_tag))
-                execute_command('git push origin :refs/tags/'
-                                '{0}'.format(last_tag))
             else:
                 warning("""\
 Version discrepancy:
@@ -399,9 +421,15 @@ upstream import use the '--replace' option.\
     except CalledProcessError:
         bailout("git-import-orig failed '{0}'".format(cmd))
 
-    # Push changes back to the original bloom repo
-    execute_command('git push --all -f')
-    execute_command('git push --tags')
+    # Push the refs the import changed back to the original bloom repo, all
+    # or nothing, and only if the original did not change in the meantime
+    changes = get_ref_changes(recorded_refs)
+    if push_ref_changes(changes) != 0:
+        error("Failed to push the import back to " + cwd)
+        return 1
+    for ref, old, new in changes:
+        debug("Pushed " + ref + ": " + (old or '(new)') + " -> " +
+              (new or '(deleted)'))
 
 
 def get_argument_parser():
@@ -472,4 +500,4 @@ def main(sysargs=None):
         # Clean up
         shutil.rmtree(tmp_dir)
         if current_branch and branch_exists(current_branch, True, cwd):
-            execute_command('git checkout ' + current_branch, cwd)
+            checkout(current_branch, cwd)
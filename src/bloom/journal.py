@@ -0,0 +1,257 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Checkpoint journal of the finished units of work of a run, used to resume it.
+
+A unit is a (branch, distro, step) triple, e.g. the generation of the debian
+for one ubuntu distro on one debian branch, and it is recorded with the commit
+it produced and the tags it created.  The journal of a run is appended to as
+each unit finishes, under ``.git/bloom/journal/``, and removed when the run
+finishes.  If the run is interrupted it is left behind, and the next run with
+the same arguments can resume by skipping the units whose commits are still
+on their branches, queueing their tags again instead of recreating them.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+
+from contextlib import contextmanager
+from subprocess import PIPE, Popen
+
+from . git import get_common_git_dir
+from . git import get_repository_key
+from . git import resolve_commit
+from . logging import debug
+from . logging import warning
+
+# Active journals, keyed by get_repository_key
+_journals = {}
+
+
+def _journal_path(common_dir, name):
+    return os.path.join(common_dir, 'bloom', 'journal', name + '.jsonl')
+
+
+class Journal(object):
+    """
+    Journal of the units finished by a run.
+
+    :ivar run: dict of the arguments of the run
+    :ivar resumed: True if units of an earlier run were loaded
+    """
+
+    def __init__(self, path, run, units=None, directory=None):
+        self.path = path
+        self.run = run
+        self.resumed = bool(units)
+        self._units = units if units is not None else {}
+        self._next_index = max([r['index'] for r in self._units.values()] +
+                               [-1]) + 1
+        self._directory = directory
+        self._file = None
+
+    @staticmethod
+    def _key(branch, distro, step):
+        return (branch, distro or '', step)
+
+    def get(self, branch, distro, step):
+        """
+        Returns the record of a finished unit, or None.
+
+        The record is a dict with the ``sha`` of the commit the unit produced
+        and the ``tags`` it created, as (name, sha, message) lists.
+        """
+        return self._units.get(self._key(branch, distro, step))
+
+    def tags(self, branch):
+        """Returns the tags created by the finished units of a branch"""
+        tags = []
+        for key in sorted(self._units):
+            if key[0] == branch:
+                tags.extend(tuple(t) for t in self._units[key]['tags'])
+        return tags
+
+    def is_current(self, branch, reference=None):
+        """
+        Returns True if branch has not moved since its last finished unit.
+
+        :param branch: branch the units were recorded for
+        :param reference: reference to compare, by default the branch
+        """
+        records = [r for k, r in self._units.items() if k[0] == branch]
+        if not records:
+            return False
+        last = max(records, key=lambda r: r['index'])
+        try:
+            sha = resolve_commit(reference or branch, self._directory)
+        except Exception:
+            return False
+        return sha == last['sha']
+
+    def contains(self, record, reference='HEAD'):
+        """Returns True if the commit of a record is in reference"""
+        cmd = ['git', 'merge-base', '--is-ancestor', record['sha'], reference]
+        p = Popen(cmd, cwd=self._directory, stdout=PIPE, stderr=PIPE)
+        p.communicate()
+        return p.returncode == 0
+
+    def _append(self, entry):
+        if self._file is None:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, branch, distro, step, reference='HEAD', tags=None):
+        """
+        Records a finished unit and the commit it produced.
+
+        :param branch: branch the unit worked on
+        :param distro: distro of the unit, or None
+        :param step: name of the step, e.g. ``branch`` or ``generate``
+        :param reference: reference to the commit the unit produced
+        :param tags: list of (name, reference, message) tags the unit created
+        """
+        tags = [[name, resolve_commit(ref, self._directory), message]
+                for name, ref, message in tags or []]
+        record = {
+            'branch': branch, 'distro': distro or '', 'step': step,
+            'sha': resolve_commit(reference, self._directory),
+            'tags': tags,
+            'index': self._next_index
+        }
+        self._next_index += 1
+        self._units[self._key(branch, distro, step)] = record
+        self._append(record)
+
+    def forget(self, branch):
+        """Forgets the units of a branch, e.g. before it is redone"""
+        keys = [k for k in self._units if k[0] == branch]
+        if not keys:
+            return
+        for key in keys:
+            del self._units[key]
+        self._append({'forget': branch})
+
+    def close(self, finished=False):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if finished and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _load(path, run):
+    """Returns the units in the journal at path if it is for run"""
+    units = {}
+    try:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return units
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        return units
+    if header.get('run') != run:
+        warning("Not resuming, the journal in " + path + " is for a "
+                "different run: " + str(header.get('run')))
+        return units
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # The last line is incomplete if the run was killed writing it
+            break
+        if 'forget' in entry:
+            for key in [k for k in units if k[0] == entry['forget']]:
+                del units[key]
+            continue
+        units[Journal._key(entry['branch'], entry['distro'],
+                           entry['step'])] = entry
+    return units
+
+
+@contextmanager
+def open_journal(name, run, resume=False, directory=None):
+    """
+    Context manager which journals the units finished inside of it.
+
+    The journal is active, see :py:func:`get_journal`, inside of the context.
+    It is removed if the context exits normally, and kept for a later resume
+    if it exits with an exception.  Nested calls for the same repository
+    yield the journal of the outermost call, and None is yielded outside of
+    a git repository.
+
+    :param name: name of the journal, e.g. the command
+    :param run: dict of the arguments of the run, a journal is only resumed
+        by a run with the same arguments
+    :param resume: if True the units of an interrupted run are loaded,
+        otherwise any earlier journal is discarded
+    :param directory: the git repository, by default the cwd
+    """
+    key = get_repository_key(directory)
+    if key in _journals:
+        yield _journals[key]
+        return
+    common_dir = get_common_git_dir(directory)
+    if common_dir is None:
+        yield None
+        return
+    path = _journal_path(common_dir, name)
+    units = _load(path, run) if resume else {}
+    journal = Journal(path, run, units, directory)
+    if units:
+        debug("Resuming " + str(len(units)) + " finished units from " + path)
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        journal._append({'run': run})
+    _journals[key] = journal
+    try:
+        yield journal
+    except BaseException:
+        journal.close()
+        raise
+    finally:
+        del _journals[key]
+    journal.close(finished=True)
+
+
+def get_journal(directory=None):
+    """Returns the active journal of the repository, or None"""
+    return _journals.get(get_repository_key(directory))
@@ -0,0 +1,349 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A git object store shared by the release repositories on a host.
+
+Release repositories mostly contain the same upstream objects, so instead of
+each keeping its own copy they borrow them from one bare repository, the
+store, through ``objects/info/alternates``.  Attaching a repository fetches
+its refs into the store, under ``refs/bloom-repos/<key>/``, and then repacks
+the repository without the objects the store has.  The temporary clones of
+git-bloom-import-upstream borrow the objects of the release repository, and
+with it those of the store.
+
+Repositories depend on the objects of the store without the store knowing
+about all of them, e.g. objects only referenced from a reflog, so the store
+never deletes objects: its gc is disabled and :py:func:`maintain` repacks it
+keeping the unreachable objects.  A repository has to be detached, which
+copies the objects it borrows back into it, before it can be moved or used
+without the store.
+"""
+
+from __future__ import print_function
+
+import argparse
+import fcntl
+import hashlib
+import os
+
+from contextlib import contextmanager
+
+from . git import get_common_git_dir
+from . logging import info
+from . logging import warning
+from . util import add_global_arguments
+from . util import bailout
+from . util import check_output
+from . util import get_cache_dir
+from . util import handle_global_arguments
+
+# Namespace of the refs of the attached repositories in the store
+_refs_prefix = 'refs/bloom-repos/'
+
+
+def get_store_dir():
+    """Returns the path of the store, $BLOOM_OBJECT_STORE or in the cache"""
+    store = os.environ.get('BLOOM_OBJECT_STORE')
+    if store:
+        return os.path.abspath(store)
+    return os.path.join(get_cache_dir(), 'objects.git')
+
+
+def init_store(store=None):
+    """
+    Creates the store, if it does not exist yet.
+
+    :param store: path of the store, by default :py:func:`get_store_dir`
+    :returns: the path of the store
+    """
+    store = store if store else get_store_dir()
+    if not os.path.exists(os.path.join(store, 'HEAD')):
+        if not os.path.isdir(store):
+            os.makedirs(store)
+        check_output(['git', 'init', '-q', '--bare', store])
+        # Objects are never pruned, the repositories may depend on them
+        for key, value in [('gc.auto', '0'), ('gc.autoPackLimit', '0'),
+                           ('gc.pruneExpire', 'never'),
+                           ('gc.reflogExpireUnreachable', 'never')]:
+            check_output(['git', 'config', key, value], cwd=store)
+    return store
+
+
+@contextmanager
+def store_lock(store):
+    """Context manager which holds the lock for changing the store"""
+    with open(os.path.join(store, 'bloom.lock'), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _repos_path(store):
+    return os.path.join(store, 'bloom-repos')
+
+
+def get_attached(store=None):
+    """Returns the git directories of the repositories attached to store"""
+    store = store if store else get_store_dir()
+    try:
+        with open(_repos_path(store), 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    except IOError:
+        return []
+
+
+def _write_attached(store, repos):
+    path = _repos_path(store)
+    with open(path + '.tmp', 'w') as f:
+        f.write(''.join(repo + '\n' for repo in repos))
+    os.rename(path + '.tmp', path)
+
+
+def _repo_key(git_dir):
+    return hashlib.sha1(git_dir).hexdigest()[:16]
+
+
+def _alternates_path(git_dir):
+    return os.path.join(git_dir, 'objects', 'info', 'alternates')
+
+
+def _read_alternates(git_dir):
+    try:
+        with open(_alternates_path(git_dir), 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    except IOError:
+        return []
+
+
+def _write_alternates(git_dir, alternates):
+    path = _alternates_path(git_dir)
+    if not alternates:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + '.tmp', 'w') as f:
+        f.write(''.join(a + '\n' for a in alternates))
+    os.rename(path + '.tmp', path)
+
+
+def _git_dir(directory):
+    git_dir = get_common_git_dir(directory)
+    if git_dir is None:
+        bailout("Not a git repository: {0}".format(directory or os.getcwd()))
+    return os.path.abspath(git_dir)
+
+
+def _fetch_into_store(store, git_dir):
+    """Fetches all of the refs of a repository into its namespace"""
+    check_output(['git', 'fetch', '-q', '--no-tags', '--prune', git_dir,
+                  '+refs/*:' + _refs_prefix + _repo_key(git_dir) + '/*'],
+                 cwd=store)
+
+
+def _loose_objects(git_dir):
+    objects = os.path.join(git_dir, 'objects')
+    for prefix in os.listdir(objects):
+        if len(prefix) != 2:
+            continue
+        for name in os.listdir(os.path.join(objects, prefix)):
+            if len(name) == 38:
+                yield prefix + name, os.path.join(objects, prefix, name)
+
+
+def _repack_local(git_dir, store):
+    """Repacks a repository without the objects it borrows"""
+    check_output(['git', 'repack', '-a', '-d', '-l', '-q'], cwd=git_dir)
+    # repack leaves the loose objects alone, those in the store are dropped
+    loose = dict(_loose_objects(git_dir))
+    if not loose:
+        return
+    out = check_output(['git', 'cat-file', '--batch-check=%(objectname)'],
+                       cwd=store, input=''.join(s + '\n' for s in loose))
+    for line in out.splitlines():
+        if line in loose:
+            os.remove(loose[line])
+
+
+def attach(directory=None, store=None):
+    """
+    Makes a repository borrow its objects from the store.
+
+    Attaching a repository again only fetches its new objects.
+
+    :param directory: the repository, by default the cwd
+    :param store: path of the store, by default :py:func:`get_store_dir`
+    :returns: the git directory of the repository
+    """
+    git_dir = _git_dir(directory)
+    store = init_store(store)
+    objects = os.path.join(store, 'objects')
+    with store_lock(store):
+        _fetch_into_store(store, git_dir)
+        repos = get_attached(store)
+        if git_dir not in repos:
+            _write_attached(store, repos + [git_dir])
+    alternates = _read_alternates(git_dir)
+    if objects not in alternates:
+        _write_alternates(git_dir, alternates + [objects])
+    _repack_local(git_dir, store)
+    return git_dir
+
+
+def detach(directory=None, store=None):
+    """
+    Copies the objects a repository borrows from the store back into it.
+
+    :param directory: the repository, by default the cwd
+    :param store: path of the store, by default :py:func:`get_store_dir`
+    :returns: the git directory of the repository
+    """
+    git_dir = _git_dir(directory)
+    store = store if store else get_store_dir()
+    objects = os.path.join(store, 'objects')
+    # Without -l the objects of the alternates are packed too
+    check_output(['git', 'repack', '-a', '-d', '-q'], cwd=git_dir)
+    _write_alternates(git_dir, [a for a in _read_alternates(git_dir)
+                                if a != objects])
+    if os.path.isdir(store):
+        with store_lock(store):
+            _write_attached(store, [r for r in get_attached(store)
+                                    if r != git_dir])
+            _delete_refs(store, _repo_key(git_dir))
+    return git_dir
+
+
+def _delete_refs(store, key):
+    refs = check_output(['git', 'for-each-ref', '--format=%(refname)',
+                         _refs_prefix + key + '/'], cwd=store).split()
+    if refs:
+        check_output(['git', 'update-ref', '--stdin'], cwd=store,
+                     input=''.join('delete ' + r + '\n' for r in refs))
+
+
+def maintain(store=None):
+    """
+    Consolidates the objects of the attached repositories into the store.
+
+    The new objects of each repository are fetched into the store, and the
+    repository is repacked without them, then the store is repacked into
+    one pack, keeping the objects which are not reachable from its refs.
+    Repositories which no longer exist are forgotten, their objects are
+    kept.
+
+    :param store: path of the store, by default :py:func:`get_store_dir`
+    :returns: list of (git directory, status) of the attached repositories
+    """
+    store = init_store(store)
+    objects = os.path.join(store, 'objects')
+    results = []
+    with store_lock(store):
+        repos = get_attached(store)
+        for git_dir in repos:
+            if not os.path.isdir(git_dir):
+                results.append((git_dir, 'missing'))
+            elif objects not in _read_alternates(git_dir):
+                results.append((git_dir, 'detached'))
+            else:
+                _fetch_into_store(store, git_dir)
+                _repack_local(git_dir, store)
+                results.append((git_dir, 'ok'))
+        _write_attached(store, [r for r, status in results if status == 'ok'])
+        check_output(['git', 'repack', '-a', '-d', '-q',
+                      '--keep-unreachable'], cwd=store)
+        check_output(['git', 'pack-refs', '--all'], cwd=store)
+    return results
+
+
+def count_objects(git_dir):
+    """Returns the counts of git count-objects -v as a dict of ints"""
+    counts = {}
+    for line in check_output(['git', 'count-objects', '-v'],
+                             cwd=git_dir).splitlines():
+        key, value = line.split(':', 1)
+        # Skips the alternate lines
+        if value.strip().isdigit():
+            counts[key.strip()] = int(value)
+    return counts
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="""\
+Manages the git object store shared by the release repositories on this host,
+in $BLOOM_OBJECT_STORE or bloom's cache directory.
+""")
+    subparsers = parser.add_subparsers(dest='command')
+    for command, text in [('attach', "borrow the objects of repositories "
+                                     "from the store"),
+                          ('detach', "copy the borrowed objects back into "
+                                     "repositories")]:
+        sub = subparsers.add_parser(command, help=text)
+        sub.add_argument('repositories', nargs='*', metavar='REPOSITORY',
+                         help="release repositories, by default the "
+                              "current one")
+    subparsers.add_parser('maintain', help="consolidate the objects of the "
+                                           "attached repositories and "
+                                           "repack the store")
+    subparsers.add_parser('show', help="show the store and the attached "
+                                       "repositories")
+    return parser
+
+
+def main(sysargs=None):
+    parser = get_argument_parser()
+    parser = add_global_arguments(parser)
+    args = parser.parse_args(sysargs)
+    handle_global_arguments(args)
+    store = get_store_dir()
+    if args.command in ['attach', 'detach']:
+        function = attach if args.command == 'attach' else detach
+        for repository in args.repositories or [None]:
+            git_dir = function(repository, store)
+            info(args.command.capitalize() + "ed " + git_dir)
+        return 0
+    if args.command == 'maintain':
+        for git_dir, status in maintain(store):
+            if status == 'ok':
+                info("Consolidated " + git_dir)
+            else:
+                warning("Forgot the {0} repository {1}".format(status,
+                                                               git_dir))
+    print("Store: " + store)
+    if os.path.isdir(store):
+        counts = count_objects(store)
+        print("Objects: {0} in packs, {1} KiB".format(
+              counts.get('in-pack', 0), counts.get('size-pack', 0)))
+    for git_dir in get_attached(store):
+        print("Attached: " + git_dir)
+    return 0
@@ -0,0 +1,565 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+The catkin packages of a repository and the dependencies between them.
+
+The package.xml, stack.xml and manifest.xml files are parsed through a cache,
+keyed by the path and stat of a file or by the SHA-1 of a git blob, so the
+import, branch and generate steps, and later commands in a bloom server, parse
+each version of a file once.  The packages are found either by walking a
+directory, skipping the directories which cannot hold released packages, or
+by listing the tree of a git reference, without touching the working tree.
+
+The dependency graph has an edge from each package to the packages it depends
+on which are released with it, from the build, buildtool and run depends of
+their package.xml files.  :py:func:`topological_waves` orders the graph into
+waves, where each package only depends on packages in the earlier waves, so
+the packages in a wave are independent of each other.  Bloom releases the
+packages wave by wave, and other tools, e.g. build farms which want to start
+on the packages without dependencies first, can get the waves from
+``git-bloom-graph`` or :py:func:`get_release_waves`.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from subprocess import CalledProcessError, PIPE
+
+from . git import get_branches
+from . git import list_tree
+from . logging import debug
+from . logging import warning
+from . util import add_global_arguments
+from . util import bailout
+from . util import check_output
+from . util import handle_global_arguments
+
+# Package.xml dependencies which order a release, test and doc depends do not
+_dependency_types = ['build_depends', 'buildtool_depends',
+                     'build_export_depends', 'buildtool_export_depends',
+                     'exec_depends', 'run_depends']
+
+
+# Files which exclude the directory they are in, and everything below it
+_ignore_markers = set(['AMENT_IGNORE', 'CATKIN_IGNORE', 'COLCON_IGNORE'])
+
+# Directories which hold build outputs rather than sources, they are only
+# searched for packages if they are a package themselves
+_pruned_dirs = set(['build', 'devel', 'install', 'CMakeFiles', '__pycache__',
+                    'node_modules'])
+
+# Parsed files, keyed by (kind, path, stat) or (kind, blob SHA-1), cleared
+# when full since every edit of a file adds a key
+_parsed = {}
+_max_parsed = 4096
+
+
+def _file_key(kind, path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return (kind, path, st.st_mtime, st.st_size, st.st_ino)
+
+
+def _cached(key, parse):
+    if key not in _parsed:
+        parsed = parse()
+        if len(_parsed) >= _max_parsed:
+            _parsed.clear()
+        _parsed[key] = parsed
+    return _parsed[key]
+
+
+def _import_catkin_pkg():
+    try:
+        import catkin_pkg.package
+        import catkin_pkg.packages
+    except ImportError:
+        bailout("catkin_pkg was not detected, please install it.")
+    return catkin_pkg
+
+
+def _import_rospkg():
+    try:
+        import rospkg
+        import rospkg.manifest
+        import rospkg.stack
+    except ImportError:
+        bailout("rospkg was not detected, please install it.")
+    return rospkg
+
+
+def parse_package_file(path):
+    """
+    Returns the parsed package.xml at path, parsing it once per version.
+
+    :param path: path to the package.xml or its directory
+    :returns: catkin_pkg.package.Package
+
+    :raises: catkin_pkg.package.InvalidPackage, or OSError if it is missing
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'package.xml')
+    catkin_pkg = _import_catkin_pkg()
+    return _cached(_file_key('package', path),
+                   lambda: catkin_pkg.package.parse_package(path))
+
+
+def parse_package_blob(blob, directory=None):
+    """
+    Returns the package.xml in a git blob, parsing it once per blob.
+
+    :param blob: SHA-1 of the blob
+    :param directory: the git repository, by default the cwd
+    :returns: catkin_pkg.package.Package
+
+    :raises: catkin_pkg.package.InvalidPackage
+    """
+    catkin_pkg = _import_catkin_pkg()
+    return _cached(('package', blob), lambda: catkin_pkg.package.
+                   parse_package_string(_read_blob(blob, directory)))
+
+
+def _read_blob(blob, directory=None):
+    return check_output(['git', 'cat-file', 'blob', blob], cwd=directory)
+
+
+def parse_stack_file(path):
+    """Returns the parsed stack.xml at path, parsing it once per version"""
+    rospkg = _import_rospkg()
+    return _cached(_file_key('stack', path),
+                   lambda: rospkg.stack.parse_stack_file(path))
+
+
+def parse_stack_blob(blob, directory=None):
+    """Returns the stack.xml in a git blob, parsing it once per blob"""
+    rospkg = _import_rospkg()
+    return _cached(('stack', blob), lambda: rospkg.stack.parse_stack(
+        _read_blob(blob, directory), 'stack.xml'))
+
+
+def parse_manifest_file(path):
+    """Returns the parsed manifest.xml at path, parsing it once per version"""
+    rospkg = _import_rospkg()
+    return _cached(_file_key('manifest', path),
+                   lambda: rospkg.parse_manifest_file(os.path.dirname(path),
+                                                      os.path.basename(path)))
+
+
+def parse_manifest_blob(blob, directory=None):
+    """Returns the manifest.xml in a git blob, parsing it once per blob"""
+    rospkg = _import_rospkg()
+    return _cached(('manifest', blob), lambda: rospkg.manifest.parse_manifest(
+        'manifest.xml', _read_blob(blob, directory), 'manifest.xml'))
+
+
+def _is_pruned(name, is_package):
+    """Returns True if the search should not descend into a directory"""
+    if name.startswith('.'):
+        return True
+    return name in _pruned_dirs and not is_package()
+
+
+def find_package_paths(basepath):
+    """
+    Finds the directories with a package.xml under basepath.
+
+    Like catkin_pkg.packages.find_package_paths, the search does not descend
+    into packages, hidden directories, or directories with an ignore marker,
+    e.g. CATKIN_IGNORE, but it also skips the build, devel and install spaces
+    and other directories in which packages are not released from.
+
+    :returns: sorted list of the paths of the packages relative to basepath
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(basepath, followlinks=True):
+        if _ignore_markers.intersection(filenames):
+            del dirnames[:]
+            continue
+        if 'package.xml' in filenames:
+            paths.append(os.path.relpath(dirpath, basepath))
+            del dirnames[:]
+            continue
+        dirnames[:] = [d for d in dirnames if not _is_pruned(
+            d, lambda: os.path.isfile(os.path.join(dirpath, d, 'package.xml'))
+        )]
+    return sorted(paths)
+
+
+def _parse_all(parse, items, jobs=None):
+    """Returns [parse(item) for item in items], parsed on a thread pool"""
+    jobs = jobs if jobs else cpu_count()
+    if len(items) < 2 or jobs < 2:
+        return [parse(item) for item in items]
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(parse, items)
+    finally:
+        pool.close()
+
+
+def find_packages(basepath, jobs=None):
+    """
+    Finds and parses the package.xml files under basepath.
+
+    Like catkin_pkg.packages.find_packages, but the directories are searched
+    with :py:func:`find_package_paths` and the package.xml files are parsed
+    through the cache, on a pool of jobs threads.
+
+    :param basepath: the directory to search
+    :param jobs: number of threads, by default the number of cpus
+    :returns: dict of the path of each package relative to basepath to its
+        catkin_pkg.package.Package
+    """
+    _import_catkin_pkg()
+    paths = find_package_paths(basepath)
+    packages = _parse_all(
+        lambda path: parse_package_file(os.path.join(basepath, path)),
+        paths, jobs)
+    return dict(zip(paths, packages))
+
+
+def find_package_blobs(reference='HEAD', directory=None):
+    """
+    Finds the package.xml files in the tree of a git reference.
+
+    The tree is listed from the object store, so neither the working tree
+    nor a checkout is needed, and it is searched with the same rules as
+    :py:func:`find_package_paths`.
+
+    :param reference: the commit or tree to search
+    :param directory: the git repository, by default the cwd
+    :returns: dict of the path of each package relative to the root of the
+        tree to the SHA-1 of its package.xml blob
+    """
+    out = check_output(['git', 'ls-tree', '-r', '-z', '--full-tree',
+                        reference], cwd=directory)
+    blobs = {}
+    ignored = set()
+    for entry in out.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        dirname, name = os.path.split(path)
+        if name == 'package.xml':
+            blobs[dirname or '.'] = info.split()[2]
+        elif name in _ignore_markers:
+            ignored.add(dirname or '.')
+    packages = {}
+    # Parents come before their sub directories in sorted order
+    for path in sorted(blobs):
+        parents = ['.']
+        parts = [] if path == '.' else path.split('/')
+        for index, part in enumerate(parts):
+            parent = '/'.join(parts[:index + 1])
+            if _is_pruned(part, lambda: parent in blobs):
+                break
+            parents.append(parent)
+        else:
+            # Skip ignored directories and packages nested in packages
+            if not ignored.intersection(parents) and \
+               not set(packages).intersection(parents[:-1]):
+                packages[path] = blobs[path]
+    return packages
+
+
+def find_packages_in_tree(reference='HEAD', directory=None, jobs=None):
+    """
+    Finds and parses the package.xml files in the tree of a git reference.
+
+    :param reference: the commit or tree to search
+    :param directory: the git repository, by default the cwd
+    :param jobs: number of threads, by default the number of cpus
+    :returns: dict of the path of each package relative to the root of the
+        tree to its catkin_pkg.package.Package
+    """
+    _import_catkin_pkg()
+    blobs = find_package_blobs(reference, directory)
+    paths = sorted(blobs)
+    packages = _parse_all(
+        lambda path: parse_package_blob(blobs[path], directory), paths, jobs)
+    return dict(zip(paths, packages))
+
+
+def get_manifest_descriptions(directory, name):
+    """
+    Returns the descriptions of the rosbuild packages in a directory.
+
+    The manifest.xml files of the directory and its direct sub directories
+    are read.
+
+    :param directory: the directory
+    :param name: name to use for a manifest.xml directly in directory
+    :returns: dict of package name to the description in its manifest.xml,
+        None if it has no description
+    """
+    descriptions = {}
+    for dir_name in ['.'] + os.listdir(directory):
+        path = os.path.join(directory, dir_name, 'manifest.xml')
+        if not os.path.isfile(path):
+            continue
+        # parse the manifest, in case it is not valid
+        manifest = parse_manifest_file(path)
+        descriptions[name if dir_name == '.' else dir_name] = \
+            manifest.description
+    return descriptions
+
+
+def get_tree_manifest_descriptions(reference, name, directory=None):
+    """
+    Like :py:func:`get_manifest_descriptions`, for the tree of a reference.
+
+    :param reference: the commit or tree to read
+    :param name: name to use for a manifest.xml at the root of the tree
+    :param directory: the git repository, by default the cwd
+    :returns: dict of package name to the description in its manifest.xml
+    """
+    top = list_tree(reference, directory=directory)
+    paths = ['manifest.xml'] + [path + '/manifest.xml'
+                                for path, entry in top.items()
+                                if entry[1] == 'tree']
+    descriptions = {}
+    for path, entry in list_tree(reference, paths, directory).items():
+        if entry[1] != 'blob':
+            continue
+        manifest = parse_manifest_blob(entry[2], directory)
+        descriptions[os.path.dirname(path) or name] = manifest.description
+    return descriptions
+
+
+class DependencyCycle(ValueError):
+    """
+    Raised when the packages depend on each other in a cycle.
+
+    :ivar packages: names of the packages in or depending on the cycle
+    """
+
+    def __init__(self, packages):
+        ValueError.__init__(self, "Circular dependency between the "
+                                  "packages: " + ', '.join(packages))
+        self.packages = packages
+
+
+def get_package_dependencies(package):
+    """
+    Returns the names of the packages a package depends on.
+
+    :param package: catkin_pkg.package.Package
+    :returns: set of package names
+    """
+    names = set()
+    for dependency_type in _dependency_types:
+        for dependency in getattr(package, dependency_type, None) or []:
+            names.add(dependency.name)
+    names.discard(package.name)
+    return names
+
+
+def build_dependency_graph(packages):
+    """
+    Builds the dependency graph of a set of packages.
+
+    :param packages: iterable of catkin_pkg.package.Package, e.g. the values
+        of catkin_pkg.packages.find_packages
+    :returns: OrderedDict of package name to the sorted list of the names of
+        the other given packages it depends on, sorted by name
+    """
+    packages = sorted(packages, key=lambda p: p.name)
+    names = set(p.name for p in packages)
+    graph = OrderedDict()
+    for package in packages:
+        graph[package.name] = sorted(get_package_dependencies(package) & names)
+    return graph
+
+
+def topological_waves(graph):
+    """
+    Orders a dependency graph into waves.
+
+    Each package is in the wave after the last of its dependencies, so the
+    packages of the first wave have no dependencies in the graph and the
+    packages of each wave only depend on packages in earlier waves.
+
+    :param graph: dict of package name to the names it depends on, as
+        returned by :py:func:`build_dependency_graph`
+    :returns: list of waves, each a sorted list of package names
+
+    :raises: DependencyCycle if the dependencies are circular
+    """
+    remaining = dict((name, set(deps) & set(graph))
+                     for name, deps in graph.items())
+    waves = []
+    while remaining:
+        wave = sorted(name for name, deps in remaining.items() if not deps)
+        if not wave:
+            raise DependencyCycle(sorted(remaining))
+        for name in wave:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(wave)
+        waves.append(wave)
+    return waves
+
+
+def order_packages(packages):
+    """
+    Returns packages in the order of their dependency waves.
+
+    If the dependencies are circular a warning is printed and the packages
+    are returned in name order.
+
+    :param packages: iterable of catkin_pkg.package.Package
+    :returns: list of the packages, the packages they depend on first
+    """
+    by_name = dict((p.name, p) for p in packages)
+    try:
+        waves = topological_waves(build_dependency_graph(by_name.values()))
+    except DependencyCycle as err:
+        warning(str(err) + ", releasing them in name order.")
+        waves = [sorted(by_name)]
+    return [by_name[name] for wave in waves for name in wave]
+
+
+def read_branch_package(branch, directory=None):
+    """
+    Returns the package in the package.xml at the root of a branch, or None.
+
+    The package.xml is read from git without checking out the branch.
+    """
+    _import_catkin_pkg()
+    try:
+        blob = check_output(['git', 'rev-parse', '--verify', '-q',
+                             branch + ':package.xml'], cwd=directory,
+                            stderr=PIPE).strip()
+    except CalledProcessError:
+        return None
+    try:
+        return parse_package_blob(blob, directory)
+    except Exception as err:
+        debug("Could not parse the package.xml of " + branch + ": " +
+              str(err))
+        return None
+
+
+def get_branch_waves(branches, directory=None):
+    """
+    Returns the dependency waves of the packages at the root of branches.
+
+    Branches without a readable package.xml have no dependencies.
+
+    :param branches: list of branches, local or remote
+    :param directory: the git repository, by default the cwd
+    :returns: list of waves, each a sorted list of the branches with packages
+        which only depend on packages in earlier waves
+
+    :raises: DependencyCycle if the dependencies are circular
+    """
+    packages = {}
+    for branch in branches:
+        package = read_branch_package(branch, directory)
+        if package is None:
+            warning("No package.xml in " + branch)
+            continue
+        packages[branch] = package
+    graph = build_dependency_graph(packages.values())
+    by_name = dict((p.name, b) for b, p in packages.items())
+    nodes = dict((b, [by_name[d] for d in graph[p.name]])
+                 for b, p in packages.items())
+    for branch in branches:
+        nodes.setdefault(branch, [])
+    return topological_waves(nodes)
+
+
+def get_release_waves(prefix='release', directory=None):
+    """
+    Returns the dependency waves of the packages branched to prefix.
+
+    :param prefix: prefix of the release branches, e.g. ``release``
+    :param directory: the release repository, by default the cwd
+    :returns: list of waves, each a sorted list of the release branches of
+        packages which only depend on packages in earlier waves
+
+    :raises: DependencyCycle if the dependencies are circular
+    """
+    prefix = prefix.rstrip('/') + '/'
+    refs = {}
+    for branch in get_branches(local_only=False, directory=directory):
+        name = branch.split('remotes/origin/', 1)[-1]
+        if not name.startswith(prefix) or '/' in name[len(prefix):]:
+            continue
+        # Prefer the local branch over the remote one
+        if name not in refs or branch == name:
+            refs[name] = branch
+    by_ref = dict((ref, name) for name, ref in refs.items())
+    waves = get_branch_waves(sorted(refs.values()), directory)
+    return [sorted(by_ref[ref] for ref in wave) for wave in waves]
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="""\
+Prints the dependency waves of the packages in the release branches.
+
+Each line is a wave of release branches whose packages only depend on packages
+in the earlier lines, so the packages of a line can be built in parallel once
+the earlier lines are built.
+""")
+    parser.add_argument('prefix', nargs='?', default='release',
+                        help="prefix of the release branches, defaults to "
+                             "release")
+    parser.add_argument('--json', action='store_true', default=False,
+                        help="print the waves as a json list of lists")
+    return parser
+
+
+def main(sysargs=None):
+    parser = get_argument_parser()
+    parser = add_global_arguments(parser)
+    args = parser.parse_args(sysargs)
+    handle_global_arguments(args)
+    try:
+        waves = get_release_waves(args.prefix)
+    except DependencyCycle as err:
+        print(str(err), file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(waves))
+    else:
+        for wave in waves:
+            print(' '.join(wave))
+    return 0
@@ -5,26 +5,27 @@ import sys
 import subprocess
 import traceback
 
-from .. util import check_output
+from .. util import bailout
 from .. util import execute_command
 from .. logging import error
 from .. logging import debug
+from .. git import create_tag
 from .. git import get_current_branch
 from .. git import has_changes
 from .. git import inbranch
-
-try:
-    from catkin_pkg.packages import find_packages
-    from catkin_pkg.packages import verify_equal_package_versions
-except ImportError:
-    error("catkin_pkg was not detected, please install it.", file=sys.stderr)
-    sys.exit(1)
+from .. gitconfig import read_config_blob
+from .. gitconfig import write_config
+from .. packages import find_packages
 
 _patch_config_keys = ['parent', 'base', 'trim', 'trimbase']
 _patch_config_keys.sort()
 
 
 def get_version(directory=None):
+    try:
+        from catkin_pkg.packages import verify_equal_package_versions
+    except ImportError:
+        bailout("catkin_pkg was not detected, please install it.")
     packages = find_packages(basepath=directory if directory else os.getcwd())
     try:
         version = verify_equal_package_versions(packages.values())
@@ -42,10 +43,11 @@ def update_tag(version=None, force=True, directory=None):
     current_branch = get_current_branch(directory)
     tag_name = current_branch + "/" + version
     debug("Updating tag " + tag_name + " to point to " + current_branch)
-    cmd = 'git tag ' + tag_name
     if force:
-        cmd += ' -f'
-    execute_command(cmd, cwd=directory)
+        # Queued if this is part of a larger tag_batch
+        create_tag(tag_name, directory=directory)
+    else:
+        execute_command('git tag ' + tag_name, cwd=directory)
 
 
 def list_patches(directory=None):
@@ -59,26 +61,23 @@ def list_patches(directory=None):
 
 
 def get_patch_config(patches_branch, directory=None):
-    @inbranch(patches_branch, directory=directory)
-    def fn():
-        global _patch_config_keys
-        conf_path = 'patches.conf'
-        if directory is not None:
-            conf_path = os.path.join(directory, conf_path)
-        if not os.path.exists(conf_path):
-            return None
-        cmd = 'git config -f {0} patches.'.format(conf_path)
-        try:
-            config = {}
-            for key in _patch_config_keys:
-                config[key] = check_output(cmd + key, shell=True,
-                                           cwd=directory).strip()
-            return config
-        except subprocess.CalledProcessError as err:
-            traceback.print_exc()
-            error("Failed to get patches info: " + str(err))
+    # Read straight from the branch, there is no need to check it out
+    try:
+        patches_conf = read_config_blob(patches_branch, 'patches.conf',
+                                        directory=directory)
+    except ValueError as err:
+        error("Failed to get patches info: " + str(err))
+        return None
+    if patches_conf is None:
+        return None
+    config = {}
+    for key in _patch_config_keys:
+        if 'patches.' + key not in patches_conf:
+            error("Failed to get patches info: patches." + key +
+                  " is not set in patches.conf")
             return None
-    return fn()
+        config[key] = patches_conf['patches.' + key].strip()
+    return config
 
 
 def set_patch_config(patches_branch, config, directory=None):
@@ -92,11 +91,9 @@ def set_patch_config(patches_branch, config, directory=None):
         config_keys.sort()
         if _patch_config_keys != config_keys:
             raise RuntimeError("Invalid config passed to set_patch_config")
-        cmd = 'git config -f {0} patches.'.format(conf_path)
         try:
-            for key in config:
-                _cmd = cmd + key + ' "' + config[key] + '"'
-                execute_command(_cmd, cwd=directory)
+            write_config(conf_path,
+                         [('patches.' + key, config[key]) for key in config])
             # Stage the patches.conf file
             cmd = 'git add ' + conf_path
             execute_command(cmd, cwd=directory)
@@ -104,7 +101,7 @@ def set_patch_config(patches_branch, config, directory=None):
                 # Commit the changed config file
                 cmd = 'git commit -m "Updated patches.conf"'
                 execute_command(cmd, cwd=directory)
-        except subprocess.CalledProcessError as err:
+        except (subprocess.CalledProcessError, IOError, OSError) as err:
             traceback.print_exc()
             error("Failed to set patches info: " + str(err))
             raise
@@ -7,6 +7,7 @@ from .. util import execute_command
 from .. logging import error
 from .. logging import info
 from .. logging import log_prefix
+from .. git import branch_context
 from .. git import branch_exists
 from .. git import get_current_branch
 from .. git import has_changes
@@ -26,14 +27,13 @@ def export_patches(directory=None):
         error("The patches branch ({0}) does not ".format(patches_branch) + \
               "exist, did you use git-bloom-branch?")
         return 1
-    try:
+    # Work in the patches branch, the current branch is restored afterwards
+    with branch_context(patches_branch, directory=directory):
         # Get parent branch and base commit from patches branch
         config = get_patch_config(patches_branch, directory)
         if config is None:
             error("Failed to get patches information.")
             return 1
-        # Checkout to the patches branch
-        execute_command('git checkout ' + patches_branch, cwd=directory)
         # Notify the user
         info("Exporting patches from "
              "{0}...{1}".format(config['base'], current_branch))
@@ -55,9 +55,6 @@ def export_patches(directory=None):
         if has_changes(directory):
             cmd = 'git commit -m "Updating patches."'
             execute_command(cmd, cwd=directory)
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
     return 0
 
 
@@ -13,6 +13,7 @@ from .. logging import error
 from .. logging import info
 from .. logging import log_prefix
 from .. logging import warning
+from .. git import branch_context
 from .. git import branch_exists
 from .. git import get_commit_hash
 from .. git import get_current_branch
@@ -40,38 +41,36 @@ def import_patches(directory=None):
     # Create a swap space
     tmp_dir = tempfile.mkdtemp()
     try:
-        # Get parent branch and base commit from patches branch
-        config = get_patch_config(patches_branch, directory)
-        parent_branch, commit = config['parent'], config['base']
-        if commit != get_commit_hash(current_branch, directory):
-            warning("The current commit is not the same as the most recent "
-                    "rebase commit. This might mean that you have committed "
-                    "since the last time you did 'git-bloom-patch export'.")
-            return 1
-        # Checkout to the patches branch
-        execute_command('git checkout ' + patches_branch, cwd=directory)
-        # Copy the patches to a temp location
-        patches = list_patches(directory)
-        if len(patches) == 0:
-            warning("No patches in the patches branch, nothing has changed.")
-            return 1
-        tmp_dir_patches = []
-        for patch in patches:
-            tmp_dir_patches.append(os.path.join(tmp_dir, patch))
-            if directory is not None:
-                patch = os.path.join(directory, patch)
-            shutil.copy(patch, tmp_dir)
-        # Now checkout back to the original branch and import them
-        execute_command('git checkout ' + current_branch, cwd=directory)
+        with branch_context(patches_branch, directory=directory):
+            # Get parent branch and base commit from patches branch
+            config = get_patch_config(patches_branch, directory)
+            parent_branch, commit = config['parent'], config['base']
+            if commit != get_commit_hash(current_branch, directory):
+                warning("The current commit is not the same as the most "
+                        "recent rebase commit. This might mean that you have "
+                        "committed since the last time you did "
+                        "'git-bloom-patch export'.")
+                return 1
+            # Copy the patches to a temp location
+            patches = list_patches(directory)
+            if len(patches) == 0:
+                warning("No patches in the patches branch, nothing has "
+                        "changed.")
+                return 1
+            tmp_dir_patches = []
+            for patch in patches:
+                tmp_dir_patches.append(os.path.join(tmp_dir, patch))
+                if directory is not None:
+                    patch = os.path.join(directory, patch)
+                shutil.copy(patch, tmp_dir)
+        # Now back on the original branch, import them
         cmd = 'git am {0}*.patch'.format(tmp_dir + os.sep)
         execute_command(cmd, cwd=directory)
         # Notify the user
         info("Applied {0} patches".format(len(patches)))
         # Update the tag
-        update_tag()
+        update_tag(directory=directory)
     finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir)
     return 0
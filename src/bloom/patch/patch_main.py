@@ -76,4 +76,4 @@ def patchmain():
         traceback.print_exc()
         error(str(err))
         retcode = 3
-    sys.exit(retcode)
+    return retcode
@@ -10,6 +10,7 @@ from .. util import handle_global_arguments
 from .. logging import error
 from .. logging import log_prefix
 from .. logging import warning
+from .. git import branch_context
 from .. git import get_commit_hash
 from .. git import get_current_branch
 
@@ -23,6 +24,12 @@ from . common import update_tag
 
 @log_prefix('[git-bloom-patch rebase]: ')
 def rebase_patches(directory=None):
+    # Share one branch stack between all of the sub commands
+    with branch_context(directory=directory):
+        return _rebase_patches(directory)
+
+
+def _rebase_patches(directory=None):
     # Make sure we need to actually call this
     current_branch = get_current_branch(directory)
     patches_branch = 'patches/' + current_branch
@@ -74,7 +81,7 @@ upstream branch.\
         error(str(err))
         return 5
     # Update the tag
-    update_tag()
+    update_tag(directory=directory)
     return 0
 
 
@@ -9,6 +9,7 @@ from .. util import handle_global_arguments
 from .. logging import log_prefix
 from .. logging import error
 from .. logging import info
+from .. git import branch_context
 from .. git import branch_exists
 from .. git import get_current_branch
 from .. git import track_branches
@@ -27,7 +28,7 @@ def remove_patches(directory=None):
         return 1
     # Construct the patches branch
     patches_branch = 'patches/' + current_branch
-    try:
+    with branch_context(directory=directory):
         # See if the patches branch exists
         if branch_exists(patches_branch, False, directory=directory):
             if not branch_exists(patches_branch, True, directory=directory):
@@ -47,10 +48,7 @@ def remove_patches(directory=None):
         # Reset this branch using git reset --hard spec
         execute_command('git reset --hard ' + spec, cwd=directory)
         # reset the tag
-        update_tag()
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
+        update_tag(directory=directory)
     return 0
 
 
@@ -13,6 +13,7 @@ from .. logging import debug
 from .. logging import log_prefix
 from .. logging import error
 from .. logging import warning
+from .. git import branch_context
 from .. git import branch_exists
 from .. git import get_commit_hash
 from .. git import get_current_branch
@@ -77,11 +78,12 @@ def _trim(config, force, directory):
         else:
             warning("If you would like to continue anyways use '--force'")
             return None
-    config['trimbase'] = get_commit_hash(get_current_branch(directory))
+    config['trimbase'] = get_commit_hash(get_current_branch(directory),
+                                         directory)
     tmp_dir = tempfile.mkdtemp()
     try:
         # Buckup trim sub directory
-        git_root = get_root()
+        git_root = get_root(directory)
         sub_dir = os.path.join(git_root, config['trim'])
         storage = os.path.join(tmp_dir, config['trim'])
         shutil.copytree(sub_dir, storage)
@@ -102,7 +104,8 @@ def _trim(config, force, directory):
               config['trim'] + ' sub directory"'
         execute_command(cmd, cwd=directory)
         # Update the patch base to be this commit
-        config['base'] = get_commit_hash(get_current_branch(directory))
+        config['base'] = get_commit_hash(get_current_branch(directory),
+                                         directory)
     finally:
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir)
@@ -119,7 +122,7 @@ def trim(sub_dir=None, force=False, undo=False, directory=None):
         return 1
     # Construct the patches branch
     patches_branch = 'patches/' + current_branch
-    try:
+    with branch_context(directory=directory):
         # See if the patches branch exists
         if branch_exists(patches_branch, False, directory=directory):
             if not branch_exists(patches_branch, True, directory=directory):
@@ -147,10 +150,7 @@ def trim(sub_dir=None, force=False, undo=False, directory=None):
         # Commit the new config
         set_patch_config(patches_branch, new_config, directory)
         # Update the tag
-        update_tag()
-    finally:
-        if current_branch:
-            execute_command('git checkout ' + current_branch, cwd=directory)
+        update_tag(directory=directory)
     return 0
 
 
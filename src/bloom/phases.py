@@ -0,0 +1,145 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Runs the phases of a command which wait on the network at the same time.
+
+A phase is a name, a function, and the names of the phases it requires, whose
+results the function is called with.  :py:func:`run_phases` starts each phase
+on its own thread as soon as the phases it requires finished, so independent
+phases, e.g. a rosdep update and the checkout of the upstream repository,
+overlap, and it reports how long each phase took.
+
+The phases share the process, so they must not change the working directory
+or the checked out branch, they should only wait on git, rosdep or the
+network with explicit paths.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+
+from . logging import debug
+from . logging import error
+from . packages import topological_waves
+from . util import BloomError
+
+
+def run_phases(phases):
+    """
+    Runs phases, each as soon as the phases it requires finished.
+
+    If a phase raises, no more phases are started, the ones running are
+    waited for, and then the exception, including SystemExit from bailout,
+    is raised again.
+
+    :param phases: list of (name, function, list of required names), the
+        function is called with the results of the required phases
+    :returns: (results, seconds), OrderedDicts of the phase names to the
+        return values of their functions and to how long they took, in the
+        order the phases finished
+
+    :raises: ValueError if a phase requires an unknown phase, or
+        :py:class:`bloom.packages.DependencyCycle` if the requirements of
+        the phases form a cycle
+    """
+    pending = OrderedDict()
+    for name, function, requires in phases:
+        pending[name] = (function, list(requires))
+    for name, (function, requires) in pending.items():
+        unknown = [r for r in requires if r not in pending]
+        if unknown:
+            raise ValueError("Phase {0} requires unknown phases: {1}"
+                             .format(name, ', '.join(unknown)))
+    topological_waves(dict((n, p[1]) for n, p in pending.items()))
+    results = OrderedDict()
+    seconds = OrderedDict()
+    failures = []
+    running = set()
+    condition = threading.Condition()
+
+    def run(name, function, args):
+        start = time.time()
+        try:
+            value = function(*args)
+        except BaseException:
+            exc_info = sys.exc_info()
+        else:
+            exc_info = None
+        with condition:
+            seconds[name] = time.time() - start
+            debug("Phase {0} took {1:.2f} s".format(name, seconds[name]))
+            if exc_info is None:
+                results[name] = value
+            else:
+                failures.append((name, exc_info))
+            running.discard(name)
+            condition.notify()
+
+    with condition:
+        while True:
+            for name, (function, requires) in list(pending.items()):
+                if failures:
+                    break
+                if all(r in results for r in requires):
+                    del pending[name]
+                    running.add(name)
+                    args = [results[r] for r in requires]
+                    thread = threading.Thread(target=run,
+                                              args=(name, function, args),
+                                              name='bloom-' + name)
+                    thread.daemon = True
+                    thread.start()
+            if not running:
+                break
+            condition.wait()
+    if failures:
+        name, exc_info = failures[0]
+        # bailout already reported its reason
+        if not isinstance(exc_info[1],
+                          (BloomError, SystemExit, KeyboardInterrupt)):
+            error("Phase {0} failed:\n{1}".format(
+                name, ''.join(traceback.format_exception(*exc_info))))
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return results, seconds
+
+
+def format_seconds(seconds):
+    """Returns a line per phase with how long it took"""
+    width = max([len(name) for name in seconds] + [0])
+    return '\n'.join('{0}  {1:6.2f} s'.format(name.ljust(width), value)
+                     for name, value in seconds.items())
@@ -0,0 +1,387 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Releases many release repositories at once, like git-bloom-release-many.
+
+Each release repository listed in the manifest is imported, branched and has
+its debians generated, like running git-bloom-import-upstream and
+git-bloom-release in it, on a pool of worker processes.  The workers are
+processes rather than threads because the bloom commands change the working
+directory and keep their state per process.
+
+Before the pool is started rosdep is updated once and the rosdep index and
+templates are loaded, so the forked workers share them instead of each
+updating rosdep and loading them again.  The output of each repository goes
+to its own log file, and a table of the results is printed at the end.
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from . logging import error
+from . logging import info
+from . logging import warning
+from . rosdep_cache import add_rosdep_arguments
+from . rosdep_cache import get_default_max_age
+from . util import add_global_arguments
+from . util import bailout
+from . util import handle_global_arguments
+
+# Columns of the results table
+RESULT_FIELDS = ['repository', 'status', 'step', 'seconds', 'version',
+                 'branches', 'tags', 'log', 'message']
+
+
+def parse_manifest(manifest):
+    """
+    Returns the release repositories listed in a manifest file.
+
+    The manifest lists one release repository path per line, blank lines and
+    everything after a ``#`` are ignored.  Relative paths are relative to the
+    directory of the manifest.
+
+    :param manifest: path to the manifest file
+    :returns: list of absolute release repository paths, in manifest order
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+    repositories = []
+    with open(manifest, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            path = os.path.normpath(os.path.join(base, line))
+            if path not in repositories:
+                repositories.append(path)
+    return repositories
+
+
+def get_default_jobs():
+    """
+    Returns the default number of workers, twice the number of cores.
+
+    Much of a release is spent waiting on git and the network rather than the
+    cpu, so the pool is larger than the number of cores.
+    """
+    try:
+        return multiprocessing.cpu_count() * 2
+    except NotImplementedError:
+        return 2
+
+
+def _log_name(repository):
+    name = os.path.basename(repository.rstrip(os.sep)) or 'repository'
+    return name + '.log'
+
+
+def warm_caches(rosdistro, update_rosdep=True, rosdep_max_age=None):
+    """
+    Updates rosdep and loads the rosdep index and templates for rosdistro.
+
+    Called before the workers are forked so they all start with them.
+
+    :param update_rosdep: if False rosdep is not updated
+    :param rosdep_max_age: if given rosdep is only updated if the last
+        update is older than this many seconds
+
+    :returns: True if successful, False if rosdep could not be updated or
+        the ubuntu targets of rosdistro could not be determined
+    """
+    import pkg_resources
+    from . generators import debian
+    from . phases import format_seconds
+    from . phases import run_phases
+    from . rosdep_cache import get_ubuntu_targets
+    from . rosdep_cache import update_rosdep as update_rosdep_cache
+    from . rosdep_index import get_rosdep_index
+
+    def load_templates():
+        for name in pkg_resources.resource_listdir('bloom', 'resources/em'):
+            if name.endswith('.em'):
+                debian._get_template('resources/em/' + name)
+
+    def update():
+        if update_rosdep:
+            update_rosdep_cache(rosdep_max_age)
+
+    rosdep2 = debian._import_rosdep()
+    try:
+        # The templates are loaded while rosdep is updated, an update
+        # clears the targets, so they are looked up after it
+        _, seconds = run_phases([
+            ('templates', load_templates, []),
+            ('rosdep update', update, []),
+            ('targets', lambda updated: get_ubuntu_targets(rosdistro),
+             ['rosdep update']),
+            ('rosdep index', lambda targets: get_rosdep_index(
+                rosdistro, targets), ['targets']),
+        ])
+    except Exception as err:
+        error("Failed to prepare rosdep for {0}: {1}".format(rosdistro, err))
+        return False
+    info("Prepared the caches for {0}:\n{1}".format(
+        rosdistro, format_seconds(seconds)))
+    return True
+
+
+def release_repository(repository, rosdistro, debian_revision=0,
+                       skip_import=False, maintenance=False):
+    """
+    Imports, branches and generates the debians of one release repository.
+
+    The release tags are only written if all of the steps succeed.  rosdep is
+    not updated, see :py:func:`warm_caches`.
+
+    :param repository: path to the release repository
+    :param rosdistro: ros distro to generate the debians for
+    :param debian_revision: debian revision of the generated debians
+    :param skip_import: if True the upstream is not imported first
+    :param maintenance: if True the ref counts and ref lookup time before and
+        after the refs and objects are packed at the end are logged
+    :returns: dict with the RESULT_FIELDS, except for log
+    """
+    from . import api
+    from . git import format_maintenance_report
+    from . git import get_ref_stats
+    from . git import maintain_repository
+    from . git import tag_batch
+    from . util import BloomError
+    result = dict.fromkeys(RESULT_FIELDS, '')
+    result.update(repository=repository, status='failed', branches=0,
+                  tags=0)
+    start = time.time()
+    step = 'import'
+    try:
+        if not os.path.isdir(repository):
+            raise BloomError("No such release repository: " + repository)
+        before = get_ref_stats(repository) if maintenance else None
+        if not skip_import:
+            imported = api.import_upstream(directory=repository)
+            result['version'] = imported.version
+        with tag_batch(directory=repository):
+            step = 'branch'
+            branched = api.branch('upstream', 'release',
+                                  directory=repository)
+            result['branches'] = len(branched.branches)
+            step = 'generate'
+            generated = api.generate_debian_all(
+                rosdistro, 'release', debian_revision, update_rosdep=False,
+                directory=repository)
+            result['tags'] = len(generated.tags)
+        step = 'maintenance'
+        commands = maintain_repository(repository)
+        if before is not None:
+            for line in format_maintenance_report(
+                    before, get_ref_stats(repository), commands):
+                info(line)
+        step = ''
+        result['status'] = 'ok'
+    except Exception as err:
+        traceback.print_exc()
+        result['message'] = str(err).strip().replace('\n', ' ')
+    result['step'] = step
+    result['seconds'] = '{0:.1f}'.format(time.time() - start)
+    return result
+
+
+def _worker(task):
+    """Runs release_repository in a worker with its output in a log file"""
+    repository, log_path, args = task
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log_path, 'w') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    with open(os.devnull, 'r') as devnull:
+        os.dup2(devnull.fileno(), 0)
+    try:
+        result = release_repository(repository, *args)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    result['log'] = log_path
+    return result
+
+
+def release_many(repositories, rosdistro, debian_revision=0, jobs=None,
+                 log_dir='.', skip_import=False, maintenance=False):
+    """
+    Releases each of the repositories on a pool of worker processes.
+
+    :param repositories: list of release repository paths
+    :param rosdistro: ros distro to generate the debians for
+    :param debian_revision: debian revision of the generated debians
+    :param jobs: number of workers, by default :py:func:`get_default_jobs`
+    :param log_dir: directory for the log file of each repository
+    :param skip_import: if True the upstreams are not imported first
+    :param maintenance: if True a maintenance report is written to the log of
+        each repository, see :py:func:`release_repository`
+    :returns: list of result dicts, in the order of repositories
+    """
+    if jobs is None:
+        jobs = get_default_jobs()
+    jobs = max(1, min(jobs, len(repositories)))
+    tasks = []
+    logs = set()
+    for repository in repositories:
+        log_name = _log_name(repository)
+        # Repositories with the same name in different directories
+        count = 1
+        while log_name in logs:
+            count += 1
+            log_name = _log_name(repository)[:-4] + '.' + str(count) + '.log'
+        logs.add(log_name)
+        tasks.append((repository, os.path.join(log_dir, log_name),
+                      (rosdistro, debian_revision, skip_import,
+                       maintenance)))
+    results = {}
+    # Each worker releases one repository, which gives each release a clean
+    # process forked from this one with the caches already loaded
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(_worker, tasks):
+            results[result['repository']] = result
+            info("[{0}/{1}] {2}: {3} ({4}s)".format(
+                len(results), len(tasks), result['repository'],
+                result['status'] if result['status'] == 'ok' else
+                'failed in ' + result['step'], result['seconds']))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return [results[repository] for repository in repositories]
+
+
+def format_results(results):
+    """Returns the results as an aligned table"""
+    rows = [[f.upper() for f in RESULT_FIELDS if f != 'log']]
+    for result in results:
+        rows.append([str(result[f]) for f in RESULT_FIELDS if f != 'log'])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
+
+def write_results(results, path):
+    """Writes the results as tab separated values with a header line"""
+    with open(path, 'w') as f:
+        f.write('\t'.join(RESULT_FIELDS) + '\n')
+        for result in results:
+            cells = [str(result[field]).replace('\t', ' ')
+                     for field in RESULT_FIELDS]
+            f.write('\t'.join(cells) + '\n')
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="""\
+Releases each of the release repositories listed in a manifest.
+
+For each release repository this runs the equivalent of:
+
+  git-bloom-import-upstream
+  git-bloom-release <rosdistro> --debian-revision <debian_revision>
+
+without prompting, on a pool of worker processes.  The manifest lists one
+release repository path per line.
+""", formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rosdistro', help="The ros distro")
+    parser.add_argument('manifest',
+                        help="file listing the release repositories")
+    parser.add_argument('--debian-revision', '-r', dest='debian_revision',
+                        type=int, default=0,
+                        help="debian revision of the generated debians")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="number of repositories to release at once, "
+                             "defaults to twice the number of cores")
+    parser.add_argument('--log-dir', default='.',
+                        help="directory for the log of each repository")
+    parser.add_argument('--results', default=None,
+                        help="also write the results to this file as tab "
+                             "separated values")
+    parser.add_argument('--skip-import', action='store_true', default=False,
+                        help="do not import the upstreams first")
+    parser.add_argument('--maintenance', action='store_true', default=False,
+                        help="log the ref counts and ref lookup time of each "
+                             "repository before and after its refs and "
+                             "objects are packed at the end")
+    parser.add_argument('--do-not-update-rosdep', dest='update_rosdep',
+                        action='store_false', default=True,
+                        help="do not update rosdep first")
+    add_rosdep_arguments(parser)
+    return parser
+
+
+def main(sysargs=None):
+    parser = get_argument_parser()
+    parser = add_global_arguments(parser)
+    args = parser.parse_args(sysargs)
+    handle_global_arguments(args)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    repositories = parse_manifest(args.manifest)
+    if not repositories:
+        warning("No release repositories in " + args.manifest)
+        return 0
+    if not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+    max_age = args.rosdep_max_age
+    if max_age is None:
+        try:
+            max_age = get_default_max_age()
+        except ValueError as err:
+            bailout("$BLOOM_ROSDEP_MAX_AGE: " + str(err))
+    if not warm_caches(args.rosdistro, args.update_rosdep, max_age):
+        return 1
+    results = release_many(repositories, args.rosdistro,
+                           args.debian_revision, args.jobs, args.log_dir,
+                           args.skip_import, args.maintenance)
+    print(format_results(results))
+    if args.results is not None:
+        write_results(results, args.results)
+    failed = [r for r in results if r['status'] != 'ok']
+    if failed:
+        error("{0} of {1} release repositories failed, see their logs in {2}"
+              .format(len(failed), len(results), args.log_dir))
+        return 1
+    return 0
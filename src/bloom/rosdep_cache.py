@@ -0,0 +1,377 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Bloom's caches of rosdep data.
+
+``rosdep update`` downloads all of the rosdep sources again, which is slow,
+so with a maximum age it is only run when the last update is older than that,
+or when the sources list changed since.  Each update writes a stamp with its
+time and the fingerprint of the sources list and cache to bloom's cache, and
+is done holding a file lock, so concurrent bloom processes wait for one update
+instead of all updating at the same time.
+
+The ubuntu distros targeted by each ros distro are downloaded once and cached
+next to the stamp, until rosdep is updated or the cache is cleared with
+``git-bloom-rosdep-cache clear``.  A targets file given with
+$BLOOM_UBUNTU_TARGETS is used instead of the download, e.g. for offline runs,
+it maps each ros distro to its ubuntu distros::
+
+    groovy: [oneiric, precise, quantal]
+"""
+
+from __future__ import print_function
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import re
+import time
+
+from contextlib import contextmanager
+
+from . logging import debug
+from . logging import info
+from . util import add_global_arguments
+from . util import get_cache_dir
+from . util import handle_global_arguments
+
+_age_re = re.compile(r'^(\d+(?:\.\d+)?)([smhdw]?)$')
+_age_units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Ubuntu targets by ros distro, once read from the cache
+_targets = {}
+
+
+def parse_age(text):
+    """
+    Parses an age like ``90``, ``30m``, ``1h`` or ``2d`` into seconds.
+
+    :raises: ValueError if text is not an age
+    """
+    match = _age_re.match(text.strip().lower())
+    if match is None:
+        raise ValueError("Invalid age, expected a number of seconds or a "
+                         "number followed by s, m, h, d or w: " + text)
+    return float(match.group(1)) * _age_units[match.group(2)]
+
+
+def get_default_max_age():
+    """
+    Returns the maximum age from $BLOOM_ROSDEP_MAX_AGE, or None if not set.
+
+    :raises: ValueError if it is not an age
+    """
+    value = os.environ.get('BLOOM_ROSDEP_MAX_AGE')
+    return parse_age(value) if value else None
+
+
+def add_rosdep_arguments(parser):
+    """Adds the --rosdep-max-age option to parser"""
+    parser.add_argument('--rosdep-max-age', type=parse_age, default=None,
+                        metavar='AGE',
+                        help="only update rosdep if the last update is "
+                             "older than this, e.g. 30m or 1h, defaults to "
+                             "$BLOOM_ROSDEP_MAX_AGE, otherwise rosdep is "
+                             "always updated")
+    return parser
+
+
+def _files_fingerprint(directory):
+    entries = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return entries
+    for name in names:
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append([name, st.st_mtime, st.st_size])
+    return entries
+
+
+def get_fingerprint():
+    """
+    Returns the fingerprint of rosdep's sources list and sources cache.
+
+    The fingerprint changes when a source is added, removed or edited, or
+    when the cache is updated.
+    """
+    from rosdep2.sources_list import CACHE_INDEX
+    from rosdep2.sources_list import get_sources_cache_dir
+    from rosdep2.sources_list import get_sources_list_dir
+    cache_index = os.path.join(get_sources_cache_dir(), CACHE_INDEX)
+    try:
+        st = os.stat(cache_index)
+        cache = [st.st_mtime, st.st_size]
+    except OSError:
+        cache = None
+    return {'sources': _files_fingerprint(get_sources_list_dir()),
+            'cache': cache}
+
+
+def _stamp_path():
+    return os.path.join(get_cache_dir('rosdep'), 'update.stamp')
+
+
+def read_stamp():
+    """Returns the stamp of the last update, a dict or None"""
+    try:
+        with open(_stamp_path(), 'r') as f:
+            stamp = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(stamp, dict) or 'time' not in stamp:
+        return None
+    return stamp
+
+
+def write_stamp(fingerprint, now=None):
+    path = _stamp_path()
+    tmp_path = path + '.tmp.' + str(os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'time': now if now is not None else time.time(),
+                   'fingerprint': fingerprint}, f)
+    os.rename(tmp_path, path)
+
+
+def is_fresh(max_age, stamp=None, fingerprint=None, now=None):
+    """
+    Returns True if the last update is younger than max_age seconds and the
+    sources list and cache did not change since.
+    """
+    stamp = stamp if stamp is not None else read_stamp()
+    if stamp is None or max_age is None:
+        return False
+    now = now if now is not None else time.time()
+    if not 0 <= now - stamp['time'] < max_age:
+        return False
+    fingerprint = fingerprint if fingerprint is not None else \
+        get_fingerprint()
+    return stamp.get('fingerprint') == fingerprint
+
+
+@contextmanager
+def update_lock():
+    """Context manager which holds the lock for updating rosdep"""
+    path = os.path.join(get_cache_dir('rosdep'), 'update.lock')
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def update_rosdep(max_age=None, update=None):
+    """
+    Updates rosdep, unless it was updated recently.
+
+    If another bloom process is updating rosdep this waits for it, and does
+    not update again if that update finished after this was called.
+
+    :param max_age: maximum age of the last update in seconds, None to
+        always update
+    :param update: function which updates rosdep, by default
+        ``rosdep2.catkin_support.update_rosdep``
+    :returns: True if rosdep was updated, False if it was fresh
+    """
+    if update is None:
+        from rosdep2.catkin_support import update_rosdep as update
+    requested = time.time()
+    with update_lock():
+        stamp = read_stamp()
+        if stamp is not None and stamp['time'] >= requested:
+            debug("rosdep was updated by another process")
+            return False
+        if is_fresh(max_age, stamp):
+            info("rosdep was updated {0:.0f}s ago, not updating it".format(
+                 time.time() - stamp['time']))
+            return False
+        info("Updating rosdep")
+        update()
+        write_stamp(get_fingerprint())
+        # Download the targets again along with the new rosdep data
+        clear_cache(['targets'])
+    return True
+
+
+def _targets_path():
+    return os.path.join(get_cache_dir('rosdep'), 'ubuntu_targets.json')
+
+
+def load_targets_file(path):
+    """
+    Reads a targets file.
+
+    Besides a mapping of each ros distro to a list of ubuntu distros, the
+    REP 3 formats, with ``{ubuntu: [...]}`` for each ros distro or a list of
+    single entry mappings, are accepted.
+
+    :returns: dict of ros distro to the list of ubuntu distros
+    """
+    import yaml
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f) or {}
+    if isinstance(data, list):
+        merged = {}
+        for entry in data:
+            merged.update(entry)
+        data = merged
+    targets = {}
+    for rosdistro, distros in data.items():
+        if isinstance(distros, dict):
+            distros = distros.get('ubuntu', [])
+        targets[str(rosdistro)] = [str(d) for d in distros]
+    return targets
+
+
+def _download_targets(rosdistro):
+    from . generators.debian import _import_rosdep
+    rosdep2 = _import_rosdep()
+    return list(rosdep2.catkin_support.get_ubuntu_targets(rosdistro))
+
+
+def get_ubuntu_targets(rosdistro, targets_file=None, download=None):
+    """
+    Returns the ubuntu distros targeted by a ros distro.
+
+    :param rosdistro: the ros distro
+    :param targets_file: file to read the targets from, by default
+        $BLOOM_UBUNTU_TARGETS, otherwise the targets are read from the cache
+        or downloaded and cached
+    :param download: function which downloads the targets of a ros distro,
+        by default from rosdep
+    :returns: list of ubuntu distro codenames
+
+    :raises: KeyError if rosdistro is not in the targets file, otherwise the
+        errors of downloading the targets
+    """
+    targets_file = targets_file or os.environ.get('BLOOM_UBUNTU_TARGETS')
+    if targets_file:
+        return load_targets_file(targets_file)[rosdistro]
+    if rosdistro in _targets:
+        return list(_targets[rosdistro])
+    path = _targets_path()
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        cached = {}
+    if rosdistro not in cached:
+        debug("Downloading the ubuntu targets of " + rosdistro)
+        cached[rosdistro] = (download or _download_targets)(rosdistro)
+        tmp_path = path + '.tmp.' + str(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(cached, f)
+        os.rename(tmp_path, path)
+    _targets[rosdistro] = [str(d) for d in cached[rosdistro]]
+    return list(_targets[rosdistro])
+
+
+# Files of each cache in the rosdep cache directory
+_cache_files = {
+    'index': '*.index',
+    'stamp': 'update.stamp',
+    'targets': 'ubuntu_targets.json'
+}
+
+
+def clear_cache(caches=None):
+    """
+    Removes cached rosdep data.
+
+    :param caches: list of the caches to clear, ``index``, ``stamp`` or
+        ``targets``, by default all of them
+    :returns: list of the removed files
+    """
+    removed = []
+    cache_dir = get_cache_dir('rosdep')
+    for cache in caches or sorted(_cache_files):
+        if cache == 'targets':
+            _targets.clear()
+        elif cache == 'index':
+            from . rosdep_index import _indexes
+            _indexes.clear()
+        for path in glob.glob(os.path.join(cache_dir, _cache_files[cache])):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="""\
+Shows or clears bloom's cached rosdep data: the ubuntu targets of each ros
+distro, the rosdep key indexes and the stamp of the last rosdep update.
+""")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('show', help="show the cached data")
+    clear = subparsers.add_parser('clear', help="clear the cached data")
+    clear.add_argument('caches', nargs='*', metavar='CACHE',
+                       help="caches to clear, one of: " +
+                            ', '.join(sorted(_cache_files)) +
+                            ", by default all of them")
+    return parser
+
+
+def main(sysargs=None):
+    parser = get_argument_parser()
+    parser = add_global_arguments(parser)
+    args = parser.parse_args(sysargs)
+    handle_global_arguments(args)
+    cache_dir = get_cache_dir('rosdep')
+    if args.command == 'clear':
+        unknown = [c for c in args.caches if c not in _cache_files]
+        if unknown:
+            parser.error("unknown caches: " + ', '.join(unknown))
+        for path in clear_cache(args.caches or None):
+            info("Removed " + path)
+        return 0
+    print("Cache: " + cache_dir)
+    stamp = read_stamp()
+    if stamp is not None:
+        print("Last rosdep update: " + time.strftime(
+              '%Y-%m-%d %H:%M:%S', time.localtime(stamp['time'])))
+    try:
+        with open(_targets_path(), 'r') as f:
+            for rosdistro, distros in sorted(json.load(f).items()):
+                print("Targets of {0}: {1}".format(rosdistro,
+                                                   ' '.join(distros)))
+    except (IOError, OSError, ValueError):
+        pass
+    for path in sorted(glob.glob(os.path.join(cache_dir, '*.index'))):
+        print("Index: " + os.path.basename(path))
+    return 0
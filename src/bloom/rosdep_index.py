@@ -0,0 +1,302 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Precomputed table of the packages each rosdep key resolves to.
+
+Resolving a rosdep key through a rosdep view walks the view's lookup chain
+and the os and installer rules every time, and the debian generator resolves
+the same keys for every package and distro.  Instead every key of the rosdep
+views of a ros distro is resolved once, for all of the ubuntu distros, and
+written to a table in bloom's cache, which is rebuilt when rosdep is updated.
+
+The table is a text file, the first line is a header and each of the other
+lines has a rosdep key followed by the packages it resolves to for each of
+the distros in the header, tab separated.  The packages of a distro are comma
+separated, or ``!`` if the key does not resolve on it.  The lines are sorted
+by key, so the table is memory mapped and keys are looked up with a binary
+search instead of reading and parsing the whole table.
+"""
+
+from __future__ import print_function
+
+import json
+import mmap
+import os
+
+from . logging import debug
+from . logging import info
+from . util import get_cache_dir
+
+_magic = 'bloom-rosdep-index'
+_version = '1'
+_unresolved = '!'
+
+# Loaded indexes, keyed by path
+_indexes = {}
+
+
+class UnresolvedKey(KeyError):
+    """
+    Raised when a rosdep key does not resolve on a distro.
+
+    :ivar rosdep_key: the rosdep key
+    """
+
+    def __init__(self, rosdep_key, codename=None):
+        KeyError.__init__(self, rosdep_key)
+        self.rosdep_key = rosdep_key
+        self.codename = codename
+
+    def __str__(self):
+        return self.rosdep_key
+
+
+class RosdepIndex(object):
+    """
+    A memory mapped rosdep resolution table.
+
+    :ivar rosdistro: ros distro of the table
+    :ivar os_name: os of the table, e.g. ``ubuntu``
+    :ivar codenames: list of the distros in the table
+    :ivar signature: signature of the rosdep cache the table was built from
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self._mmap.find('\n')
+        fields = self._mmap[:header_end].split(' ', 2)
+        if len(fields) != 3 or fields[:2] != [_magic, _version]:
+            self._mmap.close()
+            raise ValueError("Not a rosdep index: " + path)
+        header = json.loads(fields[2])
+        self.rosdistro = header['rosdistro']
+        self.os_name = header['os_name']
+        self.codenames = header['codenames']
+        self.signature = header['signature']
+        self._start = header_end + 1
+        self._columns = dict((c, i) for i, c in enumerate(self.codenames))
+        self._rows = {}
+
+    def _find(self, key):
+        """Returns the fields of the line of key, by binary search"""
+        mm = self._mmap
+        lo, hi = self._start, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind('\n', self._start - 1, mid) + 1
+            end = mm.find('\n', start)
+            if end == -1:
+                end = len(mm)
+            line = mm[start:end]
+            line_key = line.split('\t', 1)[0]
+            if line_key < key:
+                lo = end + 1
+            elif line_key > key:
+                hi = start
+            else:
+                return line.split('\t')[1:]
+        return None
+
+    def lookup(self, key):
+        """
+        Returns what a rosdep key resolves to on each distro.
+
+        :param key: the rosdep key
+        :returns: dict of distro to the list of packages, or None for the
+            distros on which the key does not resolve, or None if the key is
+            not in the rosdep views at all
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        if key not in self._rows:
+            fields = self._find(key)
+            row = None
+            if fields is not None:
+                row = {}
+                for codename, field in zip(self.codenames, fields):
+                    if field == _unresolved:
+                        row[codename] = None
+                    else:
+                        row[codename] = field.split(',') if field else []
+            self._rows[key] = row
+        return self._rows[key]
+
+    def resolve(self, keys, codename):
+        """
+        Returns the packages a set of rosdep keys resolve to on a distro.
+
+        :param keys: iterable of rosdep keys
+        :param codename: the distro, which must be in the table
+        :returns: set of package names
+
+        :raises: UnresolvedKey for the first key which does not resolve
+        """
+        if codename not in self._columns:
+            raise ValueError("The rosdep index has no " + codename)
+        packages = set()
+        for key in keys:
+            row = self.lookup(key)
+            if row is None or row[codename] is None:
+                raise UnresolvedKey(key, codename)
+            packages.update(row[codename])
+        return packages
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_index(path, rosdistro, os_name, signature, resolved):
+    """
+    Writes a rosdep index.
+
+    :param path: path of the index, which is replaced atomically
+    :param resolved: dict of distro to a dict of rosdep key to the list of
+        packages it resolves to, or None if it does not resolve
+    """
+    codenames = sorted(resolved)
+    keys = set()
+    for table in resolved.values():
+        keys.update(table)
+    rows = []
+    for key in keys:
+        encoded = key.encode('utf-8') if isinstance(key, unicode) else key
+        if '\t' in encoded or '\n' in encoded:
+            continue
+        fields = [encoded]
+        for codename in codenames:
+            packages = resolved[codename].get(key)
+            if packages is None:
+                fields.append(_unresolved)
+            else:
+                fields.append(','.join(sorted(packages)))
+        rows.append('\t'.join(fields))
+    rows.sort()
+    header = json.dumps({'rosdistro': rosdistro, 'os_name': os_name,
+                         'codenames': codenames, 'signature': signature})
+    tmp_path = path + '.tmp.' + str(os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(' '.join([_magic, _version, header]) + '\n')
+        f.write(''.join(row + '\n' for row in rows))
+    os.rename(tmp_path, path)
+
+
+def _resolve_view(rosdistro, os_name, codename):
+    """Resolves every key of the rosdep view of a distro"""
+    from . generators.debian import _import_rosdep
+    from . generators.debian import get_rosdep_view
+    rosdep2 = _import_rosdep()
+    view = get_rosdep_view(rosdistro, os_name, codename)
+    context = rosdep2.create_default_installer_context()
+    os_installers = context.get_os_installer_keys(os_name)
+    default_installer = context.get_default_os_installer_key(os_name)
+    installer = context.get_installer(rosdep2.platforms.debian.APT_INSTALLER)
+    resolved = {}
+    for key in view.keys():
+        try:
+            definition = view.lookup(key)
+            installer_key, rule = definition.get_rule_for_platform(
+                os_name, codename, os_installers, default_installer)
+            if installer_key not in os_installers:
+                resolved[key] = None
+                continue
+            resolved[key] = list(installer.resolve(rule))
+        except (KeyError, rosdep2.ResolutionError, rosdep2.InvalidData):
+            resolved[key] = None
+    return resolved
+
+
+def _rosdep_signature():
+    """Returns the signature of rosdep's sources cache, or None"""
+    from rosdep2.sources_list import CACHE_INDEX, get_sources_cache_dir
+    try:
+        st = os.stat(os.path.join(get_sources_cache_dir(), CACHE_INDEX))
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def _load(path):
+    try:
+        return RosdepIndex(path)
+    except (IOError, OSError, ValueError, mmap.error):
+        return None
+
+
+def get_rosdep_index(rosdistro, codenames, os_name='ubuntu', resolve=None,
+                     signature=None):
+    """
+    Returns the rosdep index of a ros distro, building it if needed.
+
+    The index is rebuilt if rosdep was updated since it was built, or if it
+    does not have all of the codenames.
+
+    :param rosdistro: the ros distro
+    :param codenames: the distros the index has to have
+    :param os_name: the os of the distros
+    :param resolve: function which resolves every key of a distro, by
+        default from rosdep, see :py:func:`write_index`
+    :param signature: signature of the rosdep data, by default of rosdep's
+        sources cache
+    :returns: RosdepIndex
+
+    :raises: rosdep2.catkin_support.ValidationFailed if rosdep is not
+        initialized
+    """
+    if resolve is None:
+        from . generators.debian import _import_rosdep
+        _import_rosdep()
+        resolve = _resolve_view
+        signature = _rosdep_signature()
+    path = os.path.join(get_cache_dir('rosdep'),
+                        '{0}-{1}.index'.format(os_name, rosdistro))
+    index = _indexes.get(path)
+    if index is None or index.signature != signature:
+        index = _load(path)
+    if index is not None and index.signature == signature \
+       and set(codenames) <= set(index.codenames):
+        _indexes[path] = index
+        return index
+    codenames = set(codenames)
+    if index is not None and index.signature == signature:
+        codenames.update(index.codenames)
+    info("Indexing the rosdep keys of {0} for {1}".format(
+         rosdistro, ', '.join(sorted(codenames))))
+    resolved = {}
+    for codename in codenames:
+        resolved[codename] = resolve(rosdistro, os_name, codename)
+    write_index(path, rosdistro, os_name, signature, resolved)
+    debug("Wrote the rosdep index " + path)
+    index = RosdepIndex(path)
+    _indexes[path] = index
+    return index
@@ -0,0 +1,471 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A long running bloom process which runs the git-bloom-* commands for clients.
+
+``git-bloom-serve`` listens on a Unix socket, imports the modules the commands
+use once, and runs each command it is sent in a child forked from itself, which
+runs the script with runpy.  So a command neither starts python nor loads bloom
+again, the commands of several clients run at the same time, and the global
+state a command changes, e.g. the library mode, the branch stacks or the
+counts of written objects, is dropped with its child.  So are the in process
+caches it fills, the caches on disk, e.g. of the rosdep views, are shared
+between the commands.  The git-bloom-* scripts call
+:py:func:`forward_to_server` before anything else, which hands the command to
+the server when one is running and returns otherwise, so the command runs
+locally exactly as it would without a server.
+
+The client and the server exchange frames of a one byte channel, a four byte
+length and the data.  The client sends the request (``r``) followed by its
+stdin (``0``, empty at the end of input), and the server sends the command's
+stdout (``1``) and stderr (``2``) as they are written, then the exit code
+(``x``).
+"""
+
+from __future__ import print_function
+
+import fcntl
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+
+_header = struct.Struct('>cI')
+
+# True in the server process, where the scripts must not forward to itself
+_serving = False
+
+
+def get_socket_path():
+    """
+    Returns the path of the bloom server socket.
+
+    This is $BLOOM_SERVER_SOCKET if set, otherwise a socket in a directory
+    only accessible to the current user.
+    """
+    if os.environ.get('BLOOM_SERVER_SOCKET'):
+        return os.environ['BLOOM_SERVER_SOCKET']
+    import tempfile
+    return os.path.join(tempfile.gettempdir(),
+                        'bloom-{0}'.format(os.getuid()), 'server.sock')
+
+
+def check_private(socket_path):
+    """
+    Checks that only the current user can reach the socket at socket_path.
+
+    The directory of the socket must be owned by the current user with mode
+    0700, and the socket, if it exists, must be owned by the current user.
+    Neither may be a symbolic link.
+
+    :param socket_path: path of the server socket
+    :returns: None if the socket is private, otherwise the reason it is not
+    """
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    for path, is_dir in [(socket_dir, True), (socket_path, False)]:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            if is_dir:
+                return socket_dir + " does not exist"
+            continue
+        if st.st_uid != os.getuid():
+            return path + " is not owned by the current user"
+        if is_dir and (not stat.S_ISDIR(st.st_mode) or
+                       stat.S_IMODE(st.st_mode) != 0o700):
+            return path + " is not a directory with mode 0700"
+        if not is_dir and (not stat.S_ISSOCK(st.st_mode) or
+                           stat.S_IMODE(st.st_mode) & 0o077):
+            return path + " is not a socket private to the current user"
+    return None
+
+
+def _send_frame(sock, channel, data, lock=None):
+    frame = _header.pack(channel, len(data)) + data
+    if lock is None:
+        sock.sendall(frame)
+        return
+    with lock:
+        sock.sendall(frame)
+
+
+def _recv_exactly(sock, size):
+    data = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        data.append(chunk)
+        size -= len(chunk)
+    return ''.join(data)
+
+
+def _recv_frame(sock):
+    """Returns (channel, data), or (None, None) if the connection closed"""
+    header = _recv_exactly(sock, _header.size)
+    if header is None:
+        return None, None
+    channel, size = _header.unpack(header)
+    data = _recv_exactly(sock, size) if size else ''
+    if data is None:
+        return None, None
+    return channel, data
+
+
+def forward_to_server(command):
+    """
+    Runs the command in the bloom server if one is running.
+
+    This does not return if the command was forwarded, instead it exits with
+    the return code of the command.  The command is run locally, by
+    returning, if there is no server, if this is the server, if
+    $BLOOM_NO_SERVER is set or if stdin is a terminal, since interactive
+    prompts are not forwarded.
+
+    :param command: name of the script, e.g. ``git-bloom-patch``
+    """
+    if _serving or os.environ.get('BLOOM_NO_SERVER'):
+        return
+    if sys.stdin.isatty():
+        return
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return
+    # The environment is sent to the server, which must be the user's own
+    reason = check_private(path)
+    if reason is not None:
+        sys.stderr.write("Not using the bloom server: " + reason + "\n")
+        return
+    try:
+        request = json.dumps({
+            'command': command,
+            'argv': sys.argv[1:],
+            'cwd': os.getcwd(),
+            'env': dict(os.environ)
+        })
+    except (OSError, ValueError):
+        # e.g. arguments which are not valid utf-8
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return
+    lock = threading.Lock()
+    _send_frame(sock, 'r', request, lock)
+
+    def send_stdin():
+        try:
+            while True:
+                data = os.read(0, 65536)
+                _send_frame(sock, '0', data, lock)
+                if not data:
+                    break
+        except (OSError, socket.error):
+            pass
+
+    stdin_thread = threading.Thread(target=send_stdin)
+    stdin_thread.daemon = True
+    stdin_thread.start()
+    while True:
+        channel, data = _recv_frame(sock)
+        if channel == '1':
+            sys.stdout.write(data)
+            sys.stdout.flush()
+        elif channel == '2':
+            sys.stderr.write(data)
+            sys.stderr.flush()
+        elif channel == 'x':
+            sock.close()
+            sys.exit(json.loads(data))
+        else:
+            print("Lost the connection to the bloom server running "
+                  + command + ".", file=sys.stderr)
+            sys.exit(1)
+
+
+def _exit_code(err):
+    """Returns the exit code of a SystemExit, printing it if a message"""
+    if err.code is None:
+        return 0
+    if isinstance(err.code, int):
+        return err.code
+    print(err.code, file=sys.stderr)
+    return 1
+
+
+def _set_cloexec(fd):
+    """Keeps subprocesses from inheriting the server's end of a pipe"""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return fd
+
+
+def _pump(fd, sock, channel, lock):
+    """Sends what is written to the pipe fd to the client until it closes"""
+    try:
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            _send_frame(sock, channel, data, lock)
+    except (OSError, socket.error):
+        pass
+    finally:
+        os.close(fd)
+
+
+def _feed_stdin(sock, fd):
+    """Writes the client's stdin frames to the pipe fd until it ends"""
+    try:
+        while True:
+            channel, data = _recv_frame(sock)
+            if channel != '0' or not data:
+                break
+            os.write(fd, data)
+    except (OSError, socket.error):
+        pass
+    finally:
+        os.close(fd)
+
+
+def _run_script(script, argv):
+    """Runs the script as __main__ and returns its exit code"""
+    import runpy
+    sys.argv = [script] + argv
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as err:
+        return _exit_code(err)
+    except Exception:
+        # Print it like python would, without the server's frames
+        etype, value, tb = sys.exc_info()
+        while tb is not None and tb.tb_frame.f_code.co_filename != script:
+            tb = tb.tb_next
+        sys.excepthook(etype, value, tb)
+        return 1
+    return 0
+
+
+def _handle(sock, bin_dir):
+    """Runs the command a client sent, in the forked child of the server"""
+    channel, data = _recv_frame(sock)
+    if channel != 'r':
+        return
+    request = json.loads(data)
+    command = request['command']
+    script = os.path.join(bin_dir, command)
+    if not command.startswith('git-bloom-') or command == 'git-bloom-serve' \
+       or os.sep in command or not os.path.isfile(script):
+        _send_frame(sock, '2', "Unknown bloom command: {0}\n".format(command))
+        _send_frame(sock, 'x', '1')
+        return
+    lock = threading.Lock()
+    threads = []
+    code = 1
+    try:
+        # Point fds 0, 1 and 2 at pipes to and from the client, so the
+        # output of subprocesses is forwarded as well
+        stdin_r, stdin_w = os.pipe()
+        _set_cloexec(stdin_w)
+        os.dup2(stdin_r, 0)
+        os.close(stdin_r)
+        threads.append(threading.Thread(target=_feed_stdin,
+                                        args=(sock, stdin_w)))
+        for fd, out_channel in [(1, '1'), (2, '2')]:
+            out_r, out_w = os.pipe()
+            _set_cloexec(out_r)
+            os.dup2(out_w, fd)
+            os.close(out_w)
+            threads.append(threading.Thread(target=_pump,
+                                            args=(out_r, sock, out_channel,
+                                                  lock)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        sys.stdin = os.fdopen(_set_cloexec(os.dup(0)), 'r')
+        os.environ.clear()
+        os.environ.update(request['env'])
+        try:
+            os.chdir(request['cwd'])
+        except OSError as err:
+            print("Could not change to the directory {0}: {1}"
+                  .format(request['cwd'], err), file=sys.stderr)
+        else:
+            code = _run_script(script, request['argv'])
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # The pumps finish once every writer, including any subprocess which
+        # is still running in the background, has closed its end
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in [0, 1, 2]:
+            os.dup2(devnull, fd)
+        os.close(devnull)
+        for thread in threads[1:]:
+            thread.join()
+    _send_frame(sock, 'x', json.dumps(code), lock)
+
+
+def _fork_handler(server, sock, bin_dir):
+    """Handles a client in a forked child, returns its pid in the server"""
+    import signal
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        server.close()
+        _handle(sock, bin_dir)
+    except socket.error as err:
+        from . logging import error
+        error("Lost a client: " + str(err))
+        code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        # Wakes up the thread still waiting for the client's stdin
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        # Never returns into the server's loop
+        os._exit(code)
+
+
+def _reap(children, block=False):
+    """Waits for the finished children of the server"""
+    for pid in list(children):
+        try:
+            finished, _ = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except OSError:
+            finished = pid
+        if finished:
+            children.discard(pid)
+
+
+def _preload():
+    """Imports the modules the commands use, so the first command is fast"""
+    import bloom.branch.branch_main
+    import bloom.config
+    import bloom.generators.debian.main_all
+    import bloom.import_upstream
+    import bloom.patch.patch_main
+
+
+def serve(bin_dir, socket_path=None):
+    """
+    Runs the bloom server until it is interrupted.
+
+    Each client is handled in a child forked from the server, so the
+    commands of several clients run at the same time.  Once interrupted the
+    server waits for the commands which are still running.
+
+    :param bin_dir: directory containing the git-bloom-* scripts to run
+    :param socket_path: path of the socket, by default
+        :py:func:`get_socket_path`
+    :returns: 0 once interrupted, 1 if a server is already running or the
+        socket would not be private, see :py:func:`check_private`
+    """
+    global _serving
+    from . logging import error
+    from . logging import info
+    socket_path = socket_path or get_socket_path()
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.lexists(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+        os.chmod(socket_dir, 0o700)
+    reason = check_private(socket_path)
+    if reason is not None:
+        error("Refusing to serve on {0}: {1}".format(socket_path, reason))
+        return 1
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            error("A bloom server is already listening on " + socket_path)
+            return 1
+        except socket.error:
+            # Left behind by a server which did not exit cleanly
+            os.remove(socket_path)
+        finally:
+            probe.close()
+    # Loaded before the socket exists, a server which is terminated while
+    # loading does not leave the socket behind
+    _preload()
+    children = set()
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    import signal
+    signal.signal(signal.SIGTERM, terminate)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    _set_cloexec(server.fileno())
+    bound = False
+    try:
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(socket_path)
+            bound = True
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        _serving = True
+        info("Serving bloom commands on " + socket_path)
+        while True:
+            sock, _ = server.accept()
+            _set_cloexec(sock.fileno())
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                children.add(_fork_handler(server, sock, bin_dir))
+            finally:
+                sock.close()
+            _reap(children)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _serving = False
+        server.close()
+        if bound:
+            os.remove(socket_path)
+        _reap(children, block=True)
+    return 0
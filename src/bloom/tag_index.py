@@ -0,0 +1,268 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Index of the upstream and debian tags in a release repository.
+
+Upstream tags look like ``upstream/<version>`` and debian tags look like
+``debian/<package>_<version>-<revision>_<distro>``.  The index is built from a
+single streamed call to ``git for-each-ref`` and is cached, both in process
+and in the git directory, until the tag refs of the repository change.
+"""
+
+from __future__ import print_function
+
+import bisect
+import json
+import os
+import re
+
+from collections import namedtuple
+from subprocess import PIPE, Popen, CalledProcessError
+
+from . git import get_common_git_dir
+from . logging import debug
+
+TagRecord = namedtuple('TagRecord',
+                       'name package version revision distro date')
+
+_debian_tag_re = re.compile(
+    r'^debian/(?P<package>[^/_]+)_(?P<version>[^/_-]+)-(?P<revision>[^/_]+)'
+    r'_(?P<distro>[^/_]+)$')
+
+# In process cache of indexes keyed by the common git dir
+_tag_indexes = {}
+
+
+def version_key(version):
+    """Returns a key which sorts version strings numerically"""
+    key = []
+    for part in re.split(r'[.-]', version):
+        if part.isdigit():
+            key.append((0, int(part), ''))
+        else:
+            key.append((1, 0, part))
+    return tuple(key)
+
+
+def parse_tag(name, date=0):
+    """
+    Parses a tag name into a TagRecord.
+
+    :param name: short name of the tag, e.g. ``upstream/0.1.0``
+    :param date: author date, in seconds since the epoch, of the tagged commit
+    :returns: TagRecord or None if this is not an upstream or debian tag
+    """
+    if name.startswith('upstream/'):
+        version = name[len('upstream/'):]
+        if not version or '/' in version:
+            return None
+        return TagRecord(name, None, version, None, None, date)
+    match = _debian_tag_re.match(name)
+    if match is None:
+        return None
+    return TagRecord(name, match.group('package'), match.group('version'),
+                     match.group('revision'), match.group('distro'), date)
+
+
+class TagIndex(object):
+    """
+    Sorted views of the upstream and debian tags of a repository.
+
+    The upstream tags are kept sorted both by date and by version, and the
+    debian tags are grouped by package, and by package and distro, and sorted
+    by version, so each of the queries is a lookup or a binary search.
+    """
+
+    def __init__(self, records):
+        self.records = list(records)
+        upstream = [r for r in self.records if r.package is None]
+        # Same order as: git for-each-ref --sort='*authordate'
+        self._by_date = sorted(upstream, key=lambda r: (r.date, r.name))
+        by_version = sorted(upstream, key=lambda r: self._key(r))
+        self._version_keys = [self._key(r) for r in by_version]
+        self._by_version = by_version
+        self._by_package = {}
+        self._by_distro = {}
+        for record in self.records:
+            if record.package is not None:
+                self._by_package.setdefault(record.package, []).append(record)
+                self._by_distro.setdefault((record.package, record.distro),
+                                           []).append(record)
+        for records in self._by_package.values():
+            records.sort(key=self._key)
+        for records in self._by_distro.values():
+            records.sort(key=self._key)
+
+    @staticmethod
+    def _key(record):
+        return (version_key(record.version),
+                version_key(record.revision or '0'), record.name)
+
+    def latest_upstream(self):
+        """Returns the most recent upstream TagRecord by date, or None"""
+        return self._by_date[-1] if self._by_date else None
+
+    def latest_upstream_by_version(self, below=None):
+        """
+        Returns the upstream TagRecord with the highest version, or None.
+
+        :param below: if given, only versions lower than this are considered
+        """
+        if below is None:
+            return self._by_version[-1] if self._by_version else None
+        index = bisect.bisect_left(self._version_keys,
+                                   (version_key(below),))
+        return self._by_version[index - 1] if index > 0 else None
+
+    def upstream_tag(self, version):
+        """Returns the upstream TagRecord for the given version, or None"""
+        key = (version_key(version),)
+        index = bisect.bisect_left(self._version_keys, key)
+        if index < len(self._by_version) and \
+           self._by_version[index].version == version:
+            return self._by_version[index]
+        return None
+
+    def tags_for_package(self, package):
+        """Returns the debian TagRecords of a package, sorted by version"""
+        return list(self._by_package.get(package, []))
+
+    def latest_for_package(self, package, distro=None):
+        """
+        Returns the highest versioned debian TagRecord of a package, or None.
+
+        :param distro: if given, only the tags for this distro are considered
+        """
+        if distro is None:
+            records = self._by_package.get(package)
+        else:
+            records = self._by_distro.get((package, distro))
+        return records[-1] if records else None
+
+
+def _refs_signature(common_dir):
+    """
+    Returns a value which changes whenever a tag is created, moved or deleted.
+
+    Tags are written either to packed-refs or as loose files below refs/tags.
+    The mtime of a directory does not change when a loose ref in it is
+    rewritten in place, so the stats of packed-refs and of each loose ref
+    file are used.
+    """
+    signature = []
+    paths = [os.path.join(common_dir, 'packed-refs')]
+    for root, dirs, files in os.walk(os.path.join(common_dir, 'refs', 'tags')):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if not name.endswith('.lock'))
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append([path, st.st_mtime, st.st_size, st.st_ino])
+        except OSError:
+            signature.append([path, None])
+    return signature
+
+
+def _cache_path(common_dir):
+    return os.path.join(common_dir, 'bloom', 'tag_index.json')
+
+
+def _load_cache(common_dir, signature):
+    try:
+        with open(_cache_path(common_dir), 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if data.get('signature') != signature:
+        return None
+    return [TagRecord(*r) for r in data['records']]
+
+
+def _store_cache(common_dir, signature, records):
+    path = _cache_path(common_dir)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = path + '.tmp.' + str(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'signature': signature,
+                       'records': [list(r) for r in records]}, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        debug("Could not store the tag index: " + str(err))
+
+
+def _scan_tags(directory=None):
+    """Streams git for-each-ref over the tags and parses each line"""
+    cmd = "git for-each-ref --format='%(*authordate:raw) %(refname:short)' " \
+          "refs/tags/upstream refs/tags/debian"
+    p = Popen(cmd, shell=True, cwd=directory, stdout=PIPE, stderr=PIPE)
+    records = []
+    for line in p.stdout:
+        date, _, name = line.strip().rpartition(' ')
+        date = date.split()
+        record = parse_tag(name, int(date[0]) if date else 0)
+        if record is not None:
+            records.append(record)
+    p.stdout.close()
+    p.stderr.read()
+    if p.wait():
+        raise CalledProcessError(p.returncode, cmd)
+    return records
+
+
+def get_tag_index(directory=None):
+    """
+    Returns the TagIndex of the repository containing directory.
+
+    :param directory: directory to query from, if None the cwd is used
+    :returns: TagIndex, which is rebuilt only if the tags have changed
+
+    :raises: subprocess.CalledProcessError if git for-each-ref fails
+    """
+    common_dir = get_common_git_dir(directory)
+    if common_dir is None:
+        return TagIndex(_scan_tags(directory))
+    signature = _refs_signature(common_dir)
+    cached = _tag_indexes.get(common_dir)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    records = _load_cache(common_dir, signature)
+    if records is None:
+        debug("Indexing the tags in " + common_dir)
+        records = _scan_tags(directory)
+        _store_cache(common_dir, signature, records)
+    index = TagIndex(records)
+    _tag_indexes[common_dir] = (signature, index)
+    return index
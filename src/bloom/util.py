@@ -39,6 +39,7 @@ from __future__ import print_function
 import sys
 import os
 
+from contextlib import contextmanager
 from subprocess import check_call, CalledProcessError, PIPE
 from subprocess import Popen
 
@@ -47,14 +48,57 @@ from . logging import error
 from . logging import debug
 from . logging import info
 
-try:
-    import rospkg.stack
-except ImportError:
-    error("rospkg was not detected, please install it.", file=sys.stderr)
-    sys.exit(1)
-
 _ansi = {}
 
+# Answers to maybe_continue prompts, see library_mode
+ASK = 'ask'
+ASSUME_YES = 'yes'
+ASSUME_NO = 'no'
+FAIL = 'fail'
+
+_library_mode = {'active': False, 'policy': ASK}
+
+
+class BloomError(Exception):
+    """
+    Raised by bailout, in place of exiting, inside of library_mode.
+
+    :ivar returncode: exit code the command line tool would have used
+    """
+
+    def __init__(self, msg, returncode=1):
+        Exception.__init__(self, msg)
+        self.returncode = returncode
+
+
+class InteractionRequired(BloomError):
+    """Raised by maybe_continue when the prompt policy is FAIL"""
+
+
+@contextmanager
+def library_mode(policy=ASSUME_YES):
+    """
+    Context manager in which bloom raises errors instead of exiting.
+
+    Inside of the context bailout raises BloomError instead of exiting, and
+    maybe_continue answers its prompts according to the policy:
+
+    - ASK prompts the user, as the command line tools do
+    - ASSUME_YES and ASSUME_NO answer every prompt yes or no respectively
+    - FAIL raises InteractionRequired
+
+    :param policy: how to answer prompts, one of ASK, ASSUME_YES, ASSUME_NO
+        or FAIL
+    """
+    if policy not in [ASK, ASSUME_YES, ASSUME_NO, FAIL]:
+        raise ValueError("Invalid prompt policy: {0}".format(policy))
+    previous = dict(_library_mode)
+    _library_mode.update(active=True, policy=policy)
+    try:
+        yield
+    finally:
+        _library_mode.update(previous)
+
 
 def add_global_arguments(parser):
     group = parser.add_argument_group('global')
@@ -67,11 +111,14 @@ def handle_global_arguments(args):
     enable_debug(args.debug)
 
 
-def check_output(cmd, cwd=None, stdin=None, stderr=None, shell=False):
+def check_output(cmd, cwd=None, stdin=None, stderr=None, shell=False,
+                 input=None, env=None):
     """Backwards compatible check_output"""
+    if input is not None:
+        stdin = PIPE
     p = Popen(cmd, cwd=cwd, stdin=stdin, stderr=stderr, shell=shell,
-              stdout=PIPE)
-    out, err = p.communicate()
+              stdout=PIPE, env=env)
+    out, err = p.communicate(input)
     if p.returncode:
         raise CalledProcessError(p.returncode, cmd)
     return out
@@ -83,6 +130,30 @@ def create_temporary_directory(prefix_dir=None):
     return mkdtemp(prefix='bloom_', dir=prefix_dir)
 
 
+def get_cache_dir(*parts):
+    """
+    Returns a directory in bloom's per user cache, creating it if needed.
+
+    The cache is in $BLOOM_CACHE_DIR if set, otherwise in bloom under
+    $XDG_CACHE_HOME or ~/.cache.
+
+    :param parts: sub directory of the cache, e.g. ``'rosdep'``
+    """
+    base = os.environ.get('BLOOM_CACHE_DIR')
+    if not base:
+        xdg = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(xdg, 'bloom')
+    path = os.path.join(base, *parts)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
 def ansi(key):
     """Returns the escape sequence for a given ansi color key"""
     global _ansi
@@ -130,8 +201,14 @@ enable_ANSI_colors()
 
 
 def maybe_continue(default='y'):
-    """Prompts the user for continuation"""
+    """Prompts the user for continuation, see library_mode for policies"""
     default = default.lower()
+    policy = _library_mode['policy']
+    if policy in [ASSUME_YES, ASSUME_NO]:
+        return policy == ASSUME_YES
+    if policy == FAIL:
+        raise InteractionRequired("A prompt to continue was reached, but "
+                                  "the prompt policy does not allow asking.")
     msg = "{0}Continue ".format(ansi('boldon'))
     if default == 'y':
         msg += "{0}[Y/n]? {1}".format(ansi('yellowf'), ansi('reset'))
@@ -157,8 +234,10 @@ def maybe_continue(default='y'):
 
 
 def bailout(reason='Exiting.'):
-    """Exits bloom for a given reason"""
+    """Exits bloom for a given reason, or raises BloomError in library_mode"""
     error(reason)
+    if _library_mode['active']:
+        raise BloomError(reason)
     sys.exit(1)
 
 
@@ -186,7 +265,9 @@ def parse_stack_xml(file_path):
     :param file_path: path to stack xml file to be converted
     :returns: dictionary representation of the stack xml file
     """
-    return rospkg.stack.parse_stack_file(file_path)
+    # Imported here, bloom.packages imports this module
+    from . packages import parse_stack_file
+    return parse_stack_file(file_path)
 
 
 def execute_command(cmd, shell=True, autofail=True, silent=True, cwd=None):
@@ -211,33 +292,39 @@ def execute_command(cmd, shell=True, autofail=True, silent=True, cwd=None):
 def assert_is_remote_git_repo(repo):
     """
     Asserts that the specified repo url points to a valid git repository.
+
+    The result is printed on one line once the check finished, so it is
+    not interleaved with the output of other threads.
     """
-    info('Verifying that {0} is a git repository...'.format(repo), end='')
+    msg = 'Verifying that {0} is a git repository...'.format(repo)
     cmd = 'git ls-remote --heads {0}'.format(repo)
     p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
     output, _ = p.communicate()
     if p.returncode != 0:
-        info(ansi('redf') + ' fail' + ansi('reset'), use_prefix=False)
+        info(msg + ansi('redf') + ' fail' + ansi('reset'))
         bailout("Repository {0} is not a valid git repository.".format(repo))
     else:
-        info(' pass', use_prefix=False)
+        info(msg + ' pass')
 
 
 def assert_is_not_gbp_repo(repo):
     """
     Asserts that the specified repo url does not point to a gbp repo.
+
+    Like :py:func:`assert_is_remote_git_repo` the result is printed on one
+    line.
     """
     assert_is_remote_git_repo(repo)
-    info('Verifying that {0} is not a gbp repository...'.format(repo), end='')
+    msg = 'Verifying that {0} is not a gbp repository...'.format(repo)
     cmd = 'git ls-remote --heads {0} upstream*'.format(repo)
     p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
     output, _ = p.communicate()
     if p.returncode == 0 and len(output) > 0:
-        info(ansi('redf') + ' fail' + ansi('reset'), use_prefix=False)
+        info(msg + ansi('redf') + ' fail' + ansi('reset'))
         bailout("Error: {0} appears to have an 'upstream' branch, " \
                 "indicating a gbp.".format(repo))
     else:
-        info(' pass', use_prefix=False)
+        info(msg + ' pass')
 
 
 def get_versions_from_upstream_tag(tag):
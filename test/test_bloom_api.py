@@ -0,0 +1,122 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+_package_xml = """\
+<package>
+  <name>foo</name>
+  <version>0.1.0</version>
+  <description>Foo</description>
+  <maintainer email="someone@example.com">Someone</maintainer>
+  <license>BSD</license>
+  <buildtool_depend>catkin</buildtool_depend>
+</package>
+"""
+
+
+def test_library_mode():
+    from bloom.util import ASSUME_NO, ASSUME_YES, FAIL
+    from bloom.util import BloomError, InteractionRequired
+    from bloom.util import bailout, library_mode, maybe_continue
+    with library_mode(ASSUME_YES):
+        assert maybe_continue() == True
+        with library_mode(ASSUME_NO):
+            assert maybe_continue() == False
+        assert maybe_continue() == True
+        try:
+            bailout("Failed")
+            assert False, "bailout did not raise"
+        except BloomError as err:
+            assert str(err) == "Failed" and err.returncode == 1, err
+    with library_mode(FAIL):
+        try:
+            maybe_continue()
+            assert False, "maybe_continue did not raise"
+        except InteractionRequired:
+            pass
+    # Outside of library mode bailout exits
+    try:
+        bailout("Failed")
+        assert False, "bailout did not exit"
+    except BloomError:
+        assert False, "bailout raised BloomError outside of library mode"
+    except SystemExit as err:
+        assert err.code == 1, err
+
+
+def test_branch_and_patch():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    with open(os.path.join(git_dir, 'package.xml'), 'w') as f:
+        f.write(_package_xml)
+    check_call('git add package.xml', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch upstream', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom import api
+    # Patching a branch without a patches branch fails
+    try:
+        api.patch('export', directory=git_dir)
+        assert False, "export without a patches branch did not fail"
+    except api.CommandFailed as err:
+        assert err.returncode == 1, err
+    result = api.branch('upstream', 'release', directory=git_dir)
+    assert result == api.BranchResult('upstream', ['release/foo']), result
+    from bloom.git import checkout
+    checkout('release/foo', directory=git_dir)
+    with open(os.path.join(git_dir, 'package.xml'), 'a') as f:
+        f.write('<!-- patched -->\n')
+    check_call('git commit -am "Patch"', shell=True, cwd=git_dir, stdout=PIPE)
+    result = api.patch('export', directory=git_dir)
+    assert result == api.PatchResult('export', 'release/foo'), result
+    check_call('git show patches/release/foo:0001-Patch.patch', shell=True,
+               cwd=git_dir, stdout=PIPE)
+    try:
+        api.patch('bogus', directory=git_dir)
+        assert False, "an invalid patch command did not fail"
+    except ValueError:
+        pass
+    rmtree(tmp_dir)
+
+
+def _multi_package_repo(tmp_dir):
+    git_dir = os.path.join(tmp_dir, 'repo')
+    for name in ['foo', 'bar']:
+        os.makedirs(os.path.join(git_dir, 'src', name))
+        with open(os.path.join(git_dir, 'src', name, 'package.xml'),
+                  'w') as f:
+            f.write(_package_xml.replace('foo', name))
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add src', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch upstream', shell=True, cwd=git_dir, stdout=PIPE)
+    return git_dir
+
+
+def test_branch_from_another_cwd():
+    tmp_dir = mkdtemp()
+    git_dir = _multi_package_repo(tmp_dir)
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        from bloom import api
+        from bloom.util import check_output
+        # A relative directory, while the cwd is not a git repository
+        result = api.branch('upstream', 'release', directory='repo')
+        assert sorted(result.branches) == ['release/bar', 'release/foo'], \
+            result
+        assert os.getcwd() == tmp_dir
+        tags = check_output('git tag', shell=True, cwd=git_dir).split()
+        assert tags == ['release/bar/0.1.0', 'release/foo/0.1.0'], tags
+        check_call('git checkout -q release/foo', shell=True, cwd=git_dir)
+        with open(os.path.join(git_dir, 'package.xml'), 'a') as f:
+            f.write('<!-- patched -->\n')
+        check_call('git commit -am "Patch"', shell=True, cwd=git_dir,
+                   stdout=PIPE)
+        result = api.patch('export', directory='repo')
+        assert result == api.PatchResult('export', 'release/foo'), result
+    finally:
+        os.chdir(cwd)
+    rmtree(tmp_dir)
@@ -0,0 +1,122 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+_package_xml = """\
+<package>
+  <name>foo</name>
+  <version>0.1.0</version>
+  <description>Foo</description>
+  <maintainer email="someone@example.com">Someone</maintainer>
+  <license>BSD</license>
+</package>
+"""
+
+
+def _release_repo(tmp_dir):
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit --allow-empty -m "Init"', shell=True, cwd=git_dir,
+               stdout=PIPE)
+    check_call('git branch bloom', shell=True, cwd=git_dir)
+    check_call('git checkout -q --orphan release/foo', shell=True,
+               cwd=git_dir)
+    with open(os.path.join(git_dir, 'package.xml'), 'w') as f:
+        f.write(_package_xml)
+    check_call('git add package.xml', shell=True, cwd=git_dir)
+    check_call('git commit -m "foo"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch debian/groovy/foo', shell=True, cwd=git_dir)
+    return git_dir
+
+
+def _generate(git_dir, args):
+    """Runs git-bloom-generate-debian in git_dir, without rosdep"""
+    from bloom import rosdep_index
+    from bloom.generators.debian import main
+    from bloom.rosdep_index import get_rosdep_index
+    signature = rosdep_index._rosdep_signature
+    rosdep_index._rosdep_signature = lambda: [1]
+    cwd = os.getcwd()
+    os.chdir(git_dir)
+    try:
+        get_rosdep_index('groovy', ['precise', 'quantal'],
+                         resolve=lambda rosdistro, os_name, codename: {},
+                         signature=[1])
+        return main(args + ['groovy', '--distros', 'precise', 'quantal',
+                            '--do-not-update-rosdep'])
+    finally:
+        os.chdir(cwd)
+        rosdep_index._rosdep_signature = signature
+
+
+def _with_cache(test):
+    def wrapper():
+        tmp_dir = mkdtemp()
+        cache_dir = os.environ.get('BLOOM_CACHE_DIR')
+        os.environ['BLOOM_CACHE_DIR'] = os.path.join(tmp_dir, 'cache')
+        try:
+            test(tmp_dir)
+        finally:
+            if cache_dir is None:
+                del os.environ['BLOOM_CACHE_DIR']
+            else:
+                os.environ['BLOOM_CACHE_DIR'] = cache_dir
+            rmtree(tmp_dir)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@_with_cache
+def test_generate_moves_branch(tmp_dir):
+    git_dir = _release_repo(tmp_dir)
+    from bloom.util import check_output
+
+    def rev_parse(reference):
+        return check_output(['git', 'rev-parse', reference + '^{commit}'],
+                            cwd=git_dir).strip()
+
+    upstream = rev_parse('debian/groovy/foo')
+    assert _generate(git_dir, ['-t', 'debian/groovy/foo']) == 0
+    # The debian branch ends at the commit of the last distro, on top of
+    # the commit of the first one
+    precise = rev_parse('debian/ros-groovy-foo_0.1.0-0_precise')
+    quantal = rev_parse('debian/ros-groovy-foo_0.1.0-0_quantal')
+    assert rev_parse('debian/groovy/foo') == quantal
+    assert rev_parse(quantal + '^') == precise
+    assert rev_parse(precise + '^') == upstream
+    # The checked out branch is updated with it
+    assert check_output('git status --porcelain', shell=True,
+                        cwd=git_dir) == ''
+    # A tag is only committed on top of
+    check_call('git tag upstream/0.1.0 ' + upstream, shell=True, cwd=git_dir)
+    assert _generate(git_dir, ['-t', 'upstream/0.1.0',
+                                '--debian-revision', '1']) == 0
+    assert rev_parse('upstream/0.1.0') == upstream
+    assert rev_parse('debian/ros-groovy-foo_0.1.0-1_precise^') == upstream
+
+
+@_with_cache
+def test_generate_unchanged(tmp_dir):
+    git_dir = _release_repo(tmp_dir)
+    from bloom.generators import debian
+    from bloom.util import check_output
+    check_call('git tag upstream/0.1.0 debian/groovy/foo', shell=True,
+               cwd=git_dir)
+    cmd = 'git rev-parse debian/ros-groovy-foo_0.1.0-0_precise^{commit} ' \
+          'debian/ros-groovy-foo_0.1.0-0_quantal^{commit}'
+    messages = []
+    info = debian.info
+    debian.info = messages.append
+    try:
+        assert _generate(git_dir, ['-t', 'upstream/0.1.0']) == 0
+        commits = check_output(cmd, shell=True, cwd=git_dir)
+        # Running it again gives the same files, with the same date
+        assert _generate(git_dir, ['-t', 'upstream/0.1.0']) == 0
+    finally:
+        debian.info = info
+    assert messages == ['Debian files changed for: precise, quantal',
+                        'Debian files changed for: none'], messages
+    # The commits of the last run are kept
+    assert check_output(cmd, shell=True, cwd=git_dir) == commits
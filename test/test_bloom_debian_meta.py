@@ -0,0 +1,84 @@
+import datetime
+import pickle
+
+_stack_data = {
+    'Name': 'foo', 'Version': '0.1.0', 'Description': 'Foo',
+    'Homepage': '', 'Catkin-ChangelogType': '',
+    'Catkin-DebRulesType': 'cmake', 'Catkin-DebRulesFile': '',
+    'DebianInc': 0, 'Package': 'ros-groovy-foo', 'ROS_DISTRO': 'groovy',
+    'INSTALL_PREFIX': '/opt/ros/groovy', 'Depends': set(['roscpp']),
+    'BuildDepends': set(['catkin', 'roscpp']), 'Maintainer': 'Someone'
+}
+
+
+class _UTC(datetime.tzinfo):
+    def utcoffset(self, dt):
+        return datetime.timedelta(0)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+
+def test_package_meta():
+    from bloom.generators.debian.meta import PackageMeta
+    meta = PackageMeta.from_dict(_stack_data)
+    assert meta['Package'] == meta.package == 'ros-groovy-foo'
+    assert meta['copyright'] is None
+    assert meta['Depends'] == frozenset(['roscpp'])
+    try:
+        meta.name = 'bar'
+        assert False, "a PackageMeta was changed"
+    except AttributeError:
+        pass
+    stamp = datetime.datetime(2013, 1, 2, 3, 4, 5, tzinfo=_UTC())
+    precise = meta.for_distro('precise', ['ros-groovy-roscpp'],
+                              ['ros-groovy-catkin'], stamp)
+    quantal = meta.for_distro('quantal', [], [], stamp)
+    # The overlays share the record, which keeps the keys of the package
+    assert precise.base is meta and quantal.base is meta
+    assert precise['Depends'] == ('ros-groovy-roscpp',)
+    assert quantal['Depends'] == () and meta['Depends'] == set(['roscpp'])
+    assert precise['Date'] == 'Wed, 02 Jan 2013 03:04:05 +0000'
+    assert 'debian/%(Package)s_%(Version)s-%(DebianInc)s_%(Distribution)s' \
+        % precise == 'debian/ros-groovy-foo_0.1.0-0_precise'
+    keys = dict(**precise)
+    assert len(keys) == len(precise) == len(meta) + 3, sorted(keys)
+    assert keys['YYYY'] == '2013' and keys['Name'] == 'foo'
+    for protocol in [0, 2]:
+        assert pickle.loads(pickle.dumps(precise, protocol)) == precise
+
+
+def test_render_skeleton():
+    import pkg_resources
+    from bloom.generators import debian
+    from bloom.generators.debian import _expand
+    from bloom.generators.debian import _render
+    from bloom.generators.debian import get_skeleton
+    from bloom.generators.debian import splice
+    from bloom.generators.debian.meta import PackageMeta
+    meta = PackageMeta.from_dict(_stack_data)
+    stamp = datetime.datetime(2013, 1, 2, 3, 4, 5, tzinfo=_UTC())
+    distros = [meta.for_distro('oneiric', [], [], stamp),
+               meta.for_distro('precise', ['ros-groovy-roscpp'],
+                               ['ros-groovy-catkin'], stamp),
+               meta.for_distro('quantal', ['a', 'b', 'c'], ['d'], stamp)]
+    names = pkg_resources.resource_listdir('bloom', 'resources/em')
+    assert 'control.em' in names, names
+    for name in names:
+        file_em = debian._get_template('resources/em/' + name)
+        skeleton = get_skeleton(file_em, meta)
+        assert skeleton is not None, name
+        for data in distros:
+            assert splice(skeleton, data) == _expand(file_em, data), name
+    # A template which uses the distro in another way is rendered in full
+    assert get_skeleton('@(Depends[0])\n', meta) is None
+    assert get_skeleton('@[if Depends]x@[end if]\n', meta) is None
+    assert get_skeleton('@{d = {1: Depends}}@(d)\n', meta) is None
+    assert get_skeleton('@@[if Depends]\n', meta) is not None
+    # Which is not known from the first distro only
+    file_em = "@[if Distribution == 'precise']X@[end if]" \
+              "@[if Depends]@(Depends[0])@[end if]\n"
+    distros = [meta.for_distro('oneiric', ['a'], [], stamp),
+               meta.for_distro('precise', [], [], stamp)]
+    assert [_render(file_em, data) for data in distros] == ['a\n', 'X\n']
+    assert debian._skeletons[(file_em, tuple(meta.items()))] is False
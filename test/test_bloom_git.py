@@ -94,3 +94,305 @@ def test_get_last_tag_by_date():
     assert get_last_tag_by_date(git_dir) == 'upstream/0.3.5'
     from shutil import rmtree
     rmtree(tmp_dir)
+
+
+def test_branch_context():
+    tmp_dir = mkdtemp()
+    from subprocess import check_call, PIPE
+    check_call('git init .', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('touch example.txt', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('git add *', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('git branch bloom', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('git branch upstream', shell=True, cwd=tmp_dir, stdout=PIPE)
+    import bloom.git
+    from bloom.git import branch_context, get_current_branch
+    checkouts = []
+    orig_execute_command = bloom.git.execute_command
+
+    def execute_command(cmd, *args, **kwargs):
+        if cmd.startswith('git checkout'):
+            checkouts.append(cmd.split()[-1])
+        return orig_execute_command(cmd, *args, **kwargs)
+
+    bloom.git.execute_command = execute_command
+    try:
+        with branch_context('bloom', tmp_dir):
+            assert get_current_branch(tmp_dir) == 'bloom'
+            # Nested contexts for the current branch are free
+            with branch_context('bloom', tmp_dir):
+                with branch_context(directory=tmp_dir):
+                    pass
+            assert checkouts == ['bloom'], checkouts
+            with branch_context('upstream', tmp_dir):
+                assert get_current_branch(tmp_dir) == 'upstream'
+            assert checkouts == ['bloom', 'upstream', 'bloom'], checkouts
+        assert checkouts == ['bloom', 'upstream', 'bloom', 'master'], \
+               checkouts
+        # Outside of any context git is asked again
+        assert get_current_branch(tmp_dir) == 'master'
+        # A subdirectory shares the stack of the work tree
+        sub_dir = os.path.join(tmp_dir, 'sub')
+        os.makedirs(sub_dir)
+        del checkouts[:]
+        with branch_context('bloom', tmp_dir):
+            with branch_context('bloom', sub_dir):
+                # HEAD moved by other git commands is seen
+                check_call('git checkout -q upstream', shell=True,
+                           cwd=sub_dir)
+                assert get_current_branch(tmp_dir) == 'upstream'
+            assert checkouts == ['bloom', 'bloom'], checkouts
+            assert get_current_branch(sub_dir) == 'bloom'
+        assert get_current_branch(tmp_dir) == 'master'
+    finally:
+        bloom.git.execute_command = orig_execute_command
+    rmtree(tmp_dir)
+
+
+def test_read_refs_directly():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import check_call, check_output, PIPE
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.git import get_branches, get_current_branch, get_root
+    assert get_current_branch(git_dir) == None
+    check_call('touch example.txt', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add *', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch bloom', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git pack-refs --all', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch release/foo', shell=True, cwd=git_dir, stdout=PIPE)
+    # Packed and loose refs are both found
+    assert get_branches(True, git_dir) == ['bloom', 'master', 'release/foo']
+    assert get_current_branch(git_dir) == 'master'
+    root = check_output('git rev-parse --show-toplevel', shell=True,
+                        cwd=git_dir).strip()
+    assert get_root(git_dir) == root, get_root(git_dir)
+    # Changes to HEAD are picked up
+    check_call('git checkout bloom', shell=True, cwd=git_dir, stdout=PIPE,
+               stderr=PIPE)
+    assert get_current_branch(git_dir) == 'bloom'
+    # Worktrees have their own HEAD, but share the refs
+    check_call('git worktree add ../wt release/foo', shell=True, cwd=git_dir,
+               stdout=PIPE, stderr=PIPE)
+    wt_dir = os.path.join(tmp_dir, 'wt')
+    assert get_current_branch(wt_dir) == 'release/foo'
+    assert get_branches(True, wt_dir) == ['bloom', 'master', 'release/foo']
+    rmtree(tmp_dir)
+
+
+def test_tag_batch():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import check_call, check_output, PIPE
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('touch example.txt', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add *', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.git import create_tag, tag_batch
+
+    def tags():
+        cmd = "git for-each-ref --format='%(refname:short) %(objecttype)' " \
+              "refs/tags"
+        return check_output(cmd, shell=True, cwd=git_dir).splitlines()
+
+    # Outside of a batch tags are written immediately
+    create_tag('upstream/0.1.0', directory=git_dir)
+    assert tags() == ['upstream/0.1.0 commit'], tags()
+    # Inside of a batch they are written at the end
+    with tag_batch(git_dir):
+        create_tag('debian/foo_0.1.0-0_lucid', message='Debian release 0.1.0',
+                   directory=git_dir)
+        create_tag('release/foo/0.1.0', directory=git_dir)
+        assert len(tags()) == 1, tags()
+    assert tags() == ['debian/foo_0.1.0-0_lucid tag',
+                      'release/foo/0.1.0 commit',
+                      'upstream/0.1.0 commit'], tags()
+    out = check_output('git cat-file -p debian/foo_0.1.0-0_lucid',
+                       shell=True, cwd=git_dir)
+    assert out.endswith('\n\nDebian release 0.1.0\n'), out
+    # An aborted batch writes no tags at all
+    try:
+        with tag_batch(git_dir):
+            create_tag('debian/foo_0.1.0-0_oneiric', message='Debian',
+                       directory=git_dir)
+            raise RuntimeError('aborted')
+    except RuntimeError:
+        pass
+    assert len(tags()) == 3, tags()
+    rmtree(tmp_dir)
+
+
+def test_commit_files():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import PIPE, check_call
+    from bloom.util import check_output
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    with open(os.path.join(git_dir, 'package.xml'), 'w') as f:
+        f.write('<package/>\n')
+    check_call('git add package.xml', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch debian/foo', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.git import commit_files
+    from bloom.git import get_current_branch
+    from bloom.git import sync_checkout
+    files = {'debian/rules': ('100755', '#!/usr/bin/make -f\n'),
+             'debian/source/format': ('100644', '3.0 (quilt)\n')}
+    # A branch which is not checked out is committed to directly
+    commit = commit_files(files, 'Debian', 'refs/heads/debian/foo', git_dir)
+    assert get_current_branch(git_dir) == 'master'
+    assert not os.path.exists(os.path.join(git_dir, 'debian'))
+    out = check_output('git ls-tree -r debian/foo', shell=True, cwd=git_dir)
+    modes = sorted((l.split()[0], l.split()[-1]) for l in out.splitlines())
+    assert modes == [('100644', 'debian/source/format'),
+                     ('100644', 'package.xml'),
+                     ('100755', 'debian/rules')], modes
+    out = check_output('git rev-parse debian/foo debian/foo^', shell=True,
+                       cwd=git_dir).split()
+    master = check_output('git rev-parse master', shell=True, cwd=git_dir)
+    assert out == [commit, master.strip()], out
+    # Committing to the checked out branch leaves the checkout until synced
+    commit_files({'README': ('100644', 'Foo\n')}, 'Readme', directory=git_dir)
+    assert not os.path.exists(os.path.join(git_dir, 'README'))
+    sync_checkout(master.strip(), git_dir)
+    assert open(os.path.join(git_dir, 'README')).read() == 'Foo\n'
+    status = check_output('git status --porcelain', shell=True, cwd=git_dir)
+    assert status == '', status
+    # Without a ref only the commit is written, on top of the given parent
+    from bloom.git import list_tree
+    head = check_output('git rev-parse HEAD', shell=True, cwd=git_dir)
+    other = commit_files({'debian/compat': ('100644', '7\n')}, 'Compat',
+                         None, git_dir, parent=commit)
+    assert check_output('git rev-parse HEAD debian/foo', shell=True,
+                        cwd=git_dir).split() == [head.strip(), commit]
+    assert list(list_tree(other, directory=git_dir)) == \
+        ['debian', 'package.xml']
+    entries = list_tree(other, ['debian/compat', 'missing'], git_dir)
+    assert list(entries) == ['debian/compat'], entries
+    assert entries['debian/compat'][:2] == ('100644', 'blob')
+    # Files which did not change are not committed again
+    from bloom.git import get_blob_hash
+    assert get_blob_hash('7\n') == entries['debian/compat'][2]
+    assert commit_files({'debian/compat': ('100644', '7\n')}, 'Compat',
+                        None, git_dir, parent=other) == other
+    assert commit_files(files, 'Again', 'refs/heads/debian/foo',
+                        git_dir) == commit
+    files['debian/rules'] = ('100644', files['debian/rules'][1])
+    assert commit_files(files, 'Mode', 'refs/heads/debian/foo',
+                        git_dir) != commit
+    rmtree(tmp_dir)
+
+
+def test_push_ref_changes():
+    tmp_dir = mkdtemp()
+    orig_dir = os.path.join(tmp_dir, 'orig')
+    clone_dir = os.path.join(tmp_dir, 'clone')
+    os.makedirs(orig_dir)
+    from subprocess import PIPE, check_call
+    from bloom.util import check_output
+
+    def git(cmd, cwd=clone_dir):
+        check_call('git ' + cmd, shell=True, cwd=cwd, stdout=PIPE,
+                   stderr=PIPE)
+
+    git('init --bare .', orig_dir)
+    git('clone -q ' + orig_dir + ' ' + clone_dir, tmp_dir)
+    git('commit --allow-empty -m "Init"')
+    git('branch upstream')
+    git('branch bloom')
+    git('tag upstream/0.1.0')
+    git('tag old')
+    git('push -q origin master upstream bloom --tags')
+    from bloom.git import get_ref_changes
+    from bloom.git import push_ref_changes
+    from bloom.git import record_refs
+    recorded = record_refs(directory=clone_dir)
+    assert sorted(recorded) == ['refs/heads/bloom', 'refs/heads/master',
+                                'refs/heads/upstream', 'refs/tags/old',
+                                'refs/tags/upstream/0.1.0'], recorded
+    # Move a branch, add and delete a tag, and leave the rest alone
+    git('checkout -q upstream')
+    git('commit --allow-empty -m "Import"')
+    git('tag upstream/0.2.0')
+    git('tag -d old')
+    changes = get_ref_changes(recorded, clone_dir)
+    assert [(ref, old is None, new is None) for ref, old, new in changes] == \
+        [('refs/heads/upstream', False, False), ('refs/tags/old', False, True),
+         ('refs/tags/upstream/0.2.0', True, False)], changes
+    assert push_ref_changes(changes, directory=clone_dir) == 0
+    refs = check_output('git for-each-ref --format="%(refname)"', shell=True,
+                        cwd=orig_dir).split()
+    assert refs == ['refs/heads/bloom', 'refs/heads/master',
+                    'refs/heads/upstream', 'refs/tags/upstream/0.1.0',
+                    'refs/tags/upstream/0.2.0'], refs
+    head = check_output('git rev-parse upstream', shell=True, cwd=clone_dir)
+    assert check_output('git rev-parse upstream', shell=True,
+                        cwd=orig_dir) == head
+    assert get_ref_changes(record_refs(directory=clone_dir), clone_dir) == []
+    # If the remote moved since it was recorded nothing is pushed
+    recorded = record_refs(directory=clone_dir)
+    git('tag upstream/0.3.0')
+    git('commit --allow-empty -m "Other"')
+    git('push -q -f origin HEAD:refs/heads/bloom')
+    git('reset -q --hard HEAD^')
+    git('checkout -q bloom')
+    git('commit --allow-empty -m "Mine"')
+    changes = get_ref_changes(recorded, clone_dir)
+    assert [ref for ref, old, new in changes] == ['refs/heads/bloom',
+                                                  'refs/tags/upstream/0.3.0']
+    assert push_ref_changes(changes, directory=clone_dir) != 0
+    refs = check_output('git for-each-ref --format="%(refname)"', shell=True,
+                        cwd=orig_dir).split()
+    assert 'refs/tags/upstream/0.3.0' not in refs, refs
+    rmtree(tmp_dir)
+
+
+def test_maintain_repository():
+    tmp_dir = mkdtemp()
+    from subprocess import PIPE, check_call
+    check_call('git init .', shell=True, cwd=tmp_dir, stdout=PIPE)
+    check_call('git commit --allow-empty -m "Init"', shell=True, cwd=tmp_dir,
+               stdout=PIPE)
+    from bloom import git
+    from bloom.git import commit_files
+    from bloom.git import create_tag
+    from bloom.git import format_maintenance_report
+    from bloom.git import get_ref_stats
+    from bloom.git import get_written
+    from bloom.git import maintain_repository
+    limits = dict(git._maintenance_limits)
+    git._maintenance_limits.update(refs=5, objects=10)
+    try:
+        commit_files({'a': ('100644', 'a\n'), 'b': ('100644', 'b\n')}, 'Two',
+                     directory=tmp_dir)
+        for index in range(3):
+            create_tag('debian/0.1.' + str(index), directory=tmp_dir)
+        assert get_written(tmp_dir) == {'refs': 4, 'objects': 4}, \
+            get_written(tmp_dir)
+        # Below the limits nothing is done
+        assert maintain_repository(tmp_dir) == []
+        assert get_written(tmp_dir) == {'refs': 0, 'objects': 0}
+        for index in range(5):
+            create_tag('debian/0.2.' + str(index), 'HEAD', 'Tag',
+                       directory=tmp_dir)
+        before = get_ref_stats(tmp_dir)
+        assert before['loose_refs'] == 9 and before['packed_refs'] == 0, \
+            before
+        assert before['loose_objects'] > 0 and before['packs'] == 0, before
+        assert maintain_repository(tmp_dir) == ['git pack-refs --all']
+        after = get_ref_stats(tmp_dir)
+        assert after['loose_refs'] == 0 and after['packed_refs'] == 9, after
+        assert maintain_repository(tmp_dir, force=True) == \
+            ['git pack-refs --all', 'git repack -d -l -q']
+        after = get_ref_stats(tmp_dir)
+        assert after['loose_objects'] == 0 and after['packs'] == 1, after
+        report = format_maintenance_report(before, after, [])
+        assert report[0] == 'Refs: 9 loose, 0 packed -> 0 loose, 9 packed', \
+            report
+    finally:
+        git._maintenance_limits.update(limits)
+    rmtree(tmp_dir)
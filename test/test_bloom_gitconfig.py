@@ -0,0 +1,67 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+
+def test_parse_config():
+    from bloom.gitconfig import parse_config
+    config = parse_config('# comment\n[Bloom]\n\tupstream = git://x.git\n'
+                          '\tUpstreamType=git ; comment\n'
+                          '\tupstreambranch = \n'
+                          '\tquoted = " a;b " \n'
+                          '\tescaped = a\\tb\\\\c\\"d\n'
+                          '\tcontinued = a\\\n  b\n'
+                          '[patches "sub"]\n\tflag\n')
+    assert config['bloom.upstream'] == 'git://x.git', config
+    assert config['bloom.upstreamtype'] == 'git', config
+    assert config['bloom.upstreambranch'] == '', config
+    assert config['bloom.quoted'] == ' a;b ', config
+    assert config['bloom.escaped'] == 'a\tb\\c"d', config
+    assert config['bloom.continued'] == 'a  b', config
+    assert config['patches.sub.flag'] == 'true', config
+
+
+def test_write_config():
+    tmp_dir = mkdtemp()
+    from subprocess import check_call, check_output
+    from bloom.gitconfig import read_config, write_config
+    values = [('bloom.upstream', 'https://github.com/ros/example.git'),
+              ('bloom.upstreamtype', 'git'),
+              ('bloom.upstreambranch', '')]
+    updates = [('bloom.upstreambranch', 'groovy-devel'),
+               ('patches.trim', ' a;b '),
+               ('bloom.upstreamtype', 'svn'),
+               ('patches.base', 'a\\b"c')]
+    git_conf = os.path.join(tmp_dir, 'git.conf')
+    bloom_conf = os.path.join(tmp_dir, 'bloom.conf')
+    for key, value in values:
+        check_call(['git', 'config', '-f', git_conf, key, value])
+    write_config(bloom_conf, values)
+    assert open(bloom_conf).read() == \
+        '[bloom]\n\tupstream = https://github.com/ros/example.git\n' \
+        '\tupstreamtype = git\n\tupstreambranch = \n'
+    assert open(bloom_conf).read() == open(git_conf).read()
+    for key, value in updates:
+        check_call(['git', 'config', '-f', git_conf, key, value])
+    write_config(bloom_conf, updates)
+    assert open(bloom_conf).read() == open(git_conf).read()
+    # git reads back what was written
+    config = read_config(bloom_conf)
+    for key, value in values[:1] + updates:
+        output = check_output(['git', 'config', '-f', bloom_conf, key])
+        assert output[:-1] == value, (key, output)
+        assert config[key] == value, (key, config)
+    assert read_config(os.path.join(tmp_dir, 'missing.conf')) == None
+    # A value continued over several lines is replaced as a whole
+    with open(bloom_conf, 'w') as f:
+        f.write('[bloom]\n\tupstream = a\\\n  b\\\n  c\n'
+                '\tupstreamtype = git\n')
+    write_config(bloom_conf, [('bloom.upstream', 'x'),
+                              ('bloom.upstreambranch', 'y')])
+    assert open(bloom_conf).read() == \
+        '[bloom]\n\tupstream = x\n\tupstreamtype = git\n' \
+        '\tupstreambranch = y\n'
+    assert read_config(bloom_conf) == {'bloom.upstream': 'x',
+                                       'bloom.upstreamtype': 'git',
+                                       'bloom.upstreambranch': 'y'}
+    rmtree(tmp_dir)
@@ -0,0 +1,197 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, check_output, PIPE
+from tempfile import mkdtemp
+
+
+def _commit(git_dir, message):
+    check_call(['git', 'commit', '--allow-empty', '-m', message],
+               cwd=git_dir, stdout=PIPE)
+
+
+def test_journal_resume():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    _commit(git_dir, 'Init')
+    check_call('git checkout -b debian/groovy/foo', shell=True, cwd=git_dir,
+               stdout=PIPE, stderr=PIPE)
+    from bloom.journal import get_journal
+    from bloom.journal import open_journal
+    branch = 'debian/groovy/foo'
+    run = {'rosdistro': 'groovy'}
+    path = os.path.join(git_dir, '.git', 'bloom', 'journal', 'test.jsonl')
+    # An interrupted run leaves its journal behind
+    try:
+        with open_journal('test', run, directory=git_dir) as journal:
+            assert get_journal(git_dir) is journal
+            journal.record(branch, None, 'branch')
+            _commit(git_dir, 'precise')
+            journal.record(branch, 'precise', 'generate',
+                           tags=[('debian/foo_0.1.0-0_precise', 'HEAD', 'm')])
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    assert get_journal(git_dir) is None
+    assert os.path.exists(path)
+    # A run with different arguments does not resume it
+    with open_journal('test', {'rosdistro': 'hydro'}, True,
+                      git_dir) as journal:
+        assert not journal.resumed
+        assert journal.get(branch, None, 'branch') is None
+    # The finished run removed the journal, so interrupt one again
+    try:
+        with open_journal('test', run, directory=git_dir) as journal:
+            journal.record(branch, None, 'branch')
+            _commit(git_dir, 'precise')
+            journal.record(branch, 'precise', 'generate',
+                           tags=[('debian/foo_0.1.0-0_precise', 'HEAD', 'm')])
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    with open_journal('test', run, True, git_dir) as journal:
+        assert journal.resumed
+        record = journal.get(branch, 'precise', 'generate')
+        assert record is not None and journal.contains(record)
+        assert journal.get(branch, 'quantal', 'generate') is None
+        assert journal.is_current(branch)
+        assert journal.tags(branch) == [
+            ('debian/foo_0.1.0-0_precise', record['sha'], 'm')]
+        # Once the branch moves the units are no longer current
+        _commit(git_dir, 'moved')
+        assert not journal.is_current(branch)
+        journal.forget(branch)
+        assert journal.get(branch, None, 'branch') is None
+    assert not os.path.exists(path)
+    rmtree(tmp_dir)
+
+
+_package_xml = """\
+<package>
+  <name>{0}</name>
+  <version>0.1.0</version>
+  <description>{0}</description>
+  <maintainer email="someone@example.com">Someone</maintainer>
+  <license>BSD</license>
+  <buildtool_depend>catkin</buildtool_depend>
+</package>
+"""
+
+
+def test_generate_all_failure():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    _commit(git_dir, 'Init')
+    for name in ['bar', 'foo']:
+        check_call('git checkout -q --orphan release/' + name, shell=True,
+                   cwd=git_dir)
+        with open(os.path.join(git_dir, 'package.xml'), 'w') as f:
+            f.write(_package_xml.format(name))
+        check_call('git add package.xml', shell=True, cwd=git_dir)
+        _commit(git_dir, name)
+    check_call('git checkout -q master', shell=True, cwd=git_dir)
+    from bloom.generators.debian import main_all
+    from bloom.git import create_tag
+    from bloom.util import ASSUME_YES
+    from bloom.util import BloomError
+    from bloom.util import library_mode
+    generated = []
+
+    def generate(args):
+        generated.append(args[1])
+        if args[1] == 'debian/groovy/bar' and len(generated) == 1:
+            return 3
+        create_tag(args[1].replace('/', '_') + '_tag')
+        return 0
+
+    gendeb_main = main_all.gendeb_main
+    main_all.gendeb_main = generate
+    cwd = os.getcwd()
+    os.chdir(git_dir)
+    try:
+        with library_mode(ASSUME_YES):
+            try:
+                main_all.generate_all('groovy', 'release')
+                assert False, "a failed package did not raise"
+            except BloomError as err:
+                assert err.returncode == 3, err
+            # The other package is tagged and the journal is kept
+            tags = check_output('git tag', shell=True).split()
+            assert tags == ['debian_groovy_foo_tag'], tags
+            path = os.path.join(git_dir, '.git', 'bloom', 'journal',
+                                'generate-debian-all.jsonl')
+            assert os.path.exists(path)
+            # A resumed run only generates the failed package
+            assert main_all.generate_all('groovy', 'release',
+                                         resume=True) == 0
+            assert generated == ['debian/groovy/bar', 'debian/groovy/foo',
+                                 'debian/groovy/bar'], generated
+            assert not os.path.exists(path)
+    finally:
+        os.chdir(cwd)
+        main_all.gendeb_main = gendeb_main
+    rmtree(tmp_dir)
+
+
+def test_generate_all_maintenance_failure():
+    from subprocess import CalledProcessError
+    from bloom.generators.debian import main_all
+
+    calls = []
+
+    def maintain_repository():
+        calls.append('maintain')
+        raise CalledProcessError(128, 'git pack-refs --all')
+
+    generate_all = main_all.generate_all
+    maintain = main_all.maintain_repository
+    main_all.generate_all = lambda *args, **kwargs: 3
+    main_all.maintain_repository = maintain_repository
+    try:
+        # A failed maintenance only warns, the result of the run is kept
+        assert main_all.main(['groovy', 'release']) == 3
+        assert calls == ['maintain'], calls
+        # Left to git-bloom-release, which runs it once its tags are written
+        assert main_all.main(['groovy', 'release'], maintain=False) == 3
+        assert calls == ['maintain'], calls
+    finally:
+        main_all.generate_all = generate_all
+        main_all.maintain_repository = maintain
+
+
+def test_generate_all_branch_failure():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    _commit(git_dir, 'Init')
+    check_call('git branch release/foo', shell=True, cwd=git_dir)
+    from bloom.branch import branch
+    from bloom.generators.debian import main_all
+    from bloom.journal import open_journal
+    from bloom.util import ASSUME_YES
+    from bloom.util import BloomError
+    from bloom.util import library_mode
+    branch_packages = branch._branch_packages
+    branch._branch_packages = lambda *args: 2
+    cwd = os.getcwd()
+    os.chdir(git_dir)
+    try:
+        with library_mode(ASSUME_YES):
+            try:
+                main_all.generate_all('groovy', 'release')
+                assert False, "a failed git-bloom-branch did not raise"
+            except BloomError as err:
+                assert err.returncode == 2, err
+        # The package is branched again by a resumed run
+        run = {'rosdistro': 'groovy', 'prefix': 'release',
+               'debian_revision': '0'}
+        with open_journal('generate-debian-all', run, True) as journal:
+            assert journal.get('debian/groovy/foo', None, 'branch') is None
+    finally:
+        os.chdir(cwd)
+        branch._branch_packages = branch_packages
+    rmtree(tmp_dir)
@@ -0,0 +1,62 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+
+def _repo(path, name):
+    os.makedirs(path)
+    check_call('git init .', shell=True, cwd=path, stdout=PIPE)
+    with open(os.path.join(path, 'README'), 'w') as f:
+        f.write(name + '\n')
+    check_call('git add README', shell=True, cwd=path, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=path, stdout=PIPE)
+    check_call('git tag upstream/0.1.0', shell=True, cwd=path, stdout=PIPE)
+
+
+def _local_objects(path):
+    from bloom.object_store import count_objects
+    counts = count_objects(os.path.join(path, '.git'))
+    return counts['count'] + counts['in-pack']
+
+
+def test_object_store():
+    tmp_dir = mkdtemp()
+    store = os.path.join(tmp_dir, 'store.git')
+    foo = os.path.join(tmp_dir, 'foo')
+    bar = os.path.join(tmp_dir, 'bar')
+    _repo(foo, 'foo')
+    _repo(bar, 'bar')
+    from bloom.object_store import attach
+    from bloom.object_store import detach
+    from bloom.object_store import get_attached
+    from bloom.object_store import maintain
+    for path in [foo, bar]:
+        git_dir = attach(path, store)
+        assert git_dir == os.path.join(path, '.git'), git_dir
+        with open(os.path.join(git_dir, 'objects', 'info', 'alternates')) as f:
+            assert f.read() == os.path.join(store, 'objects') + '\n'
+        # The objects are only in the store
+        assert _local_objects(path) == 0
+        check_call('git fsck', shell=True, cwd=path, stdout=PIPE, stderr=PIPE)
+    attach(foo, store)
+    assert get_attached(store) == [os.path.join(foo, '.git'),
+                                   os.path.join(bar, '.git')]
+    # New objects are consolidated into the store
+    check_call('git commit --allow-empty -m "More"', shell=True, cwd=foo,
+               stdout=PIPE)
+    assert _local_objects(foo) > 0
+    rmtree(bar)
+    assert maintain(store) == [(os.path.join(foo, '.git'), 'ok'),
+                               (os.path.join(bar, '.git'), 'missing')]
+    assert _local_objects(foo) == 0
+    assert get_attached(store) == [os.path.join(foo, '.git')]
+    # Detaching copies the objects back
+    detach(foo, store)
+    assert not os.path.exists(
+        os.path.join(foo, '.git', 'objects', 'info', 'alternates'))
+    assert _local_objects(foo) > 0
+    assert get_attached(store) == []
+    rmtree(store)
+    check_call('git fsck', shell=True, cwd=foo, stdout=PIPE, stderr=PIPE)
+    rmtree(tmp_dir)
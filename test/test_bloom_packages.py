@@ -0,0 +1,151 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+_package_xml = """\
+<package>
+  <name>{0}</name>
+  <version>0.1.0</version>
+  <description>{0}</description>
+  <maintainer email="someone@example.com">Someone</maintainer>
+  <license>BSD</license>
+  <buildtool_depend>catkin</buildtool_depend>
+{1}</package>
+"""
+
+
+def _package(name, build_depends=(), run_depends=()):
+    from catkin_pkg.package import parse_package_string
+    depends = ''.join('  <build_depend>{0}</build_depend>\n'.format(d)
+                      for d in build_depends)
+    depends += ''.join('  <run_depend>{0}</run_depend>\n'.format(d)
+                       for d in run_depends)
+    return parse_package_string(_package_xml.format(name, depends))
+
+
+def test_topological_waves():
+    from bloom.packages import DependencyCycle
+    from bloom.packages import build_dependency_graph
+    from bloom.packages import order_packages
+    from bloom.packages import topological_waves
+    packages = [_package('foo_msgs'),
+                _package('foo', ['foo_msgs', 'roscpp']),
+                _package('foo_tools', run_depends=['foo']),
+                _package('bar', ['catkin'])]
+    graph = build_dependency_graph(packages)
+    assert graph == {'bar': [], 'foo': ['foo_msgs'], 'foo_msgs': [],
+                     'foo_tools': ['foo']}, graph
+    waves = topological_waves(graph)
+    assert waves == [['bar', 'foo_msgs'], ['foo'], ['foo_tools']], waves
+    assert [p.name for p in order_packages(packages)] == \
+        ['bar', 'foo_msgs', 'foo', 'foo_tools']
+    try:
+        topological_waves({'a': ['b'], 'b': ['a'], 'c': []})
+        assert False, "a cycle did not raise"
+    except DependencyCycle as err:
+        assert err.packages == ['a', 'b'], err.packages
+
+
+def test_get_release_waves():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit --allow-empty -m "Init"', shell=True, cwd=git_dir,
+               stdout=PIPE)
+    for name, depends in [('foo', ['foo_msgs']), ('foo_msgs', [])]:
+        check_call('git checkout --orphan release/' + name, shell=True,
+                   cwd=git_dir, stdout=PIPE, stderr=PIPE)
+        depends = ''.join('  <build_depend>{0}</build_depend>\n'.format(d)
+                          for d in depends)
+        with open(os.path.join(git_dir, 'package.xml'), 'w') as f:
+            f.write(_package_xml.format(name, depends))
+        check_call('git add package.xml', shell=True, cwd=git_dir,
+                   stdout=PIPE)
+        check_call('git commit -m "' + name + '"', shell=True, cwd=git_dir,
+                   stdout=PIPE)
+    from bloom.packages import get_release_waves
+    waves = get_release_waves('release', git_dir)
+    assert waves == [['release/foo_msgs'], ['release/foo']], waves
+    rmtree(tmp_dir)
+
+
+def test_parse_cache():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    for name in ['foo', 'foo_msgs']:
+        os.makedirs(os.path.join(git_dir, 'src', name))
+        with open(os.path.join(git_dir, 'src', name, 'package.xml'), 'w') as f:
+            f.write(_package_xml.format(name, ''))
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add src', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.packages import find_packages
+    from bloom.packages import parse_package_file
+    from bloom.packages import read_branch_package
+    packages = find_packages(git_dir)
+    assert sorted(packages) == ['src/foo', 'src/foo_msgs'], packages
+    # The files are parsed once, until they change
+    path = os.path.join(git_dir, 'src', 'foo', 'package.xml')
+    assert parse_package_file(path) is packages['src/foo']
+    assert find_packages(git_dir)['src/foo'] is packages['src/foo']
+    with open(path, 'w') as f:
+        f.write(_package_xml.format('foo', '').replace('0.1.0', '0.2.0'))
+    assert parse_package_file(path).version == '0.2.0'
+    # The cache is cleared once it is full
+    from bloom import packages as packages_module
+    max_parsed = packages_module._max_parsed
+    packages_module._max_parsed = len(packages_module._parsed)
+    try:
+        with open(path, 'w') as f:
+            f.write(_package_xml.format('foo', '').replace('0.1.0', '0.3.0'))
+        assert parse_package_file(path).version == '0.3.0'
+        assert len(packages_module._parsed) == 1
+    finally:
+        packages_module._max_parsed = max_parsed
+    # Blobs are parsed once by SHA-1
+    check_call('git checkout -b release/foo_msgs', shell=True, cwd=git_dir,
+               stdout=PIPE, stderr=PIPE)
+    check_call('git mv src/foo_msgs/package.xml package.xml', shell=True,
+               cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "foo_msgs"', shell=True, cwd=git_dir,
+               stdout=PIPE)
+    package = read_branch_package('release/foo_msgs', git_dir)
+    assert package.name == 'foo_msgs'
+    assert read_branch_package('release/foo_msgs', git_dir) is package
+    assert read_branch_package('master', git_dir) is None
+    rmtree(tmp_dir)
+
+
+def test_find_packages():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    layout = ['foo', 'foo/nested', 'ignored/bar', 'build/baz', 'install',
+              '.hidden/qux', 'vendor/deep/foo_msgs']
+    for path in layout:
+        os.makedirs(os.path.join(git_dir, path))
+        with open(os.path.join(git_dir, path, 'package.xml'), 'w') as f:
+            f.write(_package_xml.format(os.path.basename(path), ''))
+    open(os.path.join(git_dir, 'ignored', 'CATKIN_IGNORE'), 'w').close()
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add -A', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.packages import find_package_blobs
+    from bloom.packages import find_package_paths
+    from bloom.packages import find_packages
+    from bloom.packages import find_packages_in_tree
+    expected = ['foo', 'install', 'vendor/deep/foo_msgs']
+    assert find_package_paths(git_dir) == expected, \
+        find_package_paths(git_dir)
+    assert sorted(find_package_blobs('HEAD', git_dir)) == expected
+    for packages in [find_packages(git_dir, jobs=4),
+                     find_packages(git_dir, jobs=1),
+                     find_packages_in_tree('HEAD', git_dir)]:
+        assert dict((k, p.name) for k, p in packages.items()) == \
+            {'foo': 'foo', 'install': 'install',
+             'vendor/deep/foo_msgs': 'foo_msgs'}, packages
+    # The tree is searched without the working tree
+    rmtree(os.path.join(git_dir, 'foo'))
+    assert 'foo' in find_packages_in_tree('HEAD', git_dir)
+    rmtree(tmp_dir)
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import traceback
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+
+def test_run_phases():
+    from bloom.phases import run_phases
+    started = {}
+
+    def phase(name, value, delay=0.2):
+        def run(*args):
+            started[name] = time.time()
+            time.sleep(delay)
+            return (value,) + args
+        return run
+
+    results, seconds = run_phases([
+        ('rosdep', phase('rosdep', 1), []),
+        ('fetch', phase('fetch', 2), []),
+        ('index', phase('index', 3, 0), ['rosdep']),
+        ('push', phase('push', 4, 0), ['fetch', 'index']),
+    ])
+    # The independent phases overlap
+    assert started['fetch'] < started['rosdep'] + 0.2
+    assert started['rosdep'] < started['fetch'] + 0.2
+    assert started['push'] >= started['fetch'] + 0.2
+    assert results['index'] == (3, (1,)), results
+    assert results['push'] == (4, (2,), (3, (1,))), results
+    assert list(results)[-1] == 'push' and sorted(seconds) == sorted(results)
+    assert seconds['rosdep'] >= 0.2
+
+
+def test_run_phases_failure():
+    from bloom.phases import run_phases
+    from bloom.packages import DependencyCycle
+    ran = []
+
+    def fail():
+        raise RuntimeError('no network')
+
+    try:
+        run_phases([('fetch', fail, []),
+                    ('push', lambda r: ran.append('push'), ['fetch'])])
+        assert False, "a failed phase did not raise"
+    except RuntimeError as err:
+        assert str(err) == 'no network'
+        # The traceback is the one of the phase
+        frames = traceback.extract_tb(sys.exc_info()[2])
+        assert frames[-1][2] == 'fail', frames
+    assert ran == []
+    try:
+        run_phases([('a', lambda b: b, ['b']), ('b', lambda a: a, ['a'])])
+        assert False, "a cycle did not raise"
+    except DependencyCycle:
+        pass
+
+
+def test_run_phases_remote():
+    tmp_dir = mkdtemp()
+    remote = os.path.join(tmp_dir, 'remote')
+    os.makedirs(remote)
+    check_call('git init .', shell=True, cwd=remote, stdout=PIPE)
+    check_call('git commit --allow-empty -m "Init"', shell=True, cwd=remote,
+               stdout=PIPE)
+    check_call('git tag 0.1.0', shell=True, cwd=remote, stdout=PIPE)
+    from bloom.phases import run_phases
+    from bloom.util import check_output
+    clone = os.path.join(tmp_dir, 'clone')
+    url = 'file://' + remote
+    results, seconds = run_phases([
+        ('ls-remote', lambda: check_output(['git', 'ls-remote', '--tags',
+                                            url]), []),
+        ('checkout', lambda: check_call(['git', 'clone', '-q', url, clone]),
+         []),
+        ('version', lambda checkout: check_output(
+            ['git', 'describe', '--tags'], cwd=clone).strip(), ['checkout']),
+    ])
+    assert 'refs/tags/0.1.0' in results['ls-remote']
+    assert results['version'] == '0.1.0', results
+    rmtree(tmp_dir)
@@ -0,0 +1,85 @@
+import os
+from shutil import rmtree
+from subprocess import check_call, PIPE
+from tempfile import mkdtemp
+
+_package_xml = """\
+<package>
+  <name>{0}</name>
+  <version>0.1.0</version>
+  <description>{0}</description>
+  <maintainer email="someone@example.com">Someone</maintainer>
+  <license>BSD</license>
+  <buildtool_depend>catkin</buildtool_depend>
+</package>
+"""
+
+
+def test_parse_manifest():
+    tmp_dir = mkdtemp()
+    manifest = os.path.join(tmp_dir, 'manifest')
+    with open(manifest, 'w') as f:
+        f.write("# Release repositories\n"
+                "ros-foo-release\n"
+                "\n"
+                "/tmp/ros-bar-release  # absolute\n"
+                "ros-foo-release\n")
+    from bloom.release_many import parse_manifest
+    assert parse_manifest(manifest) == [
+        os.path.join(tmp_dir, 'ros-foo-release'), '/tmp/ros-bar-release']
+    rmtree(tmp_dir)
+
+
+def test_release_many_failures():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'ros-foo-release')
+    os.makedirs(git_dir)
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    missing = os.path.join(tmp_dir, 'ros-bar-release')
+    log_dir = os.path.join(tmp_dir, 'logs')
+    os.makedirs(log_dir)
+    from bloom.release_many import format_results
+    from bloom.release_many import release_many
+    from bloom.release_many import write_results
+    results = release_many([git_dir, missing], 'groovy', jobs=2,
+                           log_dir=log_dir)
+    assert [r['repository'] for r in results] == [git_dir, missing], results
+    for result in results:
+        assert result['status'] == 'failed', result
+        assert result['step'] == 'import', result
+        assert os.path.exists(result['log']), result
+    assert 'No such release repository' in results[1]['message'], results
+    table = format_results(results)
+    assert table.splitlines()[0].startswith('REPOSITORY'), table
+    results_file = os.path.join(tmp_dir, 'results.tsv')
+    write_results(results, results_file)
+    with open(results_file) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 3 and lines[0].startswith('repository\t'), lines
+    rmtree(tmp_dir)
+
+
+def test_release_repository_tags():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'ros-foo-release')
+    for name in ['foo', 'bar']:
+        os.makedirs(os.path.join(git_dir, 'src', name))
+        with open(os.path.join(git_dir, 'src', name, 'package.xml'),
+                  'w') as f:
+            f.write(_package_xml.format(name))
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add src', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git branch upstream', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.release_many import release_repository
+    from bloom.util import check_output
+    # Released from another directory, generating the debians fails
+    result = release_repository(git_dir, 'bogus', skip_import=True)
+    assert result['status'] == 'failed', result
+    assert result['step'] == 'generate', result
+    assert result['branches'] == 2, result
+    branches = check_output('git branch', shell=True, cwd=git_dir)
+    assert 'release/foo' in branches and 'release/bar' in branches, branches
+    # The tags of the branches are only written if all of the steps succeed
+    assert check_output('git tag', shell=True, cwd=git_dir) == ''
+    rmtree(tmp_dir)
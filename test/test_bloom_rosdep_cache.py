@@ -0,0 +1,98 @@
+import os
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+
+
+def test_parse_age():
+    from bloom.rosdep_cache import parse_age
+    assert parse_age('90') == 90
+    assert parse_age('30m') == 1800
+    assert parse_age('1h') == 3600
+    assert parse_age('1.5d') == 129600
+    try:
+        parse_age('an hour')
+        assert False, "an invalid age did not raise"
+    except ValueError:
+        pass
+
+
+def test_update_rosdep():
+    tmp_dir = mkdtemp()
+    cache_dir = os.environ.get('BLOOM_CACHE_DIR')
+    os.environ['BLOOM_CACHE_DIR'] = tmp_dir
+    updates = []
+
+    def update():
+        updates.append(time.time())
+
+    try:
+        from bloom.rosdep_cache import read_stamp
+        from bloom.rosdep_cache import update_rosdep
+        from bloom.rosdep_cache import write_stamp
+        # Without a stamp rosdep is always updated
+        assert update_rosdep(3600, update) is True
+        assert len(updates) == 1 and read_stamp() is not None
+        # Then it is fresh for an hour
+        assert update_rosdep(3600, update) is False
+        assert len(updates) == 1
+        # But not for a shorter maximum age
+        time.sleep(0.01)
+        assert update_rosdep(0.001, update) is True
+        assert len(updates) == 2
+        # Without a maximum age rosdep is always updated
+        assert update_rosdep(None, update) is True
+        assert len(updates) == 3
+        # A different fingerprint means the sources changed since
+        write_stamp({'sources': [], 'cache': [0, 0]})
+        assert update_rosdep(3600, update) is True
+        assert len(updates) == 4
+        # An update which finished while waiting for the lock is enough
+        write_stamp(read_stamp()['fingerprint'], now=time.time() + 60)
+        assert update_rosdep(None, update) is False
+        assert len(updates) == 4
+    finally:
+        if cache_dir is None:
+            del os.environ['BLOOM_CACHE_DIR']
+        else:
+            os.environ['BLOOM_CACHE_DIR'] = cache_dir
+        rmtree(tmp_dir)
+
+
+def test_ubuntu_targets():
+    tmp_dir = mkdtemp()
+    cache_dir = os.environ.get('BLOOM_CACHE_DIR')
+    os.environ['BLOOM_CACHE_DIR'] = tmp_dir
+    downloads = []
+
+    def download(rosdistro):
+        downloads.append(rosdistro)
+        return ['precise', 'quantal']
+
+    try:
+        from bloom import rosdep_cache
+        from bloom.rosdep_cache import clear_cache
+        from bloom.rosdep_cache import get_ubuntu_targets
+        fixture = os.path.join(os.path.dirname(__file__),
+                               'ubuntu_targets.yaml')
+        assert get_ubuntu_targets('groovy', targets_file=fixture) == \
+            ['oneiric', 'precise', 'quantal']
+        # The targets are downloaded once, then read from the cache
+        assert get_ubuntu_targets('groovy', download=download) == \
+            ['precise', 'quantal']
+        rosdep_cache._targets.clear()
+        assert get_ubuntu_targets('groovy', download=download) == \
+            ['precise', 'quantal']
+        assert downloads == ['groovy'], downloads
+        # Until the cache is cleared
+        removed = clear_cache(['targets'])
+        assert [os.path.basename(p) for p in removed] == \
+            ['ubuntu_targets.json'], removed
+        get_ubuntu_targets('groovy', download=download)
+        assert downloads == ['groovy', 'groovy'], downloads
+    finally:
+        if cache_dir is None:
+            del os.environ['BLOOM_CACHE_DIR']
+        else:
+            os.environ['BLOOM_CACHE_DIR'] = cache_dir
+        rmtree(tmp_dir)
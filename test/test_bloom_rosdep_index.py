@@ -0,0 +1,62 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+_rosdep = {
+    'precise': {'boost': ['libboost-all-dev'], 'python': ['python-dev'],
+                'roscpp': ['ros-groovy-roscpp'], 'bullet': None},
+    'quantal': {'boost': ['libboost-all-dev'], 'python': ['python-dev'],
+                'roscpp': ['ros-groovy-roscpp'],
+                'bullet': ['libbullet-dev', 'libbullet-extras-dev']}
+}
+
+
+def test_rosdep_index():
+    tmp_dir = mkdtemp()
+    cache_dir = os.environ.get('BLOOM_CACHE_DIR')
+    os.environ['BLOOM_CACHE_DIR'] = tmp_dir
+    calls = []
+
+    def resolve(rosdistro, os_name, codename):
+        calls.append(codename)
+        return _rosdep[codename]
+
+    try:
+        from bloom.rosdep_index import UnresolvedKey
+        from bloom.rosdep_index import get_rosdep_index
+        index = get_rosdep_index('groovy', ['precise'], resolve=resolve,
+                                 signature=[1, 2])
+        assert calls == ['precise'], calls
+        assert index.resolve(['boost', 'python'], 'precise') == \
+            set(['libboost-all-dev', 'python-dev'])
+        assert index.lookup('missing') is None
+        try:
+            index.resolve(['roscpp', 'bullet'], 'precise')
+            assert False, "an unresolved key did not raise"
+        except UnresolvedKey as err:
+            assert str(err) == 'bullet', err
+        # A new distro rebuilds the index with both distros
+        index = get_rosdep_index('groovy', ['quantal'], resolve=resolve,
+                                 signature=[1, 2])
+        assert sorted(calls) == ['precise', 'precise', 'quantal'], calls
+        assert index.codenames == ['precise', 'quantal']
+        assert index.lookup('bullet') == {
+            'precise': None,
+            'quantal': ['libbullet-dev', 'libbullet-extras-dev']}
+        # The index is reused, also from disk, until the signature changes
+        from bloom import rosdep_index
+        rosdep_index._indexes.clear()
+        index = get_rosdep_index('groovy', ['precise'], resolve=resolve,
+                                 signature=[1, 2])
+        assert len(calls) == 3, calls
+        assert index.resolve(['roscpp'], 'quantal') == \
+            set(['ros-groovy-roscpp'])
+        get_rosdep_index('groovy', ['precise'], resolve=resolve,
+                         signature=[1, 3])
+        assert len(calls) == 4, calls
+    finally:
+        if cache_dir is None:
+            del os.environ['BLOOM_CACHE_DIR']
+        else:
+            os.environ['BLOOM_CACHE_DIR'] = cache_dir
+        rmtree(tmp_dir)
@@ -0,0 +1,86 @@
+import os
+import time
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+
+from export_bloom_from_src import get_path_and_pythonpath
+# Setup environment for running commands
+path, ppath = get_path_and_pythonpath()
+os.putenv('PATH', path)
+os.putenv('PYTHONPATH', ppath)
+
+
+def _run(cmd, cwd, env):
+    p = Popen(cmd, shell=True, cwd=cwd, env=env, stdin=PIPE, stdout=PIPE,
+              stderr=PIPE)
+    out, err = p.communicate('')
+    return p.returncode, out, err
+
+
+def test_serve():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import check_call
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    socket_path = os.path.join(tmp_dir, 'bloom.sock')
+    env = dict(os.environ)
+    env.update({'PATH': path, 'PYTHONPATH': ppath,
+                'BLOOM_SERVER_SOCKET': socket_path})
+    local_env = dict(env)
+    local_env['BLOOM_NO_SERVER'] = '1'
+    server = Popen(['git-bloom-serve'], env=env, stdout=PIPE, stderr=PIPE)
+    try:
+        for i in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+        assert os.path.exists(socket_path), server.stderr.read()
+        # The forwarded commands behave like the local ones
+        for cmd, cwd in [('git-bloom-patch export -h', git_dir),
+                         ('git-bloom-patch export', tmp_dir),
+                         ('git-bloom-config', git_dir)]:
+            forwarded = _run(cmd, cwd, env)
+            local = _run(cmd, cwd, local_env)
+            assert forwarded == local, (cmd, forwarded, local)
+        # A client which does not send its command does not hold up others
+        import socket
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(socket_path)
+        try:
+            cmd = 'git-bloom-patch export -h'
+            p = Popen(cmd, shell=True, cwd=git_dir, env=env, stdin=PIPE,
+                      stdout=PIPE, stderr=PIPE)
+            p.stdin.close()
+            for i in range(200):
+                if p.poll() is not None:
+                    break
+                time.sleep(0.05)
+            assert p.poll() == 0, "the idle client blocked the server"
+        finally:
+            idle.close()
+        # A second server does not replace the running one
+        assert _run('git-bloom-serve', tmp_dir, env)[0] == 1
+    finally:
+        server.terminate()
+        server.wait()
+    assert not os.path.exists(socket_path)
+    rmtree(tmp_dir)
+
+
+def test_check_private():
+    tmp_dir = mkdtemp()
+    socket_path = os.path.join(tmp_dir, 'bloom.sock')
+    from bloom.server import check_private
+    from bloom.server import serve
+    assert check_private(socket_path) is None
+    # Other users could replace the socket of a shared directory
+    os.chmod(tmp_dir, 0o755)
+    assert 'mode 0700' in check_private(socket_path)
+    assert serve(tmp_dir, socket_path) == 1
+    assert not os.path.exists(socket_path)
+    os.chmod(tmp_dir, 0o700)
+    open(socket_path, 'w').close()
+    assert 'not a socket' in check_private(socket_path)
+    rmtree(tmp_dir)
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+
+from export_bloom_from_src import get_path_and_pythonpath
+# Setup environment for running commands
+path, ppath = get_path_and_pythonpath()
+os.putenv('PATH', path)
+os.putenv('PYTHONPATH', ppath)
+
+# Modules which are slow to import and must only be imported on first use
+_heavy_modules = ['catkin_pkg', 'dateutil', 'distutils', 'em',
+                  'pkg_resources', 'rosdep2', 'rospkg', 'vcstools']
+
+# Seconds allowed for a warm start of git-bloom-patch export -h: a new
+# interpreter, but with the .pyc files written and the files in the OS cache
+_startup_budget = float(os.environ.get('BLOOM_STARTUP_BUDGET', '0.25'))
+
+
+def _importtime_report(stderr, count=10):
+    """Returns the slowest cumulative imports from -X importtime output"""
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times.append((int(fields[1]), fields[2].rstrip()))
+        except ValueError:
+            continue
+    times.sort(reverse=True)
+    return '\n'.join('{0:>10} us {1}'.format(*t) for t in times[:count])
+
+
+def test_lazy_imports():
+    modules = ['bloom.patch.patch_main', 'bloom.config',
+               'bloom.branch.branch_main', 'bloom.import_upstream',
+               'bloom.generators.debian.main_all']
+    code = 'import sys\nimport {0}\n' \
+           'print(" ".join(sorted(sys.modules)))'.format(', '.join(modules))
+    p = Popen([sys.executable, '-c', code], stdout=PIPE, stderr=PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    loaded = set(m.split('.')[0] for m in out.split())
+    eager = [m for m in _heavy_modules if m in loaded]
+    assert eager == [], "Imported at startup: " + ', '.join(eager)
+
+
+def test_patch_startup_budget():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import check_call
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    script = os.path.join(os.path.dirname(__file__), '..', 'bin',
+                          'git-bloom-patch')
+    cmd = [sys.executable]
+    if sys.version_info >= (3, 7):
+        cmd += ['-X', 'importtime']
+    cmd += [os.path.abspath(script), 'export', '-h']
+    # Best of three, the first run warms the .pyc files and the OS cache, so
+    # this is not a cold start
+    best = None
+    for i in range(3):
+        start = time.time()
+        p = Popen(cmd, cwd=git_dir, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+        elapsed = time.time() - start
+        assert p.returncode == 0, err
+        if best is None or elapsed < best[0]:
+            best = (elapsed, err)
+    rmtree(tmp_dir)
+    assert best[0] <= _startup_budget, \
+        "A warm git-bloom-patch export -h took {0:.3f}s, the budget is " \
+        "{1}s\n{2}" \
+        .format(best[0], _startup_budget, _importtime_report(best[1]))
@@ -0,0 +1,69 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+
+def test_parse_tag():
+    from bloom.tag_index import parse_tag
+    record = parse_tag('upstream/0.3.5', 10)
+    assert record.version == '0.3.5' and record.package == None, record
+    assert record.date == 10, record
+    record = parse_tag('debian/ros-groovy-foo-bar_0.3.5-2_precise')
+    assert record.package == 'ros-groovy-foo-bar', record
+    assert record.version == '0.3.5', record
+    assert record.revision == '2', record
+    assert record.distro == 'precise', record
+    assert parse_tag('debian/groovy/foo/0.3.5') == None
+    assert parse_tag('release/foo/0.3.5') == None
+
+
+def test_get_tag_index():
+    tmp_dir = mkdtemp()
+    git_dir = os.path.join(tmp_dir, 'repo')
+    os.makedirs(git_dir)
+    from subprocess import check_call, PIPE
+    check_call('git init .', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('touch example.txt', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git add *', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git commit -m "Init"', shell=True, cwd=git_dir, stdout=PIPE)
+    from bloom.tag_index import get_tag_index
+    index = get_tag_index(git_dir)
+    assert index.latest_upstream() == None
+    for tag in ['upstream/0.9.0', 'upstream/0.10.0',
+                'debian/foo_0.9.0-0_lucid', 'debian/foo_0.10.0-0_lucid',
+                'debian/foo_0.10.0-1_lucid', 'debian/foo_0.10.0-1_oneiric',
+                'debian/bar_0.10.0-0_lucid']:
+        check_call('git tag ' + tag, shell=True, cwd=git_dir, stdout=PIPE)
+    index = get_tag_index(git_dir)
+    # Lightweight tags have no date, so this is the same as sorting by name
+    assert index.latest_upstream().name == 'upstream/0.9.0'
+    assert index.latest_upstream_by_version().name == 'upstream/0.10.0'
+    assert index.latest_upstream_by_version('0.10.0').name == 'upstream/0.9.0'
+    assert index.upstream_tag('0.10.0').name == 'upstream/0.10.0'
+    assert index.upstream_tag('0.11.0') == None
+    assert [r.name for r in index.tags_for_package('foo')] == [
+        'debian/foo_0.9.0-0_lucid', 'debian/foo_0.10.0-0_lucid',
+        'debian/foo_0.10.0-1_lucid', 'debian/foo_0.10.0-1_oneiric']
+    record = index.latest_for_package('foo', 'lucid')
+    assert record.name == 'debian/foo_0.10.0-1_lucid', record
+    record = index.latest_for_package('foo')
+    assert record.name == 'debian/foo_0.10.0-1_oneiric', record
+    assert index.latest_for_package('bar', 'oneiric') == None
+    assert index.latest_for_package('baz') == None
+    # A loose tag changed without touching its directory is seen
+    tags_dir = os.path.join(git_dir, '.git', 'refs', 'tags', 'debian')
+    os.utime(tags_dir, (1000, 1000))
+    assert get_tag_index(git_dir).latest_for_package('foo') == record
+    os.remove(os.path.join(tags_dir, 'foo_0.10.0-1_oneiric'))
+    os.utime(tags_dir, (1000, 1000))
+    index = get_tag_index(git_dir)
+    record = index.latest_for_package('foo')
+    assert record.name == 'debian/foo_0.10.0-1_lucid', record
+    # The cached index is reused until the tags change
+    assert get_tag_index(git_dir) is index
+    check_call('git pack-refs --all', shell=True, cwd=git_dir, stdout=PIPE)
+    check_call('git tag -d upstream/0.9.0', shell=True, cwd=git_dir,
+               stdout=PIPE)
+    index = get_tag_index(git_dir)
+    assert index.latest_upstream().name == 'upstream/0.10.0'
+    rmtree(tmp_dir)